@@ -0,0 +1,127 @@
+"""Compressed and deduplicated KVStore
+
+Revision ID: 0c5a7e3d9f14
+Revises: 93f021fa65a2
+Create Date: 2026-10-16 14:00:00.000000
+
+"""
+import json
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+import tqdm
+
+from qcfractal.storage_sockets.storage_utils import compress_kvstore_value, decompress_kvstore_value
+
+# revision identifiers, used by Alembic.
+revision = "0c5a7e3d9f14"
+down_revision = "93f021fa65a2"
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger("alembic")
+
+block_size = 1000
+reference_columns = ["stdout", "stderr", "error"]
+
+
+def upgrade():
+    op.add_column("kv_store", sa.Column("compression", sa.String(), nullable=True))
+    op.add_column("kv_store", sa.Column("hash", sa.String(length=64), nullable=True))
+    op.add_column("kv_store", sa.Column("refcount", sa.Integer(), server_default="1", nullable=False))
+    op.add_column("kv_store", sa.Column("data", sa.LargeBinary(), nullable=True))
+    op.alter_column("kv_store", "value", existing_type=sa.JSON(), nullable=True)
+    op.create_index("ix_kv_store_hash", "kv_store", ["hash"], unique=True)
+
+    # Repointing duplicates looks up the results referencing them
+    for col in reference_columns:
+        op.create_index(f"ix_tmp_base_result_{col}", "base_result", [col])
+
+    connection = op.get_bind()
+    num_records = connection.execute("SELECT count(*) FROM kv_store").scalar()
+
+    logger.info("Compressing and deduplicating kv_store, this may take some time...")
+    with tqdm.tqdm(total=num_records) as progress:
+        while True:
+            rows = connection.execute(
+                sa.text("SELECT id, value FROM kv_store WHERE hash IS NULL ORDER BY id LIMIT :limit"),
+                limit=block_size,
+            ).fetchall()
+            if not rows:
+                break
+
+            entries = {}
+            for blob_id, value in rows:
+                data, compression, digest = compress_kvstore_value(value)
+                entries.setdefault(digest, {"compression": compression, "data": data, "ids": []})["ids"].append(blob_id)
+
+            stored = dict(
+                connection.execute(
+                    sa.text("SELECT hash, id FROM kv_store WHERE hash IN :hashes").bindparams(
+                        sa.bindparam("hashes", expanding=True)
+                    ),
+                    hashes=list(entries),
+                ).fetchall()
+            )
+
+            canonical = []
+            duplicates = []
+            for digest, entry in entries.items():
+                ids = entry["ids"]
+                if digest not in stored:
+                    canonical.append(
+                        {"id": ids[0], "hash": digest, "compression": entry["compression"], "data": entry["data"]}
+                    )
+                    stored[digest] = ids[0]
+                    ids = ids[1:]
+
+                duplicates.extend({"dup": x, "canon": stored[digest]} for x in ids)
+
+            if canonical:
+                connection.execute(
+                    sa.text(
+                        "UPDATE kv_store SET hash = :hash, compression = :compression, data = :data, "
+                        "refcount = 1, value = NULL WHERE id = :id"
+                    ),
+                    canonical,
+                )
+
+            if duplicates:
+                for col in reference_columns:
+                    connection.execute(sa.text(f"UPDATE base_result SET {col} = :canon WHERE {col} = :dup"), duplicates)
+                connection.execute(sa.text("UPDATE kv_store SET refcount = refcount + 1 WHERE id = :canon"), duplicates)
+                connection.execute(sa.text("DELETE FROM kv_store WHERE id = :dup"), duplicates)
+
+            progress.update(len(rows))
+
+    for col in reference_columns:
+        op.drop_index(f"ix_tmp_base_result_{col}", table_name="base_result")
+
+
+def downgrade():
+    connection = op.get_bind()
+
+    # Deduplicated entries are restored as shared rows, values are simply decompressed in place
+    while True:
+        rows = connection.execute(
+            sa.text("SELECT id, compression, data FROM kv_store WHERE value IS NULL ORDER BY id LIMIT :limit"),
+            limit=block_size,
+        ).fetchall()
+        if not rows:
+            break
+
+        connection.execute(
+            sa.text("UPDATE kv_store SET value = CAST(:value AS json) WHERE id = :id"),
+            [
+                {"id": blob_id, "value": json.dumps(decompress_kvstore_value(data, compression))}
+                for blob_id, compression, data in rows
+            ],
+        )
+
+    op.drop_index("ix_kv_store_hash", table_name="kv_store")
+    op.alter_column("kv_store", "value", existing_type=sa.JSON(), nullable=False)
+    op.drop_column("kv_store", "data")
+    op.drop_column("kv_store", "refcount")
+    op.drop_column("kv_store", "hash")
+    op.drop_column("kv_store", "compression")
@@ -0,0 +1,44 @@
+"""Incremental result state counters
+
+Revision ID: 93f021fa65a2
+Revises: 4b27843a188a
+Create Date: 2026-10-16 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from qcfractal.storage_sockets.models.results_models import result_state_count_ddl
+
+# revision identifiers, used by Alembic.
+revision = "93f021fa65a2"
+down_revision = "4b27843a188a"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "result_state_count",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("result_type", sa.String(), nullable=True),
+        sa.Column("status", sa.String(), nullable=True),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+    # Seed the counters with the existing results, then keep them up to date with the triggers
+    op.execute("LOCK TABLE base_result IN SHARE MODE")
+    op.execute(
+        "INSERT INTO result_state_count (result_type, status, count) "
+        "SELECT result_type, status::text, count(*) FROM base_result GROUP BY 1, 2"
+    )
+    op.execute(result_state_count_ddl)
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS base_result_state_count_insert ON base_result")
+    op.execute("DROP TRIGGER IF EXISTS base_result_state_count_update ON base_result")
+    op.execute("DROP TRIGGER IF EXISTS base_result_state_count_delete ON base_result")
+    op.execute("DROP FUNCTION IF EXISTS result_state_count_delta()")
+    op.drop_table("result_state_count")
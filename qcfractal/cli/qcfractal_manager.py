@@ -140,6 +140,11 @@ class FractalServerSettings(AutodocBaseSettings):
         None, description="Password to authenticate to the Fractal Server with (alongside the `username`)"
     )
     verify: Optional[bool] = Field(None, description="Use Server-side generated SSL certification or not.")
+    compression: Optional[str] = Field(
+        None,
+        description="Compress large uploads of completed tasks with this Content-Encoding, `zstd` (requires the "
+        "`zstandard` package) or `gzip`. Ignored if the Fractal Server does not accept the encoding.",
+    )
 
     class Config(SettingsCommonConfig):
         pass
@@ -206,6 +211,51 @@ class QueueManagerSettings(AutodocBaseSettings):
         "fill your maximum throughput with a buffer (assuming the queue has them).",
         gt=0,
     )
+    pipelined: bool = Field(
+        False,
+        description="Push completed tasks to the Fractal Server from a background thread and refill freed task slots "
+        "from a local buffer of prefetched tasks every `refill_frequency` seconds instead of waiting for the "
+        "next update. Recommended when tasks finish much faster than the `update_frequency`.",
+    )
+    prefetch_tasks: int = Field(
+        0,
+        description="Number of tasks to pull from the Fractal Server beyond the open task slots and keep in a local "
+        "buffer when `pipelined` is set. Prefetched tasks are returned to the server on shutdown.",
+        ge=0,
+    )
+    refill_frequency: float = Field(
+        1,
+        description="Time between checks for completed tasks and refills from the prefetch buffer when `pipelined` "
+        "is set. These checks do not wait on the Fractal Server. Units of seconds",
+        gt=0,
+    )
+    task_wait: Optional[float] = Field(
+        None,
+        description="When no tasks are available, have the Fractal Server hold the request for new tasks up to this "
+        "many seconds until tasks are submitted, instead of waiting for the next update. The server may "
+        "limit the wait. Cannot be used together with `pipelined`. Units of seconds",
+        gt=0,
+    )
+    exchange: bool = Field(
+        False,
+        description="Return completed tasks and pull new tasks in a single request to the Fractal Server instead of "
+        "separate requests. Requires a server supporting the exchange endpoint. Not used together with "
+        "`pipelined` or `task_wait`.",
+    )
+    journal_directory: Optional[str] = Field(
+        None,
+        description="Folder of an on-disk journal in which completed tasks are recorded before they are pushed to the "
+        "Fractal Server. Tasks that were never delivered, e.g. after a crash or preemption of the Manager, "
+        "are pushed on the next start. Each Manager needs its own folder, a folder next to the "
+        "`scratch_directory` is a good choice. If `None`, no journal is kept.",
+    )
+    upload_chunk_size: Optional[int] = Field(
+        2 ** 25,
+        description="Maximum size of a single upload of completed tasks to the Fractal Server. Larger uploads are "
+        "split into chunks which are acknowledged and retried on their own, which keeps uploads below proxy "
+        "limits. A task larger than this is uploaded alone. If `None`, uploads are never split. Units of bytes",
+        gt=0,
+    )
 
 
 class SchedulerEnum(str, Enum):
@@ -567,6 +617,15 @@ def parse_args():
         type=int,
         help="Maximum number of tasks to hold at any given time. " "Generally should not be set.",
     )
+    manager.add_argument(
+        "--pipelined",
+        action="store_true",
+        default=None,
+        help="Push results in the background and refill task slots from a prefetch buffer.",
+    )
+    manager.add_argument(
+        "--prefetch-tasks", type=int, help="Number of tasks to prefetch beyond the open slots in pipelined mode."
+    )
 
     # Additional args
     optional = parser.add_argument_group("Optional Settings")
@@ -625,7 +684,17 @@ def parse_args():
         "server": _build_subset(args, {"fractal_uri", "password", "username", "verify"}),
         "manager": _build_subset(
             args,
-            {"max_queued_tasks", "manager_name", "queue_tag", "log_file_prefix", "update_frequency", "test", "ntests"},
+            {
+                "max_queued_tasks",
+                "manager_name",
+                "queue_tag",
+                "log_file_prefix",
+                "update_frequency",
+                "pipelined",
+                "prefetch_tasks",
+                "test",
+                "ntests",
+            },
         ),
         # This set is for this script only, items here should not be passed to the ManagerSettings nor any other
         # classes
@@ -978,6 +1047,13 @@ def main(args=None):
         queue_tag=settings.manager.queue_tag,
         manager_name=settings.manager.manager_name,
         update_frequency=settings.manager.update_frequency,
+        pipelined=settings.manager.pipelined,
+        prefetch_tasks=settings.manager.prefetch_tasks,
+        refill_frequency=settings.manager.refill_frequency,
+        task_wait=settings.manager.task_wait,
+        exchange=settings.manager.exchange,
+        journal_directory=settings.manager.journal_directory,
+        upload_chunk_size=settings.manager.upload_chunk_size,
         cores_per_task=cores_per_task,
         memory_per_task=memory_per_task,
         nodes_per_task=settings.common.nodes_per_task,
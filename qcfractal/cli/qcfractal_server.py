@@ -76,9 +76,9 @@ def parse_args():
     start = subparsers.add_parser("start", help="Starts a QCFractal server instance.")
     start.add_argument("--base-folder", **FractalConfig.help_info("base_folder"))
 
-    # Allow port and logfile to be altered on the fly
+    # Allow port, logfile, and workers to be altered on the fly
     fractal_args = start.add_argument_group("Server Settings")
-    for field in ["port", "logfile"]:
+    for field in ["port", "logfile", "workers"]:
         cli_name = "--" + field.replace("_", "-")
         fractal_args.add_argument(cli_name, **FractalServerSettings.help_info(field))
 
@@ -371,12 +371,20 @@ def server_start(args, config):
     # make sure DB is created
     psql.create_database(config.database.database_name)
 
+    api_concurrency = {}
+    if config.fractal.queue_manager_concurrency is not None:
+        api_concurrency["queue_manager"] = config.fractal.queue_manager_concurrency
+
     print("\n>>> Initializing the QCFractal server...")
     try:
         server = qcfractal.FractalServer(
             name=args.get("server_name", None) or config.fractal.name,
             port=config.fractal.port,
             compress_response=config.fractal.compress_response,
+            workers=config.fractal.workers,
+            api_workers=config.fractal.api_workers,
+            queue_api_workers=config.fractal.queue_api_workers,
+            api_concurrency=api_concurrency,
             # Security
             security=config.fractal.security,
             allow_read=config.fractal.allow_read,
@@ -384,6 +392,9 @@ def server_start(args, config):
             # Database
             storage_uri=config.database_uri(safe=False, database=""),
             storage_project_name=config.database.database_name,
+            storage_replica_uris=config.database.read_replicas,
+            storage_replica_max_lag=config.database.replica_max_lag,
+            storage_pools=config.database.pools,
             query_limit=config.fractal.query_limit,
             # Collection views
             view_enabled=config.view.enable,
@@ -395,6 +406,8 @@ def server_start(args, config):
             # Queue options
             service_frequency=config.fractal.service_frequency,
             heartbeat_frequency=config.fractal.heartbeat_frequency,
+            max_task_wait=config.fractal.max_task_wait,
+            queue_notify=config.fractal.queue_notify,
             max_active_services=config.fractal.max_active_services,
             queue_socket=adapter,
         )
@@ -108,3 +108,37 @@ def task_graph():
     )
 
     return fig
+
+
+def result_state_graph():
+
+    socket = get_socket()
+
+    stats = socket.get_server_stats_log(limit=1)["data"]
+    result_states = (stats[0].get("result_states") or {}) if stats else {}
+
+    bar_iter = [
+        ("COMPLETE", DEFAULT_PLOTLY_COLORS[0]),
+        ("INCOMPLETE", DEFAULT_PLOTLY_COLORS[1]),
+        ("RUNNING", DEFAULT_PLOTLY_COLORS[2]),
+        ("ERROR", DEFAULT_PLOTLY_COLORS[3]),
+    ]
+
+    order = sorted(result_states)
+    bars = []
+    for status, color in bar_iter:
+        bar_data = [result_states[result_type].get(status, 0) for result_type in order]
+        bars.append(go.Bar(name=status.title(), x=order, y=bar_data, marker_color=color))
+
+    fig = go.Figure(
+        data=bars,
+        layout={
+            "barmode": "group",
+            "yaxis_type": "log",
+            "yaxis": {"title": "Results"},
+            "xaxis": {"title": "Result Type"},
+            "margin": _default_margin,
+        },
+    )
+
+    return fig
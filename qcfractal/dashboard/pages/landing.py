@@ -8,7 +8,7 @@ from flask import current_app
 
 from ..app import app
 from ..connection import get_socket
-from ..dash_models import list_managers, manager_graph, task_graph
+from ..dash_models import list_managers, manager_graph, result_state_graph, task_graph
 
 ## Layout
 
@@ -42,15 +42,18 @@ def update_server_information(status):
 **Query Limit:** {config.fractal.query_limit}
             """
     )
-    database = dcc.Markdown(
-        f"""
+    database = [
+        dcc.Markdown(
+            f"""
 **Name:** {config.database.database_name}
 
 **Port:** {config.database.port}
 
 **Host:** {config.database.host}
         """
-    )
+        ),
+        dcc.Graph(figure=result_state_graph()),
+    ]
 
     queue = dcc.Graph(figure=task_graph())
     return server, database, queue
@@ -0,0 +1,196 @@
+"""
+A persistent on-disk cache of immutable server objects for the FractalClient.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List
+
+from qcelemental.util import deserialize, serialize
+
+__all__ = ["ClientCache"]
+
+_cache_filename = "qcportal_cache.sqlite"
+
+# SQLite limits the number of bound parameters of a single statement
+_max_params = 500
+
+
+class ClientCache:
+    """
+    A least recently used cache of immutable server objects stored in a local SQLite file.
+
+    Entries are keyed by server address, object kind and object id so a single file may be
+    shared between several servers and sessions.
+    """
+
+    def __init__(self, path: str, address: str, max_size: int = 2 ** 30) -> None:
+        """
+        Parameters
+        ----------
+        path : str
+            The cache file, or an existing folder in which the cache file is placed.
+        address : str
+            The address of the server the cached objects belong to.
+        max_size : int, optional
+            The maximum size of the cached data in bytes. Least recently used entries are
+            evicted once the cache grows past this size.
+        """
+
+        path = os.path.expanduser(path)
+        if os.path.isdir(path):
+            path = os.path.join(path, _cache_filename)
+
+        self.path = path
+        self.address = address
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def __repr__(self) -> str:
+
+        return f"ClientCache(path='{self.path}', address='{self.address}', max_size={self.max_size})"
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state.pop("_lock")
+        state["_conn"] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS objects (address TEXT NOT NULL, kind TEXT NOT NULL, id TEXT NOT NULL, "
+                "data BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (address, kind, id))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_objects_accessed ON objects (accessed)")
+            conn.commit()
+            self._conn = conn
+
+        return self._conn
+
+    def get(self, kind: str, ids: List[str]) -> Dict[str, Any]:
+        """Looks up objects in the cache and marks them as recently used.
+
+        Parameters
+        ----------
+        kind : str
+            The kind of object, e.g. "molecule".
+        ids : List[str]
+            The ids of the objects to look up.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The found objects in {"id": data} format, ids missing from the cache are absent.
+        """
+
+        ids = list(dict.fromkeys(str(x) for x in ids))
+
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for i in range(0, len(ids), _max_params):
+                    chunk = ids[i : i + _max_params]
+                    placeholders = ", ".join("?" * len(chunk))
+                    rows = conn.execute(
+                        f"SELECT id, data FROM objects WHERE address = ? AND kind = ? AND id IN ({placeholders})",
+                        [self.address, kind, *chunk],
+                    )
+                    found.update(rows)
+
+                now = time.time()
+                conn.executemany(
+                    "UPDATE objects SET accessed = ? WHERE address = ? AND kind = ? AND id = ?",
+                    [(now, self.address, kind, x) for x in found],
+                )
+
+            self.hits += len(found)
+            self.misses += len(ids) - len(found)
+
+        return {k: deserialize(v, "msgpack-ext") for k, v in found.items()}
+
+    def put(self, kind: str, objects: Dict[str, Any]) -> None:
+        """Adds objects to the cache, evicting the least recently used entries if the cache is full.
+
+        Parameters
+        ----------
+        kind : str
+            The kind of object, e.g. "molecule".
+        objects : Dict[str, Any]
+            The objects to add in {"id": data} format. The data must be serializable with msgpack-ext.
+        """
+
+        if not objects:
+            return
+
+        now = time.time()
+        rows = []
+        for k, v in objects.items():
+            blob = serialize(v, "msgpack-ext")
+            rows.append((self.address, kind, str(k), blob, len(blob), now))
+
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)", rows)
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0] - self.max_size
+        if excess <= 0:
+            return
+
+        evict = []
+        for rowid, size in conn.execute("SELECT rowid, size FROM objects ORDER BY accessed").fetchall():
+            if excess <= 0:
+                break
+            evict.append((rowid,))
+            excess -= size
+
+        conn.executemany("DELETE FROM objects WHERE rowid = ?", evict)
+        self.evictions += len(evict)
+
+    def clear(self) -> None:
+        """Removes all objects of this server from the cache."""
+
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM objects WHERE address = ?", (self.address,))
+
+    def statistics(self) -> Dict[str, Any]:
+        """Returns the cache hit metrics of this session and the current size of the cache.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The number of hits, misses and evictions, the hit rate and the number of entries and bytes stored.
+        """
+
+        with self._lock:
+            entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects").fetchone()
+
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "size": size,
+            }
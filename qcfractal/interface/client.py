@@ -3,30 +3,28 @@
 import json
 import os
 import re
+import threading
 from collections import defaultdict
-from typing import TYPE_CHECKING, Any, DefaultDict, Dict, List, Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, DefaultDict, Dict, List, Optional, Tuple, Union
 
 import pandas as pd
 import requests
 from pydantic import ValidationError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from .cache import ClientCache
 from .collections import collection_factory, collections_name_map
-from .models import build_procedure
+from .models import KeywordSet, Molecule, ResultRecord, build_procedure
 from .models.rest_models import rest_model
+from .util import body_encodings, compress_body
 
 if TYPE_CHECKING:  # pragma: no cover
     from qcfractal import FractalServer
 
     from .collections.collection import Collection
-    from .models import (
-        GridOptimizationInput,
-        KeywordSet,
-        Molecule,
-        ObjectId,
-        ResultRecord,
-        TaskRecord,
-        TorsionDriveInput,
-    )
+    from .models import GridOptimizationInput, ObjectId, TaskRecord, TorsionDriveInput
     from .models.rest_models import (
         CollectionGETResponse,
         ComputeResponse,
@@ -50,6 +48,9 @@ _ssl_error_msg = (
 )
 _connection_error_msg = "\n\nCould not connect to server {}, please check the address and try again."
 
+# Smaller request bodies are not worth compressing
+_compression_threshold = 2 ** 16
+
 ### Helper functions
 
 
@@ -74,6 +75,13 @@ class FractalClient(object):
         username: Optional[str] = None,
         password: Optional[str] = None,
         verify: bool = True,
+        pool_size: int = 10,
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+        max_in_flight: int = 4,
+        cache_path: Optional[str] = None,
+        cache_max_size: int = 2 ** 30,
+        compression: Optional[str] = None,
     ) -> None:
         """Initializes a FractalClient instance from an address and verification information.
 
@@ -90,6 +98,22 @@ class FractalClient(object):
             Verifies the SSL connection with a third party server. This may be False if a
             FractalServer was not provided a SSL certificate and defaults back to self-signed
             SSL keys.
+        pool_size : int, optional
+            The maximum number of persistent connections kept open to the server.
+        retries : int, optional
+            The number of times a failed connection or idempotent request is retried.
+        backoff_factor : float, optional
+            The exponential backoff factor (in seconds) between retries.
+        max_in_flight : int, optional
+            The maximum number of concurrent requests made when fetching large queries in chunks.
+        cache_path : Optional[str], optional
+            A file or folder for a persistent cache of immutable objects (Molecules, KeywordSets, KVStore
+            entries and COMPLETE records). Queries by id are served from the cache first. No cache is used if None.
+        cache_max_size : int, optional
+            The maximum size of the cache in bytes, least recently used objects are evicted past it.
+        compression : Optional[str], optional
+            Compress large request bodies with this Content-Encoding, "zstd" or "gzip". Only used if the
+            server reports that it accepts the encoding. No request is compressed if None.
         """
 
         if hasattr(address, "get_address"):
@@ -113,6 +137,10 @@ class FractalClient(object):
         self._headers: Dict[str, str] = {}
         self.encoding = "msgpack-ext"
 
+        if (compression is not None) and (compression not in body_encodings()):
+            raise ValueError(f"Compression '{compression}' is not available, choose from {body_encodings()}.")
+        self.compression = compression
+
         # Mode toggle for network error testing, not public facing
         self._mock_network_error = False
 
@@ -132,6 +160,21 @@ class FractalClient(object):
         self._headers["User-Agent"] = f"qcportal/{__version__}"
 
         self._request_counter: DefaultDict[Tuple[str, str], int] = defaultdict(int)
+        self._request_counter_lock = threading.Lock()
+
+        # Connections are pooled and kept alive, every thread gets its own session over the shared pool
+        self._pool_size = pool_size
+        self._retries = retries
+        self._backoff_factor = backoff_factor
+        self._build_adapter()
+
+        # Worker pool for chunked requests, created on first use
+        self._max_in_flight = max_in_flight
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        self.cache: Optional[ClientCache] = None
+        if cache_path is not None:
+            self.cache = ClientCache(cache_path, self.address, max_size=cache_max_size)
 
         ### Define all attributes before this line
 
@@ -141,6 +184,10 @@ class FractalClient(object):
         self.server_name = self.server_info["name"]
         self.query_limit: int = self.server_info["query_limit"]
 
+        # Older servers do not decode compressed bodies
+        if self.compression not in self.server_info.get("request_encodings", []):
+            self.compression = None
+
         if _isportal:
             try:
                 server_version_min_client = _version_list(self.server_info["client_lower_version_limit"])[:2]
@@ -195,6 +242,104 @@ class FractalClient(object):
 </ul>
 """
 
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state.pop("_adapter")
+        state.pop("_local")
+        state.pop("_sessions")
+        state.pop("_sessions_lock")
+        state.pop("_request_counter_lock")
+        state["_executor"] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._request_counter_lock = threading.Lock()
+        self._build_adapter()
+
+    def _build_adapter(self) -> None:
+        retry = Retry(
+            total=self._retries,
+            backoff_factor=self._backoff_factor,
+            status_forcelist=[502, 503, 504],
+            raise_on_status=False,
+        )
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size, max_retries=retry)
+        self._local = threading.local()
+        self._sessions: List[requests.Session] = []
+        self._sessions_lock = threading.Lock()
+
+    def _get_session(self) -> requests.Session:
+        """Returns the calling thread's session, all sessions share a single connection pool."""
+
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", self._adapter)
+            session.mount("https://", self._adapter)
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+
+        return session
+
+    def close(self) -> None:
+        """Closes the sessions of all threads and their pooled connections, and shuts down the chunk worker pool.
+
+        The client stays usable, new sessions are opened by the next requests.
+        """
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+        with self._sessions_lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+
+        # Sessions of other threads are closed, drop them so that no thread reuses one
+        self._local = threading.local()
+        self._adapter.close()
+
+    def map_chunks(
+        self, func: Callable[[List[Any]], Any], items: List[Any], chunk_size: Optional[int] = None
+    ) -> List[Any]:
+        """Calls ``func`` on consecutive chunks of ``items``, up to ``max_in_flight`` chunks at a time.
+
+        Parameters
+        ----------
+        func : Callable[[List[Any]], Any]
+            The function to call on each chunk, usually a client query.
+        items : List[Any]
+            The items to split into chunks.
+        chunk_size : Optional[int], optional
+            The size of each chunk, defaults to the server query limit.
+
+        Returns
+        -------
+        List[Any]
+            The return value of ``func`` for each chunk in the order of the chunks.
+        """
+
+        if chunk_size is None:
+            chunk_size = self.query_limit
+
+        chunks = [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+        # Nested calls from a worker run serially so the pool can never deadlock on itself
+        if (len(chunks) < 2) or (self._max_in_flight < 2) or getattr(self._local, "in_pool", False):
+            return [func(chunk) for chunk in chunks]
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_in_flight, thread_name_prefix="fractal_client")
+
+        def run_chunk(chunk):
+            self._local.in_pool = True
+            return func(chunk)
+
+        return list(self._executor.map(run_chunk, chunks))
+
     def _set_encoding(self, encoding: str) -> None:
         self.encoding = encoding
         self._headers["Content-Type"] = f"application/{self.encoding}"
@@ -210,20 +355,28 @@ class FractalClient(object):
     ) -> requests.Response:
 
         addr = self.address + service
-        kwargs = {"data": data, "timeout": timeout, "headers": self._headers, "verify": self._verify}
+        headers = self._headers
+        if (self.compression is not None) and (data is not None) and (len(data) >= _compression_threshold):
+            if isinstance(data, str):
+                data = data.encode()
+            data = compress_body(data, self.compression)
+            headers = {**headers, "Content-Encoding": self.compression}
+
+        kwargs = {"data": data, "timeout": timeout, "headers": headers, "verify": self._verify}
 
         if self._mock_network_error:
             raise requests.exceptions.RequestException("mock_network_error is on, failing by design!")
 
+        session = self._get_session()
         try:
             if method == "get":
-                r = requests.get(addr, **kwargs)
+                r = session.get(addr, **kwargs)
             elif method == "post":
-                r = requests.post(addr, **kwargs)
+                r = session.post(addr, **kwargs)
             elif method == "put":
-                r = requests.put(addr, **kwargs)
+                r = session.put(addr, **kwargs)
             elif method == "delete":
-                r = requests.delete(addr, **kwargs)
+                r = session.delete(addr, **kwargs)
             else:
                 raise KeyError("Method not understood: '{}'".format(method))
         except requests.exceptions.SSLError:
@@ -260,7 +413,8 @@ class FractalClient(object):
             The REST response object
         """
         sname = name.strip("/")
-        self._request_counter[(sname, rest)] += 1
+        with self._request_counter_lock:
+            self._request_counter[(sname, rest)] += 1
 
         body_model, response_model = rest_model(sname, rest)
 
@@ -279,6 +433,67 @@ class FractalClient(object):
         else:
             return response.data
 
+    def _use_cache(self, id: Any, full_return: bool, *filters: Any) -> bool:
+        """Whether a query may be served from the cache, only plain queries by id are."""
+
+        return (self.cache is not None) and (id is not None) and (not full_return) and all(x is None for x in filters)
+
+    def _query_cached(
+        self,
+        kind: str,
+        ids: "QueryObjectId",
+        fetch: Callable[[List[str]], Dict[str, Any]],
+        build: Optional[Callable[[Dict[str, Any]], Any]] = None,
+        cacheable: Optional[Callable[[Any], bool]] = None,
+    ) -> Dict[str, Any]:
+        """Looks up objects in the cache and only fetches the cache misses from the server.
+
+        Parameters
+        ----------
+        kind : str
+            The kind of object being queried, e.g. "molecule".
+        ids : QueryObjectId
+            The ids to query.
+        fetch : Callable[[List[str]], Dict[str, Any]]
+            Queries the given ids from the server and returns the found objects in {"id": object} format.
+        build : Optional[Callable[[Dict[str, Any]], Any]], optional
+            Builds an object from its cached dictionary. Objects are cached as-is if None.
+        cacheable : Optional[Callable[[Any], bool]], optional
+            Whether a fetched object is immutable and may be cached, all objects are if None.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The found objects in {"id": object} format in the order of the requested ids.
+        """
+
+        if not isinstance(ids, (list, tuple)):
+            ids = [ids]
+        ids = list(dict.fromkeys(str(x) for x in ids))
+
+        found = self.cache.get(kind, ids)
+        if build is not None:
+            found = {k: build(v) for k, v in found.items()}
+
+        missing = [x for x in ids if x not in found]
+        if missing:
+            # The server truncates each query at its query limit
+            fetched = {}
+            for chunk in self.map_chunks(fetch, missing):
+                fetched.update(chunk)
+
+            self.cache.put(
+                kind,
+                {
+                    k: (v.dict() if build is not None else v)
+                    for k, v in fetched.items()
+                    if (cacheable is None) or cacheable(v)
+                },
+            )
+            found.update(fetched)
+
+        return {x: found[x] for x in ids if x in found}
+
     @classmethod
     def from_file(cls, load_path: Optional[str] = None) -> "FractalClient":
         """Creates a new FractalClient from file. If no path is passed in, the
@@ -364,6 +579,13 @@ class FractalClient(object):
             A list of found KVStore objects in {"id": "value"} format
         """
 
+        if self._use_cache(id, full_return):
+
+            def fetch(ids):
+                return self._automodel_request("kvstore", "get", {"meta": {}, "data": {"id": ids}})
+
+            return self._query_cached("kvstore", id, fetch)
+
         return self._automodel_request("kvstore", "get", {"meta": {}, "data": {"id": id}}, full_return=full_return)
 
     ### Molecule section
@@ -375,6 +597,8 @@ class FractalClient(object):
         molecular_formula: Optional["QueryStr"] = None,
         limit: Optional[int] = None,
         skip: int = 0,
+        cursor: Optional[str] = None,
+        count: str = "exact",
         full_return: bool = False,
     ) -> Union["MoleculeGETResponse", List["Molecule"]]:
         """Queries molecules from the database.
@@ -392,6 +616,13 @@ class FractalClient(object):
             The maximum number of Molecules to query
         skip : int, optional
             The number of Molecules to skip in the query, used during pagination
+        cursor : Optional[str], optional
+            Paginate with a cursor instead of ``skip``. Pass an empty string for the first page and the
+            ``meta.cursor`` of the previous ``full_return`` response for the next, which is ``None`` once
+            all Molecules have been returned.
+        count : str, optional
+            How the ``n_found`` of a ``full_return`` response is computed, one of "exact", "estimate" or
+            "none". "none" skips the server-side count and is the fastest.
         full_return : bool, optional
             Returns the full server response if True that contains additional metadata.
 
@@ -402,9 +633,18 @@ class FractalClient(object):
         """
 
         payload = {
-            "meta": {"limit": limit, "skip": skip},
+            "meta": {"limit": limit, "skip": skip, "cursor": cursor, "count": count},
             "data": {"id": id, "molecule_hash": molecule_hash, "molecular_formula": molecular_formula},
         }
+
+        if self._use_cache(id, full_return, molecule_hash, molecular_formula, limit, cursor) and (skip == 0):
+
+            def fetch(ids):
+                chunk = {"meta": {"count": "none"}, "data": {**payload["data"], "id": ids}}
+                return {x.id: x for x in self._automodel_request("molecule", "get", chunk)}
+
+            return list(self._query_cached("molecule", id, fetch, build=Molecule.parse_obj).values())
+
         response = self._automodel_request("molecule", "get", payload, full_return=full_return)
         return response
 
@@ -460,6 +700,15 @@ class FractalClient(object):
         """
 
         payload = {"meta": {}, "data": {"id": id, "hash_index": hash_index}}
+
+        if self._use_cache(id, full_return, hash_index):
+
+            def fetch(ids):
+                chunk = {"meta": {}, "data": {**payload["data"], "id": ids}}
+                return {x.id: x for x in self._automodel_request("keyword", "get", chunk)}
+
+            return list(self._query_cached("keyword", id, fetch, build=KeywordSet.parse_obj).values())
+
         return self._automodel_request("keyword", "get", payload, full_return=full_return)
 
     def add_keywords(self, keywords: List["KeywordSet"], full_return: bool = False) -> List[str]:
@@ -660,6 +909,8 @@ class FractalClient(object):
         status: "QueryStr" = "COMPLETE",
         limit: Optional[int] = None,
         skip: int = 0,
+        cursor: Optional[str] = None,
+        count: str = "exact",
         include: Optional["QueryListStr"] = None,
         full_return: bool = False,
     ) -> Union["ResultGETResponse", List["ResultRecord"], Dict[str, Any]]:
@@ -689,6 +940,13 @@ class FractalClient(object):
             The maximum number of Results to query
         skip : int, optional
             The number of Results to skip in the query, used during pagination
+        cursor : Optional[str], optional
+            Paginate with a cursor instead of ``skip``. Pass an empty string for the first page and the
+            ``meta.cursor`` of the previous ``full_return`` response for the next, which is ``None`` once
+            all Results have been returned.
+        count : str, optional
+            How the ``n_found`` of a ``full_return`` response is computed, one of "exact", "estimate" or
+            "none". "none" skips the server-side count and is the fastest.
         include : QueryListStr, optional
             Filters the returned fields, will return a dictionary rather than an object.
         full_return : bool, optional
@@ -701,7 +959,7 @@ class FractalClient(object):
             dictionary of results with include.
         """
         payload = {
-            "meta": {"limit": limit, "skip": skip, "include": include},
+            "meta": {"limit": limit, "skip": skip, "cursor": cursor, "count": count, "include": include},
             "data": {
                 "id": id,
                 "task_id": task_id,
@@ -714,6 +972,26 @@ class FractalClient(object):
                 "status": status,
             },
         }
+
+        # Only COMPLETE records are immutable and cached
+        filters = (task_id, program, molecule, driver, method, basis, keywords, limit, cursor, include)
+        if self._use_cache(id, full_return, *filters) and (skip == 0) and (status in (None, "COMPLETE")):
+
+            def build(data):
+                record = ResultRecord.parse_obj(data)
+                record.__dict__["client"] = self
+                return record
+
+            def fetch(ids):
+                chunk = {"meta": {"count": "none"}, "data": {**payload["data"], "id": ids}}
+                records = self._automodel_request("result", "get", chunk)
+                for record in records:
+                    record.__dict__["client"] = self
+                return {x.id: x for x in records}
+
+            found = self._query_cached("result", id, fetch, build=build, cacheable=lambda x: x.status == "COMPLETE")
+            return list(found.values())
+
         response = self._automodel_request("result", "get", payload, full_return=True)
 
         # Add references back to the client
@@ -736,6 +1014,8 @@ class FractalClient(object):
         status: "QueryStr" = "COMPLETE",
         limit: Optional[int] = None,
         skip: int = 0,
+        cursor: Optional[str] = None,
+        count: str = "exact",
         include: Optional["QueryListStr"] = None,
         full_return: bool = False,
     ) -> Union["ProcedureGETResponse", List[Dict[str, Any]]]:
@@ -759,6 +1039,13 @@ class FractalClient(object):
             The maximum number of Procedures to query
         skip : int, optional
             The number of Procedures to skip in the query, used during pagination
+        cursor : Optional[str], optional
+            Paginate with a cursor instead of ``skip``. Pass an empty string for the first page and the
+            ``meta.cursor`` of the previous ``full_return`` response for the next, which is ``None`` once
+            all Procedures have been returned.
+        count : str, optional
+            How the ``n_found`` of a ``full_return`` response is computed, one of "exact", "estimate" or
+            "none". "none" skips the server-side count and is the fastest.
         include : QueryListStr, optional
             Filters the returned fields, will return a dictionary rather than an object.
         full_return : bool, optional
@@ -772,7 +1059,7 @@ class FractalClient(object):
         """
 
         payload = {
-            "meta": {"limit": limit, "skip": skip, "include": include},
+            "meta": {"limit": limit, "skip": skip, "cursor": cursor, "count": count, "include": include},
             "data": {
                 "id": id,
                 "task_id": task_id,
@@ -782,6 +1069,22 @@ class FractalClient(object):
                 "status": status,
             },
         }
+
+        # Only COMPLETE records are immutable and cached
+        filters = (task_id, procedure, program, hash_index, limit, cursor, include)
+        if self._use_cache(id, full_return, *filters) and (skip == 0) and (status in (None, "COMPLETE")):
+
+            def fetch(ids):
+                chunk = {"meta": {"count": "none"}, "data": {**payload["data"], "id": ids}}
+                records = [build_procedure(x, client=self) for x in self._automodel_request("procedure", "get", chunk)]
+                return {x.id: x for x in records}
+
+            def build(data):
+                return build_procedure(data, client=self)
+
+            found = self._query_cached("procedure", id, fetch, build=build, cacheable=lambda x: x.status == "COMPLETE")
+            return list(found.values())
+
         response = self._automodel_request("procedure", "get", payload, full_return=True)
 
         if not include:
@@ -952,6 +1255,8 @@ class FractalClient(object):
         manager: Optional["QueryStr"] = None,
         limit: Optional[int] = None,
         skip: int = 0,
+        cursor: Optional[str] = None,
+        count: str = "exact",
         include: Optional["QueryListStr"] = None,
         full_return: bool = False,
     ) -> Union["TaskQueueGETResponse", List["TaskRecord"], List[Dict[str, Any]]]:
@@ -977,6 +1282,13 @@ class FractalClient(object):
             The maximum number of Tasks to query
         skip : int, optional
             The number of Tasks to skip in the query, used during pagination
+        cursor : Optional[str], optional
+            Paginate with a cursor instead of ``skip``. Pass an empty string for the first page and the
+            ``meta.cursor`` of the previous ``full_return`` response for the next, which is ``None`` once
+            all Tasks have been returned.
+        count : str, optional
+            How the ``n_found`` of a ``full_return`` response is computed, one of "exact", "estimate" or
+            "none". "none" skips the server-side count and is the fastest.
         include : QueryListStr, optional
             Filters the returned fields, will return a dictionary rather than an object.
         full_return : bool, optional
@@ -998,7 +1310,7 @@ class FractalClient(object):
         """
 
         payload = {
-            "meta": {"limit": limit, "skip": skip, "include": include},
+            "meta": {"limit": limit, "skip": skip, "cursor": cursor, "count": count, "include": include},
             "data": {
                 "id": id,
                 "hash_index": hash_index,
@@ -526,10 +526,10 @@ class BaseProcedureDataset(Collection):
         query_ids = list(mapper.values())
 
         # Chunk up the queries
-        procedures: List[Dict[str, Any]] = []
-        for i in range(0, len(query_ids), self.client.query_limit):
-            chunk_ids = query_ids[i : i + self.client.query_limit]
-            procedures.extend(self.client.query_procedures(id=chunk_ids))
+        chunks = self.client.map_chunks(
+            lambda chunk_ids: self.client.query_procedures(id=chunk_ids, count="none"), query_ids
+        )
+        procedures: List[Dict[str, Any]] = [proc for chunk in chunks for proc in chunk]
 
         proc_lookup = {x.id: x for x in procedures}
 
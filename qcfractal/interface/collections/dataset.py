@@ -1071,9 +1071,10 @@ class Dataset(Collection):
 
         molecule_ids = list(set(indexer.values()))
         if not self._use_view(force):
-            molecules: List["Molecule"] = []
-            for i in range(0, len(molecule_ids), self.client.query_limit):
-                molecules.extend(self.client.query_molecules(id=molecule_ids[i : i + self.client.query_limit]))
+            chunks = self.client.map_chunks(
+                lambda chunk_ids: self.client.query_molecules(id=chunk_ids, count="none"), molecule_ids
+            )
+            molecules: List["Molecule"] = [mol for chunk in chunks for mol in chunk]
             # XXX: molecules = pd.DataFrame({"molecule_id": molecule_ids, "molecule": molecules}) fails
             #      test_gradient_dataset_get_molecules and I don't know why
             molecules = pd.DataFrame({"molecule_id": molecule.id, "molecule": molecule} for molecule in molecules)
@@ -1148,10 +1149,11 @@ class Dataset(Collection):
                 query_set["include"] = proj
 
             # Chunk up the queries
-            records: List[ResultRecord] = []
-            for i in range(0, len(molecules), self.client.query_limit):
-                query_set["molecule"] = molecules[i : i + self.client.query_limit]
-                records.extend(self.client.query_results(**query_set))
+            def query_chunk(chunk_mols, query_set=query_set):
+                return self.client.query_results(**{**query_set, "molecule": chunk_mols}, count="none")
+
+            chunks = self.client.map_chunks(query_chunk, molecules)
+            records: List[ResultRecord] = [rec for chunk in chunks for rec in chunk]
 
             if include is None:
                 records = [{"molecule": x.molecule, "record": x} for x in records]
@@ -1217,10 +1219,10 @@ class Dataset(Collection):
         existing: List[ObjectId] = []
         for compute_set in composition_planner(**dbkeys):
 
-            for i in range(0, len(umols), self.client.query_limit):
-                chunk_mols = umols[i : i + self.client.query_limit]
-                ret = self.client.add_compute(**compute_set, molecule=chunk_mols, tag=tag, priority=priority)
+            def compute_chunk(chunk_mols, compute_set=compute_set):
+                return self.client.add_compute(**compute_set, molecule=chunk_mols, tag=tag, priority=priority)
 
+            for ret in self.client.map_chunks(compute_chunk, umols):
                 ids.extend(ret.ids)
                 submitted.extend(ret.submitted)
                 existing.extend(ret.existing)
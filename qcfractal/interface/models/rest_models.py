@@ -4,6 +4,7 @@ Models for the REST interface
 import functools
 import re
 import warnings
+from enum import Enum
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 from pydantic import Field, constr, root_validator, validator
@@ -144,6 +145,11 @@ class ResponseGETMeta(ResponseMeta):
         ...,
         description="The number of entries which were already found in the database from the set which was provided.",
     )
+    cursor: Optional[str] = Field(
+        None,
+        description="An opaque cursor to pass back as the query ``cursor`` to fetch the next page. Only returned for "
+        "cursor paginated queries, ``None`` if there are no further pages.",
+    )
 
 
 class ResponsePOSTMeta(ResponseMeta):
@@ -165,6 +171,16 @@ class ResponsePOSTMeta(ResponseMeta):
     )
 
 
+class CountEnum(str, Enum):
+    """
+    How the total number of matches of a query is reported in ``n_found``.
+    """
+
+    exact = "exact"
+    estimate = "estimate"
+    none = "none"
+
+
 class QueryMeta(ProtoModel):
     """
     Standard Fractal Server metadata for Database queries containing pagination information
@@ -174,6 +190,16 @@ class QueryMeta(ProtoModel):
         None, description="Limit to the number of objects which can be returned with this query."
     )
     skip: int = Field(0, description="The number of records to skip on the query.")
+    cursor: Optional[str] = Field(
+        None,
+        description="Paginate with a cursor rather than ``skip``, which stays fast for deep pages. Pass an empty "
+        "string to start and the ``cursor`` of the previous response to continue.",
+    )
+    count: CountEnum = Field(
+        CountEnum.exact,
+        description="How ``n_found`` is computed: ``exact`` counts all matches, ``estimate`` uses the database "
+        "planner estimate, and ``none`` skips counting and reports the number of returned entries.",
+    )
 
 
 class QueryFilter(ProtoModel):
@@ -1015,6 +1041,11 @@ common_docs[QueueManagerMeta] = str(get_base_docs(QueueManagerMeta))
 class QueueManagerGETBody(ProtoModel):
     class Data(ProtoModel):
         limit: int = Field(..., description="Max number of Queue Managers to get from the server.")
+        wait: Optional[float] = Field(
+            None,
+            description="If no Tasks are available, wait up to this many seconds for new Tasks before returning "
+            "(long-poll). The Server may shorten the wait. None returns immediately.",
+        )
 
     meta: QueueManagerMeta = Field(..., description=common_docs[QueueManagerMeta])
     data: Data = Field(
@@ -1074,6 +1105,34 @@ class QueueManagerPUTResponse(ProtoModel):
 
 register_model("queue_manager", "PUT", QueueManagerPUTBody, QueueManagerPUTResponse)
 
+
+class QueueManagerExchangePOSTBody(ProtoModel):
+    class Data(ProtoModel):
+        results: Dict[ObjectId, Any] = Field({}, description="A Dictionary of completed tasks to return to the server.")
+        limit: int = Field(
+            ..., description="The number of open task slots, the maximum number of new Tasks to pull from the server."
+        )
+
+    meta: QueueManagerMeta = Field(..., description=common_docs[QueueManagerMeta])
+    data: Data = Field(
+        ...,
+        description="Completed tasks to return and the number of new Tasks to pull, both are handled in a single "
+        "database transaction.",
+    )
+
+
+class QueueManagerExchangePOSTResponse(ProtoModel):
+    class Data(ProtoModel):
+        n_completed: int = Field(..., description="The number of returned tasks which were processed.")
+        n_failures: int = Field(..., description="The number of returned tasks which were marked as errored.")
+        tasks: List[Dict[str, Optional[Any]]] = Field(..., description="The new tasks to compute.")
+
+    meta: ResponseMeta = Field(..., description=common_docs[ResponseMeta])
+    data: Data = Field(..., description="The outcome of the returned tasks and the new tasks.")
+
+
+register_model("queue_manager/exchange", "POST", QueueManagerExchangePOSTBody, QueueManagerExchangePOSTResponse)
+
 ## advanced procedures queries
 
 
@@ -228,10 +228,8 @@ class TorsionDriveRecord(RecordBase):
 
             # Grab procedures
             needed_ids = [x for v in self.optimization_history.values() for x in v]
-            objects = []
-            for i in range(0, len(needed_ids), self.client.query_limit):
-                objects.extend(self.client.query_procedures(id=needed_ids[i : i + self.client.query_limit]))
-            procedures = {v.id: v for v in objects}
+            chunks = self.client.map_chunks(lambda chunk_ids: self.client.query_procedures(id=chunk_ids), needed_ids)
+            procedures = {v.id: v for chunk in chunks for v in chunk}
 
             # Move procedures into the correct order
             ret = {}
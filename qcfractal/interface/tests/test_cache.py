@@ -0,0 +1,49 @@
+"""
+Tests for the client object cache.
+"""
+
+import pickle
+
+import numpy as np
+
+from qcfractal.interface.cache import ClientCache
+
+
+def test_client_cache_roundtrip(tmp_path):
+
+    cache = ClientCache(str(tmp_path), "https://localhost:7777/")
+    cache.put("molecule", {"1": {"symbols": ["He"], "geometry": np.zeros(3)}, "2": {"symbols": ["Ne"]}})
+
+    ret = cache.get("molecule", ["1", "3", "2", "1"])
+    assert set(ret) == {"1", "2"}
+    assert ret["2"] == {"symbols": ["Ne"]}
+    assert np.allclose(ret["1"]["geometry"], 0)
+
+    # Keyed by kind and server address
+    assert cache.get("keyword", ["1"]) == {}
+    other = ClientCache(str(tmp_path), "https://otherhost:7777/")
+    assert other.get("molecule", ["1"]) == {}
+
+    stats = cache.statistics()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+    assert stats["entries"] == 2
+
+    # Persists across instances and pickling
+    cache = pickle.loads(pickle.dumps(ClientCache(str(tmp_path), "https://localhost:7777/")))
+    assert set(cache.get("molecule", ["1", "2"])) == {"1", "2"}
+
+    cache.clear()
+    assert cache.get("molecule", ["1", "2"]) == {}
+
+
+def test_client_cache_lru(tmp_path):
+
+    cache = ClientCache(str(tmp_path / "cache.sqlite"), "https://localhost:7777/", max_size=2500)
+    for i in range(3):
+        cache.put("kvstore", {str(i): "x" * 1000})
+        cache.get("kvstore", ["0"])
+
+    # The least recently used entry is evicted
+    assert set(cache.get("kvstore", ["0", "1", "2"])) == {"0", "2"}
+    assert cache.statistics()["evictions"] == 1
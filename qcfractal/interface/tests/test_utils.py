@@ -2,8 +2,15 @@
 Tests for the interface utility functions.
 """
 
+import pytest
+
 from . import portal
 
+using_zstandard = pytest.mark.skipif(
+    "zstd" not in portal.util.body_encodings(),
+    reason="Not detecting module 'zstandard'. Install package if necessary to enable tests.",
+)
+
 
 def test_replace_dict_keys():
 
@@ -18,3 +25,18 @@ def test_replace_dict_keys():
 
     ret = portal.util.replace_dict_keys({5: {5: 10}}, {5: 10})
     assert ret == {10: {10: 10}}
+
+
+@pytest.mark.parametrize("encoding", ["gzip", pytest.param("zstd", marks=using_zstandard)])
+def test_compress_body(encoding):
+
+    body = b"qcportal" * 100000
+    compressed = portal.util.compress_body(body, encoding)
+    assert len(compressed) < len(body)
+    assert portal.util.decompress_body(compressed, encoding) == body
+
+    with pytest.raises(ValueError):
+        portal.util.decompress_body(compressed, encoding, max_size=len(body) - 1)
+
+    with pytest.raises(ValueError):
+        portal.util.compress_body(body, "br")
@@ -1,12 +1,15 @@
 """
 Utility functions for QCPortal/QCFractal Interface.
 """
+import gzip
 import re
 import unicodedata
+import zlib
+from typing import Iterator, List, Optional
 
 from pydantic import BaseModel
 
-__all__ = ["replace_dict_keys", "normalize_filename"]
+__all__ = ["replace_dict_keys", "normalize_filename", "compress_body", "decompress_body", "body_encodings"]
 
 
 def replace_dict_keys(data, replacement):
@@ -66,3 +69,79 @@ def normalize_filename(value: str) -> str:
     value = unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode("ascii")
     value = re.sub(r"[^\w\s-]", "", value).strip()
     return re.sub(r"[-\s]+", "_", value)
+
+
+def _zstd():
+    try:
+        import zstandard
+
+        return zstandard
+    except ImportError:
+        return None
+
+
+def body_encodings() -> List[str]:
+    """
+    Returns the request body Content-Encodings available in this environment.
+    """
+    return ["gzip"] + (["zstd"] if _zstd() is not None else [])
+
+
+def compress_body(data: bytes, encoding: str) -> bytes:
+    """
+    Compresses a request body with a "gzip" or "zstd" Content-Encoding.
+    """
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6)
+
+    if encoding == "zstd":
+        zstandard = _zstd()
+        if zstandard is None:
+            raise ImportError("The zstd Content-Encoding requires the zstandard package.")
+        return zstandard.ZstdCompressor(level=3).compress(data)
+
+    raise ValueError(f"Content-Encoding '{encoding}' is not supported.")
+
+
+def _gunzip_chunks(data: bytes, chunk_size: int) -> Iterator[bytes]:
+    reader = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while data and not reader.eof:
+        yield reader.decompress(data, chunk_size)
+        data = reader.unconsumed_tail
+
+    if not reader.eof:
+        raise EOFError("The gzip body is truncated.")
+
+
+def _unzstd_chunks(data: bytes, chunk_size: int) -> Iterator[bytes]:
+    zstandard = _zstd()
+    if zstandard is None:
+        raise ImportError("The zstd Content-Encoding requires the zstandard package.")
+
+    with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+        for chunk in iter(lambda: reader.read(chunk_size), b""):
+            yield chunk
+
+
+def decompress_body(data: bytes, encoding: str, max_size: Optional[int] = None) -> bytes:
+    """
+    Decompresses a request body compressed with ``compress_body``.
+
+    Raises a ValueError if the decompressed body would be larger than ``max_size`` bytes.
+    """
+    if encoding == "gzip":
+        chunks = _gunzip_chunks(data, 2 ** 20)
+    elif encoding == "zstd":
+        chunks = _unzstd_chunks(data, 2 ** 20)
+    else:
+        raise ValueError(f"Content-Encoding '{encoding}' is not supported.")
+
+    ret = []
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        if (max_size is not None) and (size > max_size):
+            raise ValueError(f"The decompressed body is larger than {max_size} bytes.")
+        ret.append(chunk)
+
+    return b"".join(ret)
@@ -2,6 +2,8 @@
 All procedures tasks involved in on-node computation.
 """
 
+import traceback
+from collections import Counter
 from typing import List, Union
 
 import qcelemental as qcel
@@ -9,7 +11,7 @@ import qcelemental as qcel
 import qcengine as qcng
 
 from ..interface.models import Molecule, OptimizationRecord, QCSpecification, ResultRecord, TaskRecord
-from .procedures_util import parse_single_tasks
+from .procedures_util import _blob_keys, _placeholder_id, parse_single_task, store_single_tasks
 
 _wfn_return_names = set(qcel.models.results.WavefunctionProperties._return_results_names)
 _wfn_all_fields = set(qcel.models.results.WavefunctionProperties.__fields__.keys())
@@ -57,6 +59,44 @@ class BaseTasks:
     def parse_output(self, data):
         raise TypeError("parse_output not defined")
 
+    def _prefetch(self, getter, outputs):
+        """Fetches the base records of a packet of completed tasks with as few queries as possible."""
+
+        ids = list({str(x["base_result"]) for x in outputs})
+        limit = self.storage.get_limit(None)
+
+        # The records are updated right after, a lagging read replica could hand back stale records
+        records = {}
+        with self.storage.primary():
+            for i in range(0, len(ids), limit):
+                for record in getter(id=ids[i : i + limit], count="none")["data"]:
+                    records[str(record["id"])] = record
+
+        return records
+
+    def _prefetch_molecules(self, ids):
+        """Fetches molecules by id with as few queries as possible."""
+
+        ids = list({str(x) for x in ids})
+        limit = self.storage.get_limit(None)
+
+        # Molecules are immutable, but recently added ones may not have reached a read replica yet
+        molecules = {}
+        with self.storage.primary():
+            for i in range(0, len(ids), limit):
+                for molecule in self.storage.get_molecules(id=ids[i : i + limit], count="none")["data"]:
+                    molecules[molecule.id] = molecule
+
+        return molecules
+
+    def _task_error(self, task_id):
+        """Formats the current exception as the error of a single task so the rest of the packet proceeds."""
+
+        msg = "Internal FractalServer Error:\n" + traceback.format_exc()
+        self.logger.warning(f"Could not parse the output of task {task_id}:\n{msg}")
+
+        return (task_id, msg)
+
 
 class SingleResultTasks(BaseTasks):
     """A task generator for a single Result.
@@ -111,26 +151,40 @@ class SingleResultTasks(BaseTasks):
         tag = meta.pop("tag", None)
         priority = meta.pop("priority", None)
 
-        # Construct full tasks
-        new_tasks = []
-        results_ids = []
-        existing_ids = []
+        # Construct all records and add them at once
+        records = []
+        inputs = []
         for mol in molecule_list:
             if mol is None:
-                results_ids.append(None)
                 continue
 
             record = ResultRecord(**meta.copy(), molecule=mol.id)
             inp = record.build_schema_input(mol, keywords)
             inp.extras["_qcfractal_tags"] = {"program": record.program, "keywords": record.keywords}
 
-            ret = self.storage.add_results([record])
+            records.append(record)
+            inputs.append(inp)
 
-            base_id = ret["data"][0]
+        ret = self.storage.add_results(records)
+
+        # Only the first occurrence of a newly inserted id needs a task
+        new_ids = Counter(ret["data"]) - Counter(ret["meta"]["duplicates"])
+        added = iter(zip(ret["data"], inputs))
+
+        # Construct full tasks
+        new_tasks = []
+        results_ids = []
+        existing_ids = []
+        for mol in molecule_list:
+            if mol is None:
+                results_ids.append(None)
+                continue
+
+            base_id, inp = next(added)
             results_ids.append(base_id)
 
             # Task is complete
-            if len(ret["meta"]["duplicates"]):
+            if not new_ids.pop(base_id, 0):
                 existing_ids.append(base_id)
                 continue
 
@@ -156,51 +210,78 @@ class SingleResultTasks(BaseTasks):
 
     def parse_output(self, result_outputs):
 
-        # Add new runs to database
-        completed_tasks = []
-        updates = []
+        records = self._prefetch(self.storage.get_results, result_outputs)
+
+        # Validate and convert every task before anything is written, malformed tasks are diverted
+        outputs = []
+        errors = []
         for data in result_outputs:
-            result = self.storage.get_results(id=data["base_result"])["data"][0]
-            result = ResultRecord(**result)
-
-            rdata = data["result"]
-            stdout, stderr, error = self.storage.add_kvstore([rdata["stdout"], rdata["stderr"], rdata["error"]])["data"]
-            rdata["stdout"] = stdout
-            rdata["stderr"] = stderr
-            rdata["error"] = error
-
-            # Store Wavefunction data
-            if data["result"].get("wavefunction", False):
-                wfn = data["result"].get("wavefunction", False)
-                available = set(wfn.keys()) - {"restricted", "basis"}
-                return_map = {k: wfn[k] for k in wfn.keys() & _wfn_return_names}
-
-                rdata["wavefunction"] = {
-                    "available": list(available),
-                    "restricted": wfn["restricted"],
-                    "return_map": return_map,
-                }
+            key = str(data["base_result"])
+            if key not in records:
+                errors.append((data["task_id"], "Internal Error: Base result not found."))
+                continue
+
+            try:
+                result = ResultRecord(**records[key])
+
+                # The output of the manager is left unchanged
+                rdata = {**data["result"], "extras": dict(data["result"]["extras"])}
+
+                # Store Wavefunction data
+                wavefunction_save = None
+                if rdata.get("wavefunction", False):
+                    wfn = rdata["wavefunction"]
+                    available = set(wfn.keys()) - {"restricted", "basis"}
+                    return_map = {k: wfn[k] for k in wfn.keys() & _wfn_return_names}
+
+                    rdata["wavefunction"] = {
+                        "available": list(available),
+                        "restricted": wfn["restricted"],
+                        "return_map": return_map,
+                    }
+
+                    # Extra fields are trimmed as we have a column *per* wavefunction structure.
+                    available_keys = wfn.keys() - _wfn_return_names
+                    if available_keys > _wfn_all_fields:
+                        self.logger.warning(
+                            f"Too much wavefunction data for result {data['base_result']}, removing extra data."
+                        )
+                        available_keys &= _wfn_all_fields
+
+                    wavefunction_save = {k: wfn[k] for k in available_keys}
+
+                # Blobs are referenced by placeholder ids until stored
+                task_blobs = [rdata[k] for k in _blob_keys]
+                rdata.update({k: _placeholder_id for k in _blob_keys})
+                result._consume_output(rdata)
+            except Exception:
+                errors.append(self._task_error(data["task_id"]))
+                continue
+
+            outputs.append((data["task_id"], result, task_blobs, wavefunction_save))
+
+        if not outputs:
+            return [], errors, []
 
-                # Extra fields are trimmed as we have a column *per* wavefunction structure.
-                available_keys = wfn.keys() - _wfn_return_names
-                if available_keys > _wfn_all_fields:
-                    self.logger.warning(
-                        f"Too much wavefunction data for result {data['base_result']}, removing extra data."
-                    )
-                    available_keys &= _wfn_all_fields
+        blob_ids = iter(self.storage.add_kvstore([x for _, _, blobs, _ in outputs for x in blobs])["data"])
+        wfn_data_ids = self.storage.add_wavefunction_store([x[3] for x in outputs])["data"]
 
-                wavefunction_save = {k: wfn[k] for k in available_keys}
-                wfn_data_id = self.storage.add_wavefunction_store([wavefunction_save])["data"][0]
-                rdata["wavefunction_data_id"] = wfn_data_id
+        # Add new runs to database
+        completed_tasks = []
+        updates = []
+        for (task_id, result, _, _), wfn_data_id in zip(outputs, wfn_data_ids):
+            ids = {k: next(blob_ids) for k in _blob_keys}
+            if wfn_data_id is not None:
+                ids["wavefunction_data_id"] = wfn_data_id
 
-            result._consume_output(rdata)
-            updates.append(result)
-            completed_tasks.append(data["task_id"])
+            # None of the stored ids are part of the hash index
+            updates.append(result.copy(update=ids))
+            completed_tasks.append(task_id)
 
         # TODO: sometimes it should be update, and others its add
         self.storage.update_results(updates)
 
-        return completed_tasks, [], []
+        return completed_tasks, errors, []
 
 
 # ----------------------------------------------------------------------------
@@ -348,49 +429,66 @@ class OptimizationTasks(BaseTasks):
         including the task_id in the TaskQueue table
         """
 
+        records = self._prefetch(self.storage.get_procedures, opt_outputs)
+        initial_molecules = self._prefetch_molecules([x["initial_molecule"] for x in records.values()])
+
+        # Validate and convert every task, trajectory included, before anything is written
+        outputs = []
+        errors = []
+        for output in opt_outputs:
+            task_id = output["task_id"]
+            key = str(output["base_result"])
+            if key not in records:
+                errors.append((task_id, "Internal Error: Base result not found."))
+                continue
+
+            try:
+                procedure = output["result"]
+                initial_molecule = Molecule(**procedure["initial_molecule"])
+                final_molecule = Molecule(**procedure["final_molecule"])
+                trajectory = [parse_single_task(v, task_id=task_id) for v in procedure["trajectory"]]
+                task_blobs = [procedure[k] for k in _blob_keys]
+                update_dict = {"energies": procedure["energies"], "provenance": procedure["provenance"]}
+
+                # Validate now with placeholders for the ids, the record is rebuilt once they are stored
+                placeholders = {k: _placeholder_id for k in _blob_keys}
+                placeholders["final_molecule"] = _placeholder_id
+                placeholders["trajectory"] = [_placeholder_id] * len(trajectory)
+                OptimizationRecord(**{**records[key], **update_dict, **placeholders})
+            except Exception:
+                errors.append(self._task_error(task_id))
+                continue
+
+            # Checked before any molecule of the packet is written
+            stored_initial = initial_molecules.get(str(records[key]["initial_molecule"]))
+            if (stored_initial is None) or (stored_initial.get_hash() != initial_molecule.get_hash()):
+                errors.append((task_id, "Internal Error: Initial molecule does not match the record."))
+                continue
+
+            outputs.append((task_id, {**records[key], **update_dict}, final_molecule, trajectory, task_blobs))
+
+        if not outputs:
+            return [], errors, []
+
+        # Store the final molecules, trajectory computations and stdout/stderr of all procedures together
+        molecule_ids = iter(self.storage.add_molecules([x[2] for x in outputs])["data"])
+        results = store_single_tasks(self.storage, [x for _, _, _, trajectory, _ in outputs for x in trajectory])
+        result_ids = iter(self.storage.add_results(results)["data"])
+        blob_ids = iter(self.storage.add_kvstore([x for _, _, _, _, blobs in outputs for x in blobs])["data"])
+
         completed_tasks = []
         updates = []
-        for output in opt_outputs:
-            rec = self.storage.get_procedures(id=output["base_result"])["data"][0]
-            rec = OptimizationRecord(**rec)
-
-            procedure = output["result"]
-
-            # Add initial and final molecules
-            update_dict = {}
-            initial_mol, final_mol = self.storage.add_molecules(
-                [Molecule(**procedure["initial_molecule"]), Molecule(**procedure["final_molecule"])]
-            )["data"]
-            assert initial_mol == rec.initial_molecule
-            update_dict["final_molecule"] = final_mol
-
-            # Parse trajectory computations and add task_id
-            traj_dict = {k: v for k, v in enumerate(procedure["trajectory"])}
-            results = parse_single_tasks(self.storage, traj_dict)
-            for k, v in results.items():
-                v["task_id"] = output["task_id"]
-                results[k] = ResultRecord(**v)
-
-            ret = self.storage.add_results(list(results.values()))
-            update_dict["trajectory"] = ret["data"]
-            update_dict["energies"] = procedure["energies"]
-
-            # Save stdout/stderr
-            stdout, stderr, error = self.storage.add_kvstore(
-                [procedure["stdout"], procedure["stderr"], procedure["error"]]
-            )["data"]
-            update_dict["stdout"] = stdout
-            update_dict["stderr"] = stderr
-            update_dict["error"] = error
-            update_dict["provenance"] = procedure["provenance"]
-
-            rec = OptimizationRecord(**{**rec.dict(), **update_dict})
-            updates.append(rec)
-            completed_tasks.append(output["task_id"])
+        for task_id, rec_data, _, trajectory, _ in outputs:
+            ids = {k: next(blob_ids) for k in _blob_keys}
+            ids["final_molecule"] = next(molecule_ids)
+            ids["trajectory"] = [next(result_ids) for _ in trajectory]
+
+            updates.append(OptimizationRecord(**{**rec_data, **ids}))
+            completed_tasks.append(task_id)
 
         self.storage.update_procedures(updates)
 
-        return completed_tasks, [], []
+        return completed_tasks, errors, []
 
 
 # ----------------------------------------------------------------------------
@@ -6,7 +6,16 @@ import json
 
 from qcelemental.models import ResultInput
 
-from ..interface.models import Molecule
+from ..interface.models import Molecule, ResultRecord
+
+# Keys of a QCSchema result that have no counterpart on a ResultRecord
+_schema_keys = {"model", "schema_name", "schema_version", "success", "molecule"}
+
+# Keys of a result stored in the KVStore
+_blob_keys = ("stdout", "stderr", "error")
+
+# Stands in for the ids of objects that are stored in bulk after all results are validated
+_placeholder_id = "0"
 
 
 def unpack_single_task_spec(storage, meta, molecules):
@@ -80,47 +89,76 @@ def unpack_single_task_spec(storage, meta, molecules):
     return tasks, []
 
 
-def parse_single_tasks(storage, results):
-    """Summary
+def parse_single_task(result, task_id=None):
+    """Validates a single QCSchema result and converts it to ResultRecord fields without writing to the database.
+
+    The record is only built by ``store_single_tasks`` once the ids of its molecule, stdout,
+    stderr and error are known, as the hash index depends on the molecule. The result itself
+    is left unchanged.
 
     Parameters
     ----------
-    storage : DBSocket
-        A live connection to the current database.
-    results : dict
-        A (key, result) dictionary of the single return results.
+    result : dict
+        The QCSchema result returned by the manager.
+    task_id : str, optional
+        The id of the task that computed the result.
 
     Returns
     -------
-
-    Examples
-    --------
+    tuple(dict, Molecule, list)
+        The fields of the record, its molecule and its stdout, stderr and error blobs.
 
     """
 
-    for k, v in results.items():
-        stdout, stderr, error = storage.add_kvstore([v["stdout"], v["stderr"], v["error"]])["data"]
-        v["stdout"] = stdout
-        v["stderr"] = stderr
-        v["error"] = error
+    tags = result["extras"]["_qcfractal_tags"]
+
+    data = {k: v for k, v in result.items() if k not in _schema_keys and k not in _blob_keys}
+
+    # Flatten data back out
+    data["method"] = result["model"]["method"]
+    data["basis"] = result["model"]["basis"]
+    data["keywords"] = tags["keywords"]
+    data["program"] = tags["program"]
+    data["extras"] = {k: v for k, v in result["extras"].items() if k != "_qcfractal_tags"}
+    data["status"] = "COMPLETE" if result["success"] else "ERROR"
+    data["task_id"] = task_id
+
+    molecule = Molecule(**result["molecule"])
+    blobs = [result[k] for k in _blob_keys]
+
+    # Validate now with placeholders for the ids, the record is rebuilt once they are stored
+    ResultRecord(**data, molecule=_placeholder_id, **{k: _placeholder_id for k in _blob_keys})
 
-        # Flatten data back out
-        v["method"] = v["model"]["method"]
-        v["basis"] = v["model"]["basis"]
-        del v["model"]
+    return data, molecule, blobs
+
+
+def store_single_tasks(storage, tasks):
+    """Stores the molecules and blobs of parsed single results in bulk and builds their records.
+
+    Parameters
+    ----------
+    storage : DBSocket
+        A live connection to the current database.
+    tasks : list of tuple(dict, Molecule, list)
+        The parsed results as returned by ``parse_single_task``.
+
+    Returns
+    -------
+    list of ResultRecord
+        The records, ready to be added to the database.
+
+    """
 
-        # Molecule should be by ID
-        v["molecule"] = storage.add_molecules([Molecule(**v["molecule"])])["data"][0]
+    if not tasks:
+        return []
 
-        v["keywords"] = v["extras"]["_qcfractal_tags"]["keywords"]
-        v["program"] = v["extras"]["_qcfractal_tags"]["program"]
-        del v["extras"]["_qcfractal_tags"]
-        del v["schema_name"]
-        del v["schema_version"]
+    # Store the outputs and molecules of all results at once
+    blob_ids = iter(storage.add_kvstore([x for _, _, blobs in tasks for x in blobs])["data"])
+    molecule_ids = iter(storage.add_molecules([molecule for _, molecule, _ in tasks])["data"])
 
-        if v.pop("success"):
-            v["status"] = "COMPLETE"
-        else:
-            v["status"] = "ERROR"
+    records = []
+    for data, _, _ in tasks:
+        ids = {k: next(blob_ids) for k in _blob_keys}
+        records.append(ResultRecord(**data, molecule=next(molecule_ids), **ids))
 
-    return results
+    return records
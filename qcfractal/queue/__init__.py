@@ -3,5 +3,7 @@ Initializer for the queue_handler folder
 """
 
 from .adapters import build_queue_adapter
-from .handlers import QueueManagerHandler, ServiceQueueHandler, TaskQueueHandler
+from .handlers import QueueManagerExchangeHandler, QueueManagerHandler, ServiceQueueHandler, TaskQueueHandler
+from .journal import ResultJournal
 from .managers import QueueManager
+from .waiters import TaskWaiters
@@ -3,6 +3,7 @@ Queue backend abstraction manager.
 """
 
 import collections
+import time
 import traceback
 
 import tornado.web
@@ -13,6 +14,33 @@ from ..services import initialize_service
 from ..web_handlers import APIHandler
 
 
+def _parse_output_batch(storage_socket, procedure_parser, outputs, logger):
+    """Parses a batch of completed tasks, if the batch fails as a whole its tasks are parsed one by one.
+
+    Must be called within a storage transaction, the writes of a failed batch are rolled back with its savepoint.
+    """
+
+    try:
+        with storage_socket.session_scope():
+            completed, errors, _ = procedure_parser.parse_output(outputs)
+        return completed, errors
+    except Exception:
+        msg = "Internal FractalServer Error:\n" + traceback.format_exc()
+        if len(outputs) == 1:
+            logger.warning("update: ERROR\n{}".format(msg))
+            return [], [(outputs[0]["task_id"], msg)]
+
+        logger.warning("update: batch of {} tasks failed, parsing them one by one\n{}".format(len(outputs), msg))
+
+    completed, errors = [], []
+    for output in outputs:
+        com, err = _parse_output_batch(storage_socket, procedure_parser, [output], logger)
+        completed.extend(com)
+        errors.extend(err)
+
+    return completed, errors
+
+
 class TaskQueueHandler(APIHandler):
     """
     Takes in a data packet the contains the molecule_hash, modelchem and options objects.
@@ -20,7 +48,7 @@ class TaskQueueHandler(APIHandler):
 
     _required_auth = "compute"
 
-    def post(self):
+    async def post(self):
         """Posts new tasks to the task queue.
         """
 
@@ -38,26 +66,26 @@ class TaskQueueHandler(APIHandler):
         if verify is not True:
             raise tornado.web.HTTPError(status_code=400, reason=verify)
 
-        payload = procedure_parser.submit_tasks(body)
+        payload = await self.run_storage(procedure_parser.submit_tasks, body)
         response = response_model(**payload)
 
         self.logger.info("POST: TaskQueue -  Added {} tasks.".format(response.meta.n_inserted))
         self.write(response)
 
-    def get(self):
+    async def get(self):
         """Posts new services to the service queue.
         """
 
         body_model, response_model = rest_model("task_queue", "get")
         body = self.parse_bodymodel(body_model)
 
-        tasks = self.storage.get_queue(**{**body.data.dict(), **body.meta.dict()})
+        tasks = await self.run_storage(self.storage.get_queue, **{**body.data.dict(), **body.meta.dict()})
         response = response_model(**tasks)
 
         self.logger.info("GET: TaskQueue - {} pulls.".format(len(response.data)))
         self.write(response)
 
-    def put(self):
+    async def put(self):
         """Posts new services to the service queue.
         """
 
@@ -68,7 +96,9 @@ class TaskQueueHandler(APIHandler):
             raise tornado.web.HTTPError(status_code=400, reason="Id or ResultId must be specified.")
 
         if body.meta.operation == "restart":
-            tasks_updated = self.storage.queue_reset_status(**body.data.dict(), reset_error=True)
+            tasks_updated = await self.run_storage(
+                self.storage.queue_reset_status, **body.data.dict(), reset_error=True
+            )
             data = {"n_updated": tasks_updated}
         else:
             raise tornado.web.HTTPError(status_code=400, reason=f"Operation '{operation}' is not valid.")
@@ -86,13 +116,10 @@ class ServiceQueueHandler(APIHandler):
 
     _required_auth = "compute"
 
-    def post(self):
-        """Posts new services to the service queue.
+    def _initialize_services(self, body):
+        """Builds and adds the requested services, requires several storage round trips.
         """
 
-        body_model, response_model = rest_model("service_queue", "post")
-        body = self.parse_bodymodel(body_model)
-
         new_services = []
         for service_input in body.data:
             # Get molecules with ids
@@ -111,7 +138,16 @@ class ServiceQueueHandler(APIHandler):
                 )
             )
 
-        ret = self.storage.add_services(new_services)
+        return self.storage.add_services(new_services)
+
+    async def post(self):
+        """Posts new services to the service queue.
+        """
+
+        body_model, response_model = rest_model("service_queue", "post")
+        body = self.parse_bodymodel(body_model)
+
+        ret = await self.run_storage(self._initialize_services, body)
         ret["data"] = {"ids": ret["data"], "existing": ret["meta"]["duplicates"]}
         ret["data"]["submitted"] = list(set(ret["data"]["ids"]) - set(ret["meta"]["duplicates"]))
         response = response_model(**ret)
@@ -119,20 +155,20 @@ class ServiceQueueHandler(APIHandler):
         self.logger.info("POST: ServiceQueue -  Added {} services.\n".format(response.meta.n_inserted))
         self.write(response)
 
-    def get(self):
+    async def get(self):
         """Gets services from the service queue.
         """
 
         body_model, response_model = rest_model("service_queue", "get")
         body = self.parse_bodymodel(body_model)
 
-        ret = self.storage.get_services(**{**body.data.dict(), **body.meta.dict()})
+        ret = await self.run_storage(self.storage.get_services, **{**body.data.dict(), **body.meta.dict()})
         response = response_model(**ret)
 
         self.logger.info("GET: ServiceQueue - {} pulls.\n".format(len(response.data)))
         self.write(response)
 
-    def put(self):
+    async def put(self):
         """Posts new services to the service queue.
         """
 
@@ -143,7 +179,7 @@ class ServiceQueueHandler(APIHandler):
             raise tornado.web.HTTPError(status_code=400, reason="Id or ProcedureId must be specified.")
 
         if body.meta.operation == "restart":
-            updates = self.storage.update_service_status("running", **body.data.dict())
+            updates = await self.run_storage(self.storage.update_service_status, "running", **body.data.dict())
             data = {"n_updated": updates}
         else:
             raise tornado.web.HTTPError(status_code=400, reason=f"Operation '{operation}' is not valid.")
@@ -161,6 +197,7 @@ class QueueManagerHandler(APIHandler):
     """
 
     _required_auth = "queue"
+    _storage_workload = "queue"
 
     def _get_name_from_metadata(self, meta):
         """
@@ -226,20 +263,29 @@ class QueueManagerHandler(APIHandler):
                 )
             )
 
-        # Run output parsers
+        # Run output parsers in a single transaction, each parser ingests all of its tasks as a batch
         completed = []
-        for k, v in new_results.items():
-            procedure_parser = get_procedure_parser(k, storage_socket, logger)
-            com, err, hks = procedure_parser.parse_output(v)
-            completed.extend(com)
-            error_data.extend(err)
-
-        # Handle complete tasks
-        storage_socket.queue_mark_complete(completed)
-        storage_socket.queue_mark_error(error_data)
+        with storage_socket.transaction():
+            for k, v in new_results.items():
+                try:
+                    procedure_parser = get_procedure_parser(k, storage_socket, logger)
+                except Exception:
+                    msg = "Internal FractalServer Error:\n" + traceback.format_exc()
+                    logger.warning("update: ERROR\n{}".format(msg))
+                    error_data.extend((x["task_id"], msg) for x in v)
+                    continue
+
+                com, err = _parse_output_batch(storage_socket, procedure_parser, v, logger)
+                completed.extend(com)
+                error_data.extend(err)
+
+            # Handle complete tasks
+            storage_socket.queue_mark_complete(completed)
+            storage_socket.queue_mark_error(error_data)
+
         return len(completed), len(error_data)
 
-    def get(self):
+    async def get(self):
         """Pulls new tasks from the Servers queue
         """
 
@@ -249,10 +295,41 @@ class QueueManagerHandler(APIHandler):
         # Figure out metadata and kwargs
         name = self._get_name_from_metadata(body.meta)
 
-        # Grab new tasks and write out
-        new_tasks = self.storage.queue_get_next(
-            name, body.meta.programs, body.meta.procedures, limit=body.data.limit, tag=body.meta.tag
-        )
+        # Long-poll: park the request until matching tasks are announced or the wait runs out
+        waiters = self.objects.get("task_waiters", None)
+        wait = 0
+        if waiters is not None and body.data.wait:
+            wait = min(body.data.wait, waiters.max_wait)
+        deadline = time.monotonic() + wait
+
+        while True:
+            # Subscribe before claiming so that tasks announced in between are not missed
+            future = None
+            if wait > 0:
+                future = waiters.subscribe(body.meta.programs, body.meta.procedures, body.meta.tag)
+
+            try:
+                # Grab new tasks
+                new_tasks = await self.run_storage(
+                    self.storage.queue_get_next,
+                    name,
+                    body.meta.programs,
+                    body.meta.procedures,
+                    limit=body.data.limit,
+                    tag=body.meta.tag,
+                )
+
+                remaining = deadline - time.monotonic()
+                if new_tasks or (future is None) or (remaining <= 0):
+                    break
+
+                # Woken tasks may be claimed by another manager first, claim again until the deadline
+                if not await waiters.wait(future, remaining):
+                    break
+            finally:
+                if future is not None:
+                    waiters.unsubscribe(future)
+
         response = response_model(
             **{
                 "meta": {
@@ -270,9 +347,9 @@ class QueueManagerHandler(APIHandler):
         self.logger.info("QueueManager: Served {} tasks.".format(response.meta.n_found))
 
         # Update manager logs
-        self.storage.manager_update(name, submitted=len(new_tasks), **body.meta.dict())
+        await self.run_storage(self.storage.manager_update, name, submitted=len(new_tasks), **body.meta.dict())
 
-    def post(self):
+    async def post(self):
         """Posts complete tasks to the Servers queue
         """
 
@@ -281,7 +358,7 @@ class QueueManagerHandler(APIHandler):
 
         name = self._get_name_from_metadata(body.meta)
         self.logger.info("QueueManager: Received completed task packet from {}.".format(name))
-        success, error = self.insert_complete_tasks(self.storage, body.data, self.logger)
+        success, error = await self.run_storage(self.insert_complete_tasks, self.storage, body.data, self.logger)
 
         completed = success + error
 
@@ -303,9 +380,9 @@ class QueueManagerHandler(APIHandler):
 
         # Update manager logs
         name = self._get_name_from_metadata(body.meta)
-        self.storage.manager_update(name, completed=completed, failures=error)
+        await self.run_storage(self.storage.manager_update, name, completed=completed, failures=error)
 
-    def put(self):
+    async def put(self):
         """
         Various manager manipulation operations
         """
@@ -318,14 +395,21 @@ class QueueManagerHandler(APIHandler):
         name = self._get_name_from_metadata(body.meta)
         op = body.data.operation
         if op == "startup":
-            self.storage.manager_update(
-                name, status="ACTIVE", configuration=body.data.configuration, **body.meta.dict(), log=True
+            await self.run_storage(
+                self.storage.manager_update,
+                name,
+                status="ACTIVE",
+                configuration=body.data.configuration,
+                **body.meta.dict(),
+                log=True,
             )
             self.logger.info("QueueManager: New active manager {} detected.".format(name))
 
         elif op == "shutdown":
-            nshutdown = self.storage.queue_reset_status(manager=name, reset_running=True)
-            self.storage.manager_update(name, returned=nshutdown, status="INACTIVE", **body.meta.dict(), log=True)
+            nshutdown = await self.run_storage(self.storage.queue_reset_status, manager=name, reset_running=True)
+            await self.run_storage(
+                self.storage.manager_update, name, returned=nshutdown, status="INACTIVE", **body.meta.dict(), log=True
+            )
 
             self.logger.info(
                 "QueueManager: Shutdown of manager {} detected, recycling {} incomplete tasks.".format(name, nshutdown)
@@ -334,7 +418,7 @@ class QueueManagerHandler(APIHandler):
             ret = {"nshutdown": nshutdown}
 
         elif op == "heartbeat":
-            self.storage.manager_update(name, status="ACTIVE", **body.meta.dict(), log=True)
+            await self.run_storage(self.storage.manager_update, name, status="ACTIVE", **body.meta.dict(), log=True)
             self.logger.debug("QueueManager: Heartbeat of manager {} detected.".format(name))
 
         else:
@@ -345,3 +429,61 @@ class QueueManagerHandler(APIHandler):
         self.write(response)
 
         # Update manager logs
+
+
+class QueueManagerExchangeHandler(APIHandler):
+    """
+    Returns complete tasks and pulls new tasks for a Queue Manager in a single request.
+    """
+
+    _required_auth = "queue"
+    _storage_workload = "queue"
+
+    _get_name_from_metadata = QueueManagerHandler._get_name_from_metadata
+
+    def _exchange(self, name, body):
+        """Ingests the results, claims new tasks and updates the manager in one transaction"""
+
+        with self.storage.transaction():
+            success, error = QueueManagerHandler.insert_complete_tasks(self.storage, body.data.results, self.logger)
+
+            new_tasks = []
+            if body.data.limit > 0:
+                new_tasks = self.storage.queue_get_next(
+                    name, body.meta.programs, body.meta.procedures, limit=body.data.limit, tag=body.meta.tag
+                )
+
+            self.storage.manager_update(
+                name,
+                status="ACTIVE",
+                submitted=len(new_tasks),
+                completed=success + error,
+                failures=error,
+                **body.meta.dict(),
+            )
+
+        return success, error, new_tasks
+
+    async def post(self):
+        """Posts complete tasks and pulls new tasks from the Servers queue
+        """
+
+        body_model, response_model = rest_model("queue_manager/exchange", "post")
+        body = self.parse_bodymodel(body_model)
+
+        name = self._get_name_from_metadata(body.meta)
+        success, error, new_tasks = await self.run_storage(self._exchange, name, body)
+
+        response = response_model(
+            **{
+                "meta": {"success": True, "errors": [], "error_description": False},
+                "data": {"n_completed": success, "n_failures": error, "tasks": new_tasks},
+            }
+        )
+        self.write(response)
+
+        self.logger.info(
+            "QueueManager: Exchange with {}, inserted {} complete tasks and served {} tasks.".format(
+                name, len(body.data.results), len(new_tasks)
+            )
+        )
@@ -0,0 +1,225 @@
+"""
+Crash-safe on-disk journal of completed tasks which were not yet delivered to the server.
+"""
+
+import glob
+import logging
+import os
+import struct
+import threading
+import zlib
+from typing import Any, Dict, Iterable, Optional
+
+from qcelemental.util import msgpackext_dumps, msgpackext_loads
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+__all__ = ["ResultJournal"]
+
+# Every record is a msgpack blob preceded by its length and crc32
+_header = struct.Struct("<II")
+_segment_pattern = "segment-{:08d}.msgpack"
+
+# Record locks only exclude other processes, journals of this process are tracked here
+_open_directories = set()
+_open_lock = threading.Lock()
+
+
+class ResultJournal:
+    """
+    An append-only journal of completed task results, split into segment files.
+
+    Results are written and fsync'ed before they are pushed to the server and marked as delivered
+    once the server acknowledged them. Undelivered results of a previous process are returned by
+    ``replay``. Segments are deleted once all of their results are delivered.
+    """
+
+    def __init__(self, directory: str, segment_size: int = 64 * 2 ** 20, logger: Optional[logging.Logger] = None):
+        """
+        Parameters
+        ----------
+        directory : str
+            The folder holding the journal segments, created if missing. Only a single manager
+            may use a folder at a time.
+        segment_size : int, optional
+            The size in bytes after which a new segment file is started.
+        logger : Optional[logging.Logger], optional
+            A logger for the journal.
+        """
+
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.segment_size = segment_size
+        self.logger = logger or logging.getLogger("ResultJournal")
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        with _open_lock:
+            if self.directory in _open_directories:
+                raise RuntimeError(f"The journal at {self.directory} is in use by another manager.")
+
+            # Unlike flock, record locks are not inherited by forked worker processes
+            self._lock_file = open(os.path.join(self.directory, "journal.lock"), "w")
+            if fcntl is not None:
+                try:
+                    fcntl.lockf(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    self._lock_file.close()
+                    raise RuntimeError(f"The journal at {self.directory} is in use by another manager.")
+
+            _open_directories.add(self.directory)
+
+        # Undelivered task ids of each segment
+        self._segments = {}
+        self._active = None
+        self._active_file = None
+
+    def __repr__(self) -> str:
+        return f"ResultJournal(directory='{self.directory}', segments={len(self._segments)})"
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, _segment_pattern.format(number))
+
+    @staticmethod
+    def _read_records(path: str) -> Iterable[Dict[str, Any]]:
+        with open(path, "rb") as handle:
+            while True:
+                header = handle.read(_header.size)
+                if len(header) < _header.size:
+                    return
+
+                length, crc = _header.unpack(header)
+                blob = handle.read(length)
+                if len(blob) < length or zlib.crc32(blob) != crc:
+                    # A torn write of a crash, nothing after it was acknowledged
+                    return
+
+                yield msgpackext_loads(blob)
+
+    def replay(self) -> Dict[str, Any]:
+        """Reads the results which were journaled but never delivered, e.g. by a crashed manager.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The undelivered results in {"task_id": result} format.
+        """
+
+        results = {}
+        with self._lock:
+            paths = sorted(glob.glob(os.path.join(self.directory, _segment_pattern.replace("{:08d}", "*"))))
+            for path in paths:
+                number = int(os.path.basename(path)[len("segment-") : -len(".msgpack")])
+                segment_results = {}
+                for record in self._read_records(path):
+                    segment_results.update(record.get("results", {}))
+                    for task_id in record.get("delivered", []):
+                        segment_results.pop(task_id, None)
+
+                results.update(segment_results)
+                self._segments[number] = set(segment_results)
+
+            self._compact()
+
+        return results
+
+    @staticmethod
+    def _write(handle, record: Dict[str, Any], sync: bool) -> None:
+        blob = msgpackext_dumps(record)
+        handle.write(_header.pack(len(blob), zlib.crc32(blob)) + blob)
+        handle.flush()
+        if sync:
+            os.fsync(handle.fileno())
+
+    def append(self, results: Dict[str, Any]) -> None:
+        """Durably records completed results, call before pushing them to the server.
+
+        Parameters
+        ----------
+        results : Dict[str, Any]
+            The completed results in {"task_id": result} format.
+        """
+
+        if not results:
+            return
+
+        with self._lock:
+            if self._active_file is None:
+                self._active = max(self._segments, default=0) + 1
+                self._segments[self._active] = set()
+                self._active_file = open(self._segment_path(self._active), "ab")
+
+            self._write(self._active_file, {"results": results}, sync=True)
+            self._segments[self._active].update(results)
+
+            # Full segments are only appended to again by delivery records
+            if self._active_file.tell() >= self.segment_size:
+                self._active_file.close()
+                self._active_file = None
+                self._active = None
+
+    def mark_delivered(self, task_ids: Iterable[str]) -> None:
+        """Marks results as acknowledged by the server and deletes the segments which are fully delivered.
+
+        Parameters
+        ----------
+        task_ids : Iterable[str]
+            The ids of the delivered tasks.
+        """
+
+        task_ids = set(task_ids)
+        with self._lock:
+            for number, pending in self._segments.items():
+                delivered = list(pending & task_ids)
+                if not delivered:
+                    continue
+
+                pending.difference_update(delivered)
+                if not pending:
+                    continue
+
+                # Each segment records the deliveries of its own results. Losing a delivery record
+                # only leads to a duplicate push, no need to sync.
+                if number == self._active:
+                    self._write(self._active_file, {"delivered": delivered}, sync=False)
+                else:
+                    with open(self._segment_path(number), "ab") as handle:
+                        self._write(handle, {"delivered": delivered}, sync=False)
+
+            self._compact()
+
+    def _compact(self) -> None:
+        for number, pending in list(self._segments.items()):
+            if pending:
+                continue
+
+            if number == self._active:
+                self._active_file.close()
+                self._active_file = None
+                self._active = None
+
+            os.remove(self._segment_path(number))
+            del self._segments[number]
+
+    def pending(self) -> int:
+        """Returns the number of journaled results which were not delivered yet."""
+
+        with self._lock:
+            return sum(len(x) for x in self._segments.values())
+
+    def close(self) -> None:
+        """Closes the journal, undelivered results are kept on disk for the next replay."""
+
+        with self._lock:
+            if self._active_file is not None:
+                self._active_file.close()
+                self._active_file = None
+                self._active = None
+
+            if not self._lock_file.closed:
+                self._lock_file.close()
+                with _open_lock:
+                    _open_directories.discard(self.directory)
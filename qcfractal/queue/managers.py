@@ -6,21 +6,31 @@ import json
 import logging
 import sched
 import socket
+import threading
 import time
 import uuid
-from typing import Any, Callable, Dict, List, Optional, Union
+from queue import Queue
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 from pydantic import BaseModel, validator
+from qcelemental.util import msgpackext_dumps
 
 import qcengine as qcng
 from qcfractal.extras import get_information
 
 from ..interface.data import get_molecule
 from .adapters import build_queue_adapter
+from .journal import ResultJournal
 
 __all__ = ["QueueManager"]
 
 
+def _result_data(result: Any) -> Any:
+    """Returns the plain data of a completed task"""
+
+    return result.dict() if isinstance(result, BaseModel) else result
+
+
 class QueueStatistics(BaseModel):
     """
     Queue Manager Job statistics
@@ -105,6 +115,13 @@ class QueueManager:
         scratch_directory: Optional[str] = None,
         retries: Optional[int] = 2,
         configuration: Optional[Dict[str, Any]] = None,
+        pipelined: bool = False,
+        prefetch_tasks: int = 0,
+        refill_frequency: Union[int, float] = 1,
+        task_wait: Optional[float] = None,
+        exchange: bool = False,
+        journal_directory: Optional[str] = None,
+        upload_chunk_size: Optional[int] = 2 ** 25,
     ):
         """
         Parameters
@@ -154,6 +171,30 @@ class QueueManager:
             error will be raised.
         configuration : Optional[Dict[str, Any]], optional
             A JSON description of the settings used to create this object for the database.
+        pipelined : bool, optional
+            Push completed tasks from a background thread and keep a local buffer of prefetched tasks
+            so that freed task slots are refilled every ``refill_frequency`` seconds instead of waiting
+            for the next update.
+        prefetch_tasks : int, optional
+            Number of tasks to pull from the server beyond the open task slots in pipelined mode.
+        refill_frequency : Union[int, float], optional
+            The frequency in seconds to check for completed tasks and refill slots from the prefetch
+            buffer in pipelined mode.
+        task_wait : Optional[float], optional
+            If no tasks are available, ask the server to hold the request up to this many seconds
+            until new tasks are submitted instead of returning empty handed. Not supported in pipelined
+            mode, where the wait would hold up the refills of the scheduler.
+        exchange : bool, optional
+            Return completed tasks and pull new tasks with a single request to the server's exchange
+            endpoint instead of separate requests. Not used in pipelined mode or with ``task_wait``.
+        journal_directory : Optional[str], optional
+            Folder of an on-disk journal recording completed tasks before they are pushed to the server.
+            Tasks that were never delivered, e.g. because the manager crashed, are pushed again on the
+            next start. None disables the journal.
+        upload_chunk_size : Optional[int], optional
+            Completed tasks are pushed to the server in chunks of at most this many bytes, each
+            acknowledged on its own so that only failed chunks are retried. Tasks larger than a chunk
+            are pushed alone. None pushes all tasks of an update at once.
         """
 
         # Setup logging
@@ -162,6 +203,9 @@ class QueueManager:
         else:
             self.logger = logging.getLogger("QueueManager")
 
+        if pipelined and task_wait:
+            raise ValueError("Pipelined managers refill task slots on a schedule and cannot wait on the server.")
+
         self.name_data = {"cluster": manager_name, "hostname": socket.gethostname(), "uuid": str(uuid.uuid4())}
         self._name = self.name_data["cluster"] + "-" + self.name_data["hostname"] + "-" + self.name_data["uuid"]
 
@@ -204,10 +248,28 @@ class QueueManager:
         # Server response/stale job handling
         self.server_error_retries = server_error_retries
         self.stale_update_limit = stale_update_limit
+        self.upload_chunk_size = upload_chunk_size
         self._stale_updates_tracked = 0
         self._stale_payload_tracking = []
+        self._stale_lock = threading.Lock()
         self.n_stale_jobs = 0
 
+        # Pipelined mode: background result pushes and a buffer of prefetched tasks
+        self.pipelined = pipelined
+        self.prefetch_tasks = prefetch_tasks
+        self.refill_frequency = refill_frequency
+        self._task_buffer = []
+        self._send_queue = Queue()
+        self._sender = None
+        self._sender_error = None
+        self.task_wait = task_wait
+        self.exchange = exchange
+
+        # Completed tasks are journaled on disk until the server acknowledged them
+        self.journal = None
+        if journal_directory is not None:
+            self.journal = ResultJournal(journal_directory, logger=self.logger)
+
         # QCEngine data
         self.available_programs = qcng.list_available_programs()
         self.available_procedures = qcng.list_available_procedures()
@@ -268,6 +330,13 @@ class QueueManager:
 
             self.client._automodel_request("queue_manager", "put", payload)
 
+            # Undelivered results of a previous run are pushed with the retries of the first update
+            if self.journal is not None:
+                replayed = self.journal.replay()
+                if replayed:
+                    self.logger.info(f"Replaying {len(replayed)} undelivered complete tasks from the journal.")
+                    self._stale_payload_tracking.append([replayed, 0])
+
             if self.verbose:
                 self.logger.info("    Connected:")
                 self.logger.info("        Version:     {}".format(self.server_version))
@@ -343,10 +412,16 @@ class QueueManager:
             self.heartbeat()
             self.scheduler.enter(heartbeat_time, 1, scheduler_heartbeat)
 
+        def scheduler_refill():
+            self.refill()
+            self.scheduler.enter(self.refill_frequency, 3, scheduler_refill)
+
         self.logger.info("QueueManager successfully started.\n")
 
         self.scheduler.enter(0, 1, scheduler_update)
         self.scheduler.enter(0, 2, scheduler_heartbeat)
+        if self.pipelined:
+            self.scheduler.enter(self.refill_frequency, 3, scheduler_refill)
 
         self.scheduler.run()
 
@@ -404,6 +479,14 @@ class QueueManager:
         self.assert_connected()
 
         self.update(new_tasks=False, allow_shutdown=False)
+        self._stop_sender()
+        if self.journal is not None:
+            self.journal.close()
+
+        # Prefetched tasks are claimed by this manager and returned to the queue by the server
+        if self._task_buffer:
+            self.logger.info(f"Returning {len(self._task_buffer)} prefetched tasks.")
+            self._task_buffer = []
 
         payload = self._payload_template()
         payload["data"]["operation"] = "shutdown"
@@ -478,44 +561,52 @@ class QueueManager:
         """
         Attempt to post the previous payload failures
         """
-        clear_indices = []
-        for index, (results, attempts) in enumerate(self._stale_payload_tracking):
-            try:
-                self._post_update(results)
+        # The sender thread of pipelined mode appends failed pushes while this runs
+        with self._stale_lock:
+            tracked = list(self._stale_payload_tracking)
+
+        cleared = []
+        for entry in tracked:
+            results, attempts = entry
+            failed = self._push_results(self._chunk_results(results))
+            if not failed:
                 self.logger.info(f"Successfully pushed jobs from {attempts+1} updates ago")
-                clear_indices.append(index)
-            except IOError:
+                cleared.append(entry)
+                continue
 
-                # Tried and failed
-                attempts += 1
-                # Case: Still within the retry limit
-                if self.server_error_retries is None or self.server_error_retries > attempts:
-                    self._stale_payload_tracking[index][-1] = attempts
-                    self.logger.warning(f"Could not post jobs from {attempts} ago, will retry on next update.")
+            # Tried and failed, only the chunks which were not delivered are kept
+            entry[0] = failed
+            attempts += 1
+            # Case: Still within the retry limit
+            if self.server_error_retries is None or self.server_error_retries > attempts:
+                entry[-1] = attempts
+                self.logger.warning(f"Could not post jobs from {attempts} ago, will retry on next update.")
 
-                # Case: Over limit
-                else:
-                    self.logger.warning(
-                        f"Could not post jobs from {attempts} ago and over attempt limit, marking " f"jobs as stale."
-                    )
-                    self.n_stale_jobs += len(results)
-                    clear_indices.append(index)
+            # Case: Over limit
+            else:
+                self.logger.warning(
+                    f"Could not post jobs from {attempts} ago and over attempt limit, marking " f"jobs as stale."
+                )
+                cleared.append(entry)
+                with self._stale_lock:
+                    self.n_stale_jobs += len(failed)
                     self._stale_updates_tracked += 1
 
-        # Cleanup clear indices
-        for index in clear_indices[::-1]:
-            self._stale_payload_tracking.pop(index)
+        # Cleanup cleared payloads and check stale limiters
+        with self._stale_lock:
+            self._stale_payload_tracking = [x for x in self._stale_payload_tracking if all(x is not y for y in cleared)]
+            exceeded = (
+                self.stale_update_limit is not None
+                and (len(self._stale_payload_tracking) + self._stale_updates_tracked) > self.stale_update_limit
+            )
 
-        # Check stale limiters
-        if (
-            self.stale_update_limit is not None
-            and (len(self._stale_payload_tracking) + self._stale_updates_tracked) > self.stale_update_limit
-        ):
+        if exceeded:
             self.logger.error("Exceeded number of stale updates allowed! Attempting to shutdown gracefully...")
 
             # Log all not-quite stale jobs to stale
-            for (results, _) in self._stale_payload_tracking:
-                self.n_stale_jobs += len(results)
+            with self._stale_lock:
+                for (results, _) in self._stale_payload_tracking:
+                    self.n_stale_jobs += len(results)
             try:
                 if allow_shutdown:
                     self.shutdown()
@@ -537,9 +628,11 @@ class QueueManager:
         """
 
         self.assert_connected()
+        self._check_sender(allow_shutdown=allow_shutdown)
         self._update_stale_jobs(allow_shutdown=allow_shutdown)
 
         results = self.queue_adapter.acquire_complete()
+        self._journal_results(results)
 
         # Stats fetching for running tasks, as close to the time we got the jobs as we can
         last_time = self.statistics.last_update_time
@@ -560,52 +653,41 @@ class QueueManager:
         self.statistics.maximum_possible_walltime += timedelta_maximum_walltime
 
         # Process jobs
-        n_success = 0
-        n_fail = 0
         n_result = len(results)
-        task_cpu_hours = 0
-        error_payload = []
         jobs_pushed = f"Pushed {n_result} complete tasks to the server "
-        if n_result:
+        failed = {}
+        exchanged = []
+        use_exchange = self.exchange and not self.pipelined and not self.task_wait
+        exchange_limit = max(0, self.max_tasks - self.active + n_result) if new_tasks else 0
+        if n_result and self.pipelined:
+            self._push_background(results)
+            jobs_pushed = f"Queued {n_result} complete tasks for the server "
+        elif use_exchange and (n_result or exchange_limit):
+            # Results and the slots they free are exchanged for new tasks in one request, results
+            # beyond a single upload chunk are pushed ahead of it
+            chunks = self._chunk_results(results)
+            failed = self._push_results(chunks[:-1], allow_shutdown=allow_shutdown)
+
+            payload = self._payload_template()
+            payload["data"] = {"results": chunks[-1], "limit": exchange_limit}
             try:
-                self._post_update(results, allow_shutdown=allow_shutdown)
+                exchanged = self.client._automodel_request("queue_manager/exchange", "post", payload).tasks
+                self._mark_delivered(chunks[-1])
             except IOError:
-                if self.server_error_retries is None or self.server_error_retries > 0:
-                    self.logger.warning("Post complete tasks was not successful. Attempting again on next update.")
-                    self._stale_payload_tracking.append([results, 0])
-                    jobs_pushed = f"Tried to push {n_result} complete tasks to the server "
-                else:
-                    self.logger.warning("Post complete tasks was not successful. Data may be lost.")
-                    self.n_stale_jobs += len(results)
-                    jobs_pushed = f"Failed to push {n_result} complete tasks to the server "
-
-            self.active -= n_result
-            for key, result in results.items():
-                wall_time_seconds = 0
-                if result.success:
-                    n_success += 1
-                    if hasattr(result.provenance, "wall_time"):
-                        wall_time_seconds = float(result.provenance.wall_time)
-                else:
-                    error_payload.append(
-                        f"Job {key} failed: {result.error.error_type} - " f"Msg: {result.error.error_message}"
-                    )
-                    # Try to get the wall time in the most fault-tolerant way
-                    try:
-                        wall_time_seconds = float(result.input_data.get("provenance", {}).get("wall_time", 0))
-                    except AttributeError:
-                        # Trap the result.input_data is None, but let other attribute errors go
-                        if result.input_data is None:
-                            wall_time_seconds = 0
-                        else:
-                            raise
-                    except TypeError:
-                        # Trap wall time corruption, e.g. float(None)
-                        # Other Result corruptions will raise an error correctly
-                        wall_time_seconds = 0
+                exchanged = None
+                failed.update(chunks[-1])
+        elif n_result:
+            failed = self._push_results(self._chunk_results(results), allow_shutdown=allow_shutdown)
+
+        if failed:
+            if self._track_failed_push(failed):
+                self.logger.warning("Post complete tasks was not successful. Attempting again on next update.")
+                jobs_pushed = f"Tried to push {len(failed)} of {n_result} complete tasks to the server "
+            else:
+                self.logger.warning("Post complete tasks was not successful. Data may be lost.")
+                jobs_pushed = f"Failed to push {len(failed)} of {n_result} complete tasks to the server "
 
-                task_cpu_hours += wall_time_seconds * self.statistics.cores_per_task / 3600
-            n_fail = n_result - n_success
+        n_success, n_fail, error_payload = self._record_results(results)
 
         self.logger.info(jobs_pushed + f"({n_success} success / {n_fail} fail).")
         if n_fail:
@@ -616,9 +698,6 @@ class QueueManager:
         open_slots = max(0, self.max_tasks - self.active)
 
         # Crunch Statistics
-        self.statistics.total_failed_tasks += n_fail
-        self.statistics.total_successful_tasks += n_success
-        self.statistics.total_task_walltime += task_cpu_hours
         na_format = ""
         float_format = ",.2f"
         if self.statistics.total_completed_tasks == 0:
@@ -663,12 +742,34 @@ class QueueManager:
         if worker_stats_str is not None:
             self.logger.info(worker_stats_str)
 
-        if (new_tasks is False) or (open_slots == 0):
+        if new_tasks is False:
+            return True
+
+        if use_exchange:
+            if exchanged is None:
+                self.logger.warning("Acquisition of new tasks was not successful.")
+                return False
+
+            if exchange_limit:
+                self.logger.info("Acquired {} new tasks.".format(len(exchanged)))
+                self.queue_adapter.submit_tasks(exchanged)
+                self.active += len(exchanged)
+            return True
+
+        # Fill open slots from the prefetch buffer first, then top the buffer back up
+        limit = open_slots
+        if self.pipelined:
+            open_slots -= self._submit_buffered()
+            limit = open_slots + self.prefetch_tasks - len(self._task_buffer)
+
+        if limit <= 0:
             return True
 
         # Get new tasks
         payload = self._payload_template()
-        payload["data"]["limit"] = open_slots
+        payload["data"]["limit"] = limit
+        if self.task_wait:
+            payload["data"]["wait"] = self.task_wait
 
         try:
             new_tasks = self.client._automodel_request("queue_manager", "get", payload)
@@ -680,10 +781,230 @@ class QueueManager:
         self.logger.info("Acquired {} new tasks.".format(len(new_tasks)))
 
         # Add new tasks to queue
-        self.queue_adapter.submit_tasks(new_tasks)
-        self.active += len(new_tasks)
+        if self.pipelined:
+            self._task_buffer.extend(new_tasks)
+            self._submit_buffered()
+        else:
+            self.queue_adapter.submit_tasks(new_tasks)
+            self.active += len(new_tasks)
         return True
 
+    def refill(self) -> int:
+        """Pushes completed tasks and refills the freed task slots from the prefetch buffer.
+
+        Only talks to the server through the background sender, so it can run much more often than
+        ``update``. Does nothing unless the manager is pipelined.
+
+        Returns
+        -------
+        int
+            The number of tasks submitted from the prefetch buffer
+        """
+
+        if not self.pipelined:
+            return 0
+
+        results = self.queue_adapter.acquire_complete()
+        if results:
+            self._journal_results(results)
+            self._push_background(results)
+            n_success, n_fail, error_payload = self._record_results(results)
+            self.logger.debug(
+                f"Queued {len(results)} complete tasks for the server ({n_success} success / {n_fail} fail)."
+            )
+            for error in error_payload:
+                self.logger.warning(error)
+
+        n_submitted = self._submit_buffered()
+        if n_submitted:
+            self.logger.debug(f"Submitted {n_submitted} prefetched tasks, {len(self._task_buffer)} remain buffered.")
+
+        return n_submitted
+
+    def _submit_buffered(self) -> int:
+        """Submits prefetched tasks into the open task slots"""
+
+        n_submit = min(len(self._task_buffer), max(0, self.max_tasks - self.active))
+        if n_submit == 0:
+            return 0
+
+        tasks, self._task_buffer = self._task_buffer[:n_submit], self._task_buffer[n_submit:]
+        self.queue_adapter.submit_tasks(tasks)
+        self.active += n_submit
+        return n_submit
+
+    def _record_results(self, results: Dict[str, Any]) -> Tuple[int, int, List[str]]:
+        """Frees the task slots of completed tasks and adds them to the statistics"""
+
+        n_success = 0
+        task_cpu_hours = 0
+        error_payload = []
+
+        self.active -= len(results)
+        for key, result in results.items():
+            wall_time_seconds = 0
+            if result.success:
+                n_success += 1
+                if hasattr(result.provenance, "wall_time"):
+                    wall_time_seconds = float(result.provenance.wall_time)
+            else:
+                error_payload.append(
+                    f"Job {key} failed: {result.error.error_type} - " f"Msg: {result.error.error_message}"
+                )
+                # Try to get the wall time in the most fault-tolerant way
+                try:
+                    wall_time_seconds = float(result.input_data.get("provenance", {}).get("wall_time", 0))
+                except AttributeError:
+                    # Trap the result.input_data is None, but let other attribute errors go
+                    if result.input_data is None:
+                        wall_time_seconds = 0
+                    else:
+                        raise
+                except TypeError:
+                    # Trap wall time corruption, e.g. float(None)
+                    # Other Result corruptions will raise an error correctly
+                    wall_time_seconds = 0
+
+            task_cpu_hours += wall_time_seconds * self.statistics.cores_per_task / 3600
+
+        n_fail = len(results) - n_success
+
+        self.statistics.total_failed_tasks += n_fail
+        self.statistics.total_successful_tasks += n_success
+        self.statistics.total_task_walltime += task_cpu_hours
+
+        return n_success, n_fail, error_payload
+
+    def _track_failed_push(self, results: Dict[str, Any]) -> bool:
+        """Keeps results that could not be pushed for a retry on the next update.
+
+        Returns False if retries are disabled and the results were marked stale instead.
+        """
+
+        with self._stale_lock:
+            if self.server_error_retries is None or self.server_error_retries > 0:
+                self._stale_payload_tracking.append([results, 0])
+                return True
+
+            self.n_stale_jobs += len(results)
+            return False
+
+    def _chunk_results(self, results: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Splits completed tasks into chunks of at most ``upload_chunk_size`` serialized bytes"""
+
+        if (self.upload_chunk_size is None) or (len(results) < 2):
+            return [results]
+
+        chunks = [{}]
+        chunk_size = 0
+        for key, result in results.items():
+            size = len(msgpackext_dumps(_result_data(result)))
+            if chunks[-1] and (chunk_size + size > self.upload_chunk_size):
+                chunks.append({})
+                chunk_size = 0
+
+            chunks[-1][key] = result
+            chunk_size += size
+
+        return chunks
+
+    def _push_results(self, chunks: List[Dict[str, Any]], allow_shutdown: bool = True) -> Dict[str, Any]:
+        """Pushes chunks of completed tasks to the server, each chunk is acknowledged on its own.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The tasks of all chunks which could not be pushed, empty if all were delivered
+        """
+
+        failed = {}
+        for chunk in chunks:
+            if not chunk:
+                continue
+
+            try:
+                self._post_update(chunk, allow_shutdown=allow_shutdown)
+                self._mark_delivered(chunk)
+            except IOError:
+                failed.update(chunk)
+
+        if len(chunks) > 1:
+            self.logger.debug(f"Pushed {len(chunks)} chunks of complete tasks, {len(failed)} tasks failed.")
+
+        return failed
+
+    def _journal_results(self, results: Dict[str, Any]) -> None:
+        """Durably records completed tasks before the first push attempt"""
+
+        if self.journal is not None and results:
+            self.journal.append({k: _result_data(v) for k, v in results.items()})
+
+    def _mark_delivered(self, results: Dict[str, Any]) -> None:
+        """Drops tasks acknowledged by the server from the journal"""
+
+        if self.journal is not None:
+            self.journal.mark_delivered(results.keys())
+
+    ## Pipelined result pushes
+
+    def _push_background(self, results: Dict[str, Any]) -> None:
+        """Hands results to the sender thread, starting it if needed"""
+
+        if self._sender is None or not self._sender.is_alive():
+            self._sender = threading.Thread(target=self._sender_loop, name="QueueManagerSender", daemon=True)
+            self._sender.start()
+
+        self._send_queue.put(results)
+
+    def _sender_loop(self) -> None:
+        while True:
+            results = self._send_queue.get()
+            try:
+                if results is None:
+                    return
+
+                try:
+                    failed = self._push_results(self._chunk_results(results), allow_shutdown=False)
+                except Exception as fatal:
+                    # Raised in the main thread by the next update
+                    self._sender_error = fatal
+                    failed = {}
+
+                if failed and self._track_failed_push(failed):
+                    self.logger.warning(
+                        f"Background push of {len(failed)} complete tasks was not successful. "
+                        "Attempting again on next update."
+                    )
+                elif failed:
+                    self.logger.warning(
+                        f"Background push of {len(failed)} complete tasks was not successful. Data may be lost."
+                    )
+            finally:
+                self._send_queue.task_done()
+
+    def _check_sender(self, allow_shutdown: bool = True) -> None:
+        """Raises an unexpected error of the sender thread, shutting down as best as possible"""
+
+        if self._sender_error is None:
+            return
+
+        fatal, self._sender_error = self._sender_error, None
+        try:
+            if allow_shutdown:
+                self.shutdown()
+        finally:
+            raise fatal
+
+    def _stop_sender(self) -> None:
+        """Waits for all queued results to be pushed and stops the sender thread"""
+
+        if self._sender is None:
+            return
+
+        self._send_queue.put(None)
+        self._sender.join()
+        self._sender = None
+
     def await_results(self) -> bool:
         """A synchronous method for testing or small launches
         that awaits task completion.
@@ -699,6 +1020,9 @@ class QueueManager:
         self.update()
         self.queue_adapter.await_results()
         self.update(new_tasks=False)
+
+        # Pipelined pushes complete in the background
+        self._send_queue.join()
         return True
 
     def list_current_tasks(self) -> List[Any]:
@@ -0,0 +1,129 @@
+"""
+Long-poll support for queue managers waiting on new tasks.
+"""
+
+import datetime
+from typing import Any, Dict, List, Optional, Union
+
+import tornado.gen
+import tornado.util
+from tornado.concurrent import Future
+
+
+class TaskWaiters:
+    """
+    Parks the task requests of queue managers until tasks they are able to compute are announced.
+
+    Waiters are registered and woken on the IOLoop, announcements from other threads must go
+    through ``notify_threadsafe``.
+    """
+
+    def __init__(self, loop: "IOLoop", max_wait: float = 60):
+        """
+        Parameters
+        ----------
+        loop : IOLoop
+            The IOLoop the waiting requests run on.
+        max_wait : float, optional
+            The maximum time in seconds a request may wait for new tasks.
+        """
+
+        self.loop = loop
+        self.max_wait = max_wait
+        self._waiters = {}
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    def subscribe(self, programs: List[str], procedures: List[str], tag: Optional[Union[str, List[str]]]) -> Future:
+        """Registers a waiter for tasks a manager is able to compute.
+
+        Parameters
+        ----------
+        programs : List[str]
+            The programs available to the manager.
+        procedures : List[str]
+            The procedures available to the manager.
+        tag : Optional[Union[str, List[str]]]
+            The tags the manager pulls from, None for any tag.
+
+        Returns
+        -------
+        Future
+            A future resolved once matching tasks may be available. It must be passed to
+            ``unsubscribe`` once the request stops waiting.
+        """
+
+        if isinstance(tag, str):
+            tag = [tag]
+
+        future = Future()
+        self._waiters[future] = (
+            {x.lower() for x in programs},
+            {x.lower() for x in procedures},
+            None if tag is None else set(tag),
+        )
+        return future
+
+    def unsubscribe(self, future: Optional[Future]) -> None:
+        self._waiters.pop(future, None)
+
+    async def wait(self, future: Future, timeout: float) -> bool:
+        """Waits on a subscribed future for at most ``timeout`` seconds.
+
+        Returns
+        -------
+        bool
+            True if matching tasks were announced, False if the wait timed out.
+        """
+
+        if timeout <= 0:
+            return future.done()
+
+        try:
+            await tornado.gen.with_timeout(datetime.timedelta(seconds=timeout), future)
+            return True
+        except tornado.util.TimeoutError:
+            return False
+
+    @staticmethod
+    def _matches(waiter, task: Dict[str, Any]) -> bool:
+        programs, procedures, tags = waiter
+
+        if (task.get("program") or "").lower() not in programs:
+            return False
+
+        if task.get("procedure") is not None and task["procedure"].lower() not in procedures:
+            return False
+
+        return (tags is None) or (task.get("tag") in tags)
+
+    def notify(self, tasks: Optional[List[Dict[str, Any]]]) -> int:
+        """Wakes the waiters able to compute any of the announced tasks, must be called on the IOLoop.
+
+        Parameters
+        ----------
+        tasks : Optional[List[Dict[str, Any]]]
+            The ``tag``, ``program`` and ``procedure`` of the new tasks, None wakes all waiters.
+
+        Returns
+        -------
+        int
+            The number of woken waiters.
+        """
+
+        woken = 0
+        for future, waiter in list(self._waiters.items()):
+            if future.done():
+                continue
+
+            if tasks is None or any(self._matches(waiter, task) for task in tasks):
+                future.set_result(True)
+                woken += 1
+
+        return woken
+
+    def notify_threadsafe(self, tasks: Optional[List[Dict[str, Any]]]) -> None:
+        """Schedules ``notify`` on the IOLoop, may be called from any thread."""
+
+        self.loop.add_callback(self.notify, tasks)
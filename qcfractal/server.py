@@ -4,6 +4,7 @@ The FractalServer class
 
 import asyncio
 import datetime
+import functools
 import logging
 import ssl
 import time
@@ -11,14 +12,26 @@ import traceback
 from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional, Union
 
+import tornado.gen
 import tornado.ioloop
+import tornado.locks
 import tornado.log
+import tornado.netutil
 import tornado.options
+import tornado.process
 import tornado.web
 
 from .extras import get_information
 from .interface import FractalClient
-from .queue import QueueManager, QueueManagerHandler, ServiceQueueHandler, TaskQueueHandler
+from .interface.util import body_encodings
+from .queue import (
+    QueueManager,
+    QueueManagerExchangeHandler,
+    QueueManagerHandler,
+    ServiceQueueHandler,
+    TaskQueueHandler,
+    TaskWaiters,
+)
 from .services import construct_service
 from .storage_sockets import ViewHandler, storage_socket_factory
 from .storage_sockets.api_logger import API_AccessLogger
@@ -96,6 +109,10 @@ class FractalServer:
         port: int = 7777,
         loop: "IOLoop" = None,
         compress_response: bool = True,
+        workers: int = 1,
+        api_workers: int = 8,
+        queue_api_workers: int = 4,
+        api_concurrency: Optional[Dict[str, int]] = None,
         # Security
         security: Optional[str] = None,
         allow_read: bool = False,
@@ -103,6 +120,9 @@ class FractalServer:
         # Database options
         storage_uri: str = "postgresql://localhost:5432",
         storage_project_name: str = "qcfractal_default",
+        storage_replica_uris: Optional[List[str]] = None,
+        storage_replica_max_lag: float = 30,
+        storage_pools: Optional[Dict[str, Dict[str, Any]]] = None,
         query_limit: int = 1000,
         # View options
         view_enabled: bool = False,
@@ -114,6 +134,8 @@ class FractalServer:
         # Queue options
         queue_socket: "BaseAdapter" = None,
         heartbeat_frequency: float = 1800,
+        max_task_wait: float = 60,
+        queue_notify: Optional[bool] = None,
         # Service options
         max_active_services: int = 20,
         service_frequency: float = 60,
@@ -133,6 +155,17 @@ class FractalServer:
         compress_response : bool, optional
             Automatic compression of responses, turn on unless behind a proxy that
             provides this capability.
+        workers : int, optional
+            The number of server processes to pre-fork, all processes share the listening socket.
+            Only the first worker runs the periodic updates (services, heartbeats, server logs).
+        api_workers : int, optional
+            The number of threads used to run blocking storage calls for the API handlers.
+        queue_api_workers : int, optional
+            The number of threads used to run the storage calls of queue managers, separate from ``api_workers``
+            so that manager heartbeats and task requests never wait behind other API calls.
+        api_concurrency : Optional[Dict[str, int]], optional
+            Maximum number of concurrent storage calls per endpoint (e.g., ``{"queue_manager": 2}``).
+            Endpoints which are not listed are only bounded by ``api_workers``.
         security : Optional[str], optional
             The security options for the server {None, "local"}. The local security
             option uses the database to cache users.
@@ -144,6 +177,16 @@ class FractalServer:
             The database URI that the underlying storage socket will connect to.
         storage_project_name : str, optional
             The project name to use on the database.
+        storage_replica_uris : Optional[List[str]], optional
+            URIs of read replicas of the database, read-only queries are spread over them.
+        storage_replica_max_lag : float, optional
+            The replication lag (in seconds) beyond which a replica is no longer read from.
+        storage_pools : Optional[Dict[str, Dict[str, Any]]], optional
+            Overrides of the ``pool_size``, ``max_overflow`` and ``pool_timeout`` of the "interactive",
+            "queue" (manager traffic) and "background" (periodic updates) database connection pools.
+            Every worker process holds its own pools, the sum of ``pool_size`` and ``max_overflow`` over all
+            pools (14 by default, plus one connection for ``queue_notify``) times ``workers`` must stay below the
+            ``max_connections`` of the database (100 by default in Postgres).
         query_limit : int, optional
             The maximum number of entries a query will return.
         logfile_prefix : str, optional
@@ -153,6 +196,12 @@ class FractalServer:
             Should only be used for testing and interactive sessions.
         heartbeat_frequency : float, optional
             The time (in seconds) of the heartbeat manager frequency.
+        max_task_wait : float, optional
+            The maximum time (in seconds) a manager's request for new tasks may wait for tasks to be
+            submitted if none are available (long-poll). Zero disables waiting.
+        queue_notify : Optional[bool], optional
+            Announce new tasks through Postgres LISTEN/NOTIFY so that waiting managers are woken by tasks
+            submitted to any server process. Defaults to True when running multiple workers.
         max_active_services : int, optional
             The maximum number of active Services that can be running at any given time.
         service_frequency : float, optional
@@ -178,12 +227,6 @@ class FractalServer:
         tornado.log.enable_pretty_logging()
         self.logger = logging.getLogger("tornado.application")
 
-        # Create API Access logger class if enables
-        if log_apis:
-            self.api_logger = API_AccessLogger(geo_file_path=geo_file_path)
-        else:
-            self.api_logger = None
-
         # Build security layers
         if security is None:
             storage_bypass_security = True
@@ -217,12 +260,16 @@ class FractalServer:
             ssl_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
             ssl_ctx.load_cert_chain(ssl_options["crt"], ssl_options["key"])
 
-            # Destroy keyfiles upon close
+            # Destroy keyfiles upon close, every forked worker will attempt this
             import atexit
             import os
 
-            atexit.register(os.remove, cert_name)
-            atexit.register(os.remove, key_name)
+            def _remove_keyfiles():
+                for filename in [cert_name, key_name]:
+                    if os.path.exists(filename):
+                        os.remove(filename)
+
+            atexit.register(_remove_keyfiles)
             self.client_verify = False
 
         elif ssl_options is False:
@@ -237,7 +284,25 @@ class FractalServer:
         else:
             raise KeyError("ssl_options not understood")
 
-        # Setup the database connection
+        # Pre-fork the workers before any IOLoop, thread, or database connection is created
+        if workers < 1:
+            raise ValueError("The number of workers must be at least one.")
+
+        self.workers = workers
+        self.task_id = 0
+        sockets = None
+        if self.workers > 1:
+            if loop is not None:
+                raise ValueError("Cannot provide an IOLoop when running multiple workers.")
+
+            if queue_socket is not None:
+                raise ValueError("Cannot use an internal QueueManager when running multiple workers.")
+
+            sockets = tornado.netutil.bind_sockets(self.port)
+            self.task_id = tornado.process.fork_processes(self.workers)
+
+        # Setup the database connection, each worker holds its own connection pool
+        self.queue_notify = (self.workers > 1) if queue_notify is None else queue_notify
         self.storage_database = storage_project_name
         self.storage_uri = storage_uri
         self.storage = storage_socket_factory(
@@ -247,8 +312,18 @@ class FractalServer:
             allow_read=allow_read,
             max_limit=query_limit,
             skip_version_check=skip_storage_version_check,
+            read_replica_uris=storage_replica_uris,
+            replica_max_lag=storage_replica_max_lag,
+            pools=storage_pools,
+            queue_notify=self.queue_notify,
         )
 
+        # Create API Access logger class if enables, writes in a background thread
+        if log_apis:
+            self.api_logger = API_AccessLogger(geo_file_path=geo_file_path, storage_socket=self.storage)
+        else:
+            self.api_logger = None
+
         if view_enabled:
             self.view_handler = ViewHandler(view_path)
         else:
@@ -257,12 +332,32 @@ class FractalServer:
         # Pull the current loop if we need it
         self.loop = loop or tornado.ioloop.IOLoop.current()
 
+        # Storage calls from the API handlers run on a bounded executor so the IOLoop is never blocked,
+        # queue managers have their own so that they never wait behind interactive queries
+        self.api_workers = api_workers
+        self.queue_api_workers = queue_api_workers
+        self.storage_executor = ThreadPoolExecutor(max_workers=api_workers, thread_name_prefix="fractal_api")
+        self.queue_executor = ThreadPoolExecutor(max_workers=queue_api_workers, thread_name_prefix="fractal_queue_api")
+        self.api_limits = {k: tornado.locks.Semaphore(v) for k, v in (api_concurrency or {}).items()}
+
+        # Managers waiting for new tasks, woken directly by this process or through the database
+        self.task_waiters = TaskWaiters(self.loop, max_wait=max_task_wait)
+        self._queue_listen_conn = None
+        self._queue_listen_fd = None
+        self._queue_listening = False
+        if not self.queue_notify:
+            self.storage.add_queue_listener(self.task_waiters.notify_threadsafe)
+
         # Build up the application
         self.objects = {
             "storage_socket": self.storage,
             "logger": self.logger,
             "api_logger": self.api_logger,
             "view_handler": self.view_handler,
+            "storage_executor": self.storage_executor,
+            "queue_executor": self.queue_executor,
+            "api_limits": self.api_limits,
+            "task_waiters": self.task_waiters,
         }
 
         # Public information
@@ -273,6 +368,7 @@ class FractalServer:
             "query_limit": self.storage.get_limit(1.0e9),
             "client_lower_version_limit": "0.12.1",  # Must be XX.YY.ZZ
             "client_upper_version_limit": "0.13.99",  # Must be XX.YY.ZZ
+            "request_encodings": body_encodings(),
         }
         self.update_public_information()
 
@@ -291,6 +387,7 @@ class FractalServer:
             (r"/task_queue", TaskQueueHandler, self.objects),
             (r"/service_queue", ServiceQueueHandler, self.objects),
             (r"/queue_manager", QueueManagerHandler, self.objects),
+            (r"/queue_manager/exchange", QueueManagerExchangeHandler, self.objects),
         ]
 
         # Build the app
@@ -300,7 +397,10 @@ class FractalServer:
 
         self.http_server = tornado.httpserver.HTTPServer(self.app, ssl_options=ssl_ctx)
 
-        self.http_server.listen(self.port)
+        if sockets is None:
+            self.http_server.listen(self.port)
+        else:
+            self.http_server.add_sockets(sockets)
 
         # Add periodic callback holders
         self.periodic = {}
@@ -314,7 +414,13 @@ class FractalServer:
         self.logger.info("    Address:       {}".format(self._address))
         self.logger.info("    Database URI:  {}".format(storage_uri))
         self.logger.info("    Database Name: {}".format(storage_project_name))
-        self.logger.info("    Query Limit:   {}\n".format(self.storage.get_limit(1.0e9)))
+        self.logger.info("    Read Replicas: {}".format(len(storage_replica_uris or [])))
+        self.logger.info("    Query Limit:   {}".format(self.storage.get_limit(1.0e9)))
+        self.logger.info("    Workers:       {} (worker {})".format(self.workers, self.task_id))
+        self.logger.info("    API Workers:   {} (queue {})".format(self.api_workers, self.queue_api_workers))
+        capacity = [x["capacity"] for x in self.storage.get_pool_statistics().values()]
+        capacity = "unbounded" if None in capacity else "up to {}".format(sum(capacity))
+        self.logger.info("    Connections:   {} per worker\n".format(capacity))
         self.loop_active = False
 
         # Create a executor for background processes
@@ -356,6 +462,75 @@ class FractalServer:
         fut = self.loop.run_in_executor(self.executor, func)
         return fut
 
+    def _in_background(self, func):
+        """
+        Wraps a periodic update so that its queries use the background connection pool
+        """
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.storage.workload("background"):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    async def _listen_queue(self) -> None:
+        """
+        Opens the connection listening for task announcements, retrying with backoff until it succeeds
+        """
+
+        delay = 1
+        while self._queue_listening and self._queue_listen_conn is None:
+            try:
+                conn = await self.loop.run_in_executor(self.executor, self.storage.queue_listen)
+            except Exception as err:
+                self.logger.warning(f"Could not listen for task announcements, retrying in {delay}s: {err}")
+                await tornado.gen.sleep(delay)
+                delay = min(2 * delay, 60)
+                continue
+
+            if not self._queue_listening:
+                conn.close()
+                return
+
+            self._queue_listen_conn = conn
+            self._queue_listen_fd = conn.fileno()
+            self.loop.add_handler(self._queue_listen_fd, self._read_queue_notifications, self.loop.READ)
+
+            # Announcements may have been missed while disconnected
+            self.task_waiters.notify(None)
+
+    def _read_queue_notifications(self, fd, events) -> None:
+
+        try:
+            notifications = self.storage.queue_notifications(self._queue_listen_conn)
+        except Exception as err:
+            self.logger.warning(f"Lost the connection listening for task announcements, reconnecting: {err}")
+            self._close_queue_listen()
+            self.loop.add_callback(self._listen_queue)
+            return
+
+        for tasks in notifications:
+            self.task_waiters.notify(tasks)
+
+    def _close_queue_listen(self) -> None:
+
+        conn = self._queue_listen_conn
+        if conn is None:
+            return
+
+        self._queue_listen_conn = None
+        self.loop.remove_handler(self._queue_listen_fd)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @property
+    def owns_periodics(self) -> bool:
+        """Whether this process is responsible for the server periodic updates."""
+        return self.task_id == 0
+
     ## Start/stop functionality
 
     def start(self, start_loop: bool = True, start_periodics: bool = True) -> None:
@@ -368,7 +543,8 @@ class FractalServer:
             If False, does not start the IOLoop
         start_periodics : bool, optional
             If False, does not start the server periodic updates such as
-            Service iterations and Manager heartbeat checking.
+            Service iterations and Manager heartbeat checking. When running multiple
+            workers, only the first worker starts the periodic updates.
         """
         if "queue_manager_future" in self.futures:
 
@@ -379,30 +555,39 @@ class FractalServer:
             # Call this after the loop has started
             self._run_in_thread(start_manager)
 
-        # Add services callback
-        if start_periodics:
-            nanny_services = tornado.ioloop.PeriodicCallback(self.update_services, self.service_frequency * 1000)
+        # Add services callback, only a single worker may own these
+        if start_periodics and self.owns_periodics:
+            nanny_services = tornado.ioloop.PeriodicCallback(
+                self._in_background(self.update_services), self.service_frequency * 1000
+            )
             nanny_services.start()
             self.periodic["update_services"] = nanny_services
 
             # Check Manager heartbeats, 5x heartbeat frequency
             heartbeats = tornado.ioloop.PeriodicCallback(
-                self.check_manager_heartbeats, self.heartbeat_frequency * 1000 * 0.2
+                self._in_background(self.check_manager_heartbeats), self.heartbeat_frequency * 1000 * 0.2
             )
             heartbeats.start()
             self.periodic["heartbeats"] = heartbeats
 
             # Log can take some time, update in thread
             def run_log_update_in_thread():
-                self._run_in_thread(self.update_server_log)
+                self._run_in_thread(self._in_background(self.update_server_log))
 
             server_log = tornado.ioloop.PeriodicCallback(run_log_update_in_thread, self.heartbeat_frequency * 1000)
 
             server_log.start()
             self.periodic["server_log"] = server_log
 
+        # Task announcements of all server processes wake the waiting managers of this one
+        if self.queue_notify and not self._queue_listening:
+            self._queue_listening = True
+            self.loop.add_callback(self._listen_queue)
+
         # Build callbacks which are always required
-        public_info = tornado.ioloop.PeriodicCallback(self.update_public_information, self.heartbeat_frequency * 1000)
+        public_info = tornado.ioloop.PeriodicCallback(
+            self._in_background(self.update_public_information), self.heartbeat_frequency * 1000
+        )
         public_info.start()
         self.periodic["public_info"] = public_info
 
@@ -430,10 +615,17 @@ class FractalServer:
         for cb in self.periodic.values():
             cb.stop()
 
+        self._queue_listening = False
+        self._close_queue_listen()
+
         # Call exit callbacks
         for func, args, kwargs in self.exit_callbacks:
             func(*args, **kwargs)
 
+        # Write out any queued access logs
+        if self.api_logger is not None:
+            self.api_logger.stop()
+
         # Shutdown executor and futures
         for k, v in self.futures.items():
             v.cancel()
@@ -441,6 +633,9 @@ class FractalServer:
         if self.executor is not None:
             self.executor.shutdown()
 
+        self.storage_executor.shutdown()
+        self.queue_executor.shutdown()
+
         # Shutdown IOLoop if needed
         if (asyncio.get_event_loop().is_running()) and stop_loop:
             self.loop.stop()
@@ -497,60 +692,76 @@ class FractalServer:
         """Runs through all active services and examines their current status.
         """
 
-        # Grab current services
-        current_services = self.storage.get_services(status="RUNNING")["data"]
-
-        # Grab new services if we have open slots
-        open_slots = max(0, self.max_active_services - len(current_services))
-        if open_slots > 0:
-            new_services = self.storage.get_services(status="WAITING", limit=open_slots)["data"]
-            current_services.extend(new_services)
-            if len(new_services):
-                self.logger.info(f"Starting {len(new_services)} new services.")
-
-        self.logger.debug(f"Updating {len(current_services)} services.")
-
-        # Loop over the services and iterate
-        running_services = 0
-        completed_services = []
-        for data in current_services:
-
-            # Attempt to iteration and get message
-            try:
-                service = construct_service(self.storage, self.logger, data)
-                finished = service.iterate()
-            except Exception:
-                error_message = "FractalServer Service Build and Iterate Error:\n{}".format(traceback.format_exc())
-                self.logger.error(error_message)
-                service.status = "ERROR"
-                service.error = {"error_type": "iteration_error", "error_message": error_message}
-                finished = False
-
-            self.storage.update_services([service])
-
-            # Mark procedure and service as error
-            if service.status == "ERROR":
-                self.storage.update_service_status("ERROR", id=service.id)
-
-            if finished is not False:
-                # Add results to procedures, remove complete_ids
-                completed_services.append(service)
-            else:
-                running_services += 1
-
-        if len(completed_services):
-            self.logger.info(f"Completed {len(completed_services)} services.")
-
-        # Add new procedures and services
-        self.storage.services_completed(completed_services)
-
-        return running_services
+        # Services read back their own writes, never from a read replica
+        with self.storage.primary():
+            # Grab current services
+            current_services = self.storage.get_services(status="RUNNING")["data"]
+
+            # Grab new services if we have open slots
+            open_slots = max(0, self.max_active_services - len(current_services))
+            if open_slots > 0:
+                new_services = self.storage.get_services(status="WAITING", limit=open_slots)["data"]
+                current_services.extend(new_services)
+                if len(new_services):
+                    self.logger.info(f"Starting {len(new_services)} new services.")
+
+            self.logger.debug(f"Updating {len(current_services)} services.")
+
+            # Loop over the services and iterate
+            running_services = 0
+            completed_services = []
+            for data in current_services:
+
+                # Attempt to iteration and get message
+                try:
+                    service = construct_service(self.storage, self.logger, data)
+                    finished = service.iterate()
+                except Exception:
+                    error_message = "FractalServer Service Build and Iterate Error:\n{}".format(traceback.format_exc())
+                    self.logger.error(error_message)
+                    service.status = "ERROR"
+                    service.error = {"error_type": "iteration_error", "error_message": error_message}
+                    finished = False
+
+                self.storage.update_services([service])
+
+                # Mark procedure and service as error
+                if service.status == "ERROR":
+                    self.storage.update_service_status("ERROR", id=service.id)
+
+                if finished is not False:
+                    # Add results to procedures, remove complete_ids
+                    completed_services.append(service)
+                else:
+                    running_services += 1
+
+            if len(completed_services):
+                self.logger.info(f"Completed {len(completed_services)} services.")
+
+            # Add new procedures and services
+            self.storage.services_completed(completed_services)
+
+            return running_services
 
     def update_server_log(self) -> Dict[str, Any]:
         """
         Updates the servers internal log
         """
 
+        for name, stats in self.storage.get_pool_statistics().items():
+            self.logger.info(
+                f"Connection pool {name}: {stats['in_use']}/{stats['capacity']} in use (peak {stats['in_use_peak']}), "
+                f"{stats['checkouts']} checkouts, wait mean {stats['wait_mean']:.3f}s max {stats['wait_max']:.3f}s, "
+                f"{stats['timeouts']} timeouts"
+            )
+
+        for i, replica in enumerate(self.storage.get_replica_status()):
+            if replica["healthy"]:
+                self.logger.info(f"Read replica {i}: healthy, lag {replica['lag']:.1f}s")
+            else:
+                reason = replica["error"] or f"lag {replica['lag']:.1f}s"
+                self.logger.warning(f"Read replica {i}: unhealthy, {reason}")
+
         return self.storage.log_server_stats()
 
     def update_public_information(self) -> None:
@@ -560,13 +771,18 @@ class FractalServer:
         data = self.storage.get_server_stats_log(limit=1)["data"]
 
         counts = {"collection": 0, "molecule": 0, "result": 0, "kvstore": 0}
+        result_states = {}
         if len(data):
             counts["collection"] = data[0].get("collection_count", 0)
             counts["molecule"] = data[0].get("molecule_count", 0)
             counts["result"] = data[0].get("result_count", 0)
             counts["kvstore"] = data[0].get("kvstore_count", 0)
+            result_states = data[0].get("result_states") or {}
+
+        # Replica addresses are not public, only their health
+        read_replicas = [{"healthy": x["healthy"], "lag": x["lag"]} for x in self.storage.get_replica_status()]
 
-        update = {"counts": counts}
+        update = {"counts": counts, "result_states": result_states, "read_replicas": read_replicas}
         self.objects["public_information"].update(update)
 
     def check_manager_heartbeats(self) -> None:
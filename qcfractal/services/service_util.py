@@ -79,6 +79,7 @@ class TaskManager(ProtoModel):
         procedure_parser = get_procedure_parser(procedure_type, self.storage_socket, self.logger)
 
         required_tasks = {}
+        new_tasks = []
 
         # Add in all new tasks
         for key, packet in tasks.items():
@@ -87,13 +88,16 @@ class TaskManager(ProtoModel):
             packet = TaskQueuePOSTBody(**packet)
 
             # Turn packet into a full task, if there are duplicates, get the ID
-            r = procedure_parser.submit_tasks(packet)
+            packet_tasks, results_ids, existing_ids, errors = procedure_parser.parse_input(packet)
 
-            if len(r["meta"]["errors"]):
+            if len(errors):
                 raise KeyError("Problem submitting task: {}.".format(errors))
 
-            # print("Submission:", r["data"])
-            required_tasks[key] = r["data"]["ids"][0]
+            required_tasks[key] = results_ids[0]
+            new_tasks.extend(packet_tasks)
+
+        # Submit the tasks of the whole iteration at once
+        self.storage_socket.queue_submit(new_tasks)
 
         self.required_tasks = required_tasks
 
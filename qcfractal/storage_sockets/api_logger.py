@@ -5,19 +5,59 @@ https://www.maxmind.com
 (attribution requirement)
 """
 
+import datetime
+import functools
 import logging
+import threading
+from collections import deque
 
 logger = logging.getLogger(__name__)
 
+_geo_fields = ["city", "country", "country_code", "ip_lat", "ip_long", "postal_code", "subdivision"]
+
 
 class API_AccessLogger:
     """
     Extract access information from HTTP requests to be saved by the database
     Calculate geo data using geoip2 if the library and its files are available
     otherwise, just extracts the basic information
+
+    If a storage socket is provided, access logs can be queued with ``log_access``
+    and are written in bulk by a background thread. GeoIP lookups are then done by
+    the background thread and cached per IP address. When the queue grows past
+    ``max_queue_size // 2`` only one in ``overload_sample`` entries is kept and once
+    the queue is full new entries are dropped, logging never adds request latency.
     """
 
-    def __init__(self, geo_file_path):
+    def __init__(
+        self,
+        geo_file_path,
+        storage_socket=None,
+        flush_interval=5.0,
+        flush_size=500,
+        max_queue_size=10000,
+        overload_sample=10,
+        geo_cache_size=4096,
+    ):
+
+        # Memoize lookups, clients tend to hit the server many times from the same address
+        self.get_geoip2_data = functools.lru_cache(maxsize=geo_cache_size)(self._get_geoip2_data)
+
+        self.storage_socket = storage_socket
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_queue_size = max_queue_size
+        self.overload_sample = overload_sample
+
+        self.n_logged = 0
+        self.n_dropped = 0
+        self._n_overloaded = 0
+        self._queue = deque()
+        self._flush_lock = threading.Lock()
+        self._count_lock = threading.Lock()  # n_logged and n_dropped are updated by the request and writer threads
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._writer = None
 
         self.geoip2_reader = None
         try:
@@ -39,9 +79,16 @@ class API_AccessLogger:
                 f"(default base_folder is ~/.qca/qcfractal/qcfractal_config.yaml)."
             )
 
-    def get_api_access_log(self, request, access_type=None, extra_params=None):
+        if self.storage_socket is not None:
+            self._writer = threading.Thread(target=self._writer_loop, name="api_access_logger", daemon=True)
+            self._writer.start()
 
-        log = {}
+    def _base_access_log(self, request, access_type=None, extra_params=None):
+        """
+        Extracts the request information, does not include geo data.
+        """
+
+        log = {"access_date": datetime.datetime.utcnow()}
 
         if not access_type:
             log["access_type"] = request.uri[1:]  # remove /
@@ -61,13 +108,125 @@ class API_AccessLogger:
         # Or, will saved as string anyway
         # log.extra_access_params = request.json
 
+        return log
+
+    def get_api_access_log(self, request, access_type=None, extra_params=None):
+
+        log = self._base_access_log(request, access_type=access_type, extra_params=extra_params)
+
         # extra geo data if available
         extra = self.get_geoip2_data(log["ip_address"])
         log.update(extra)
 
         return log
 
-    def get_geoip2_data(self, ip_address):
+    def log_access(self, request, access_type=None, extra_params=None) -> bool:
+        """
+        Queues an access log to be written by the background writer.
+
+        Parameters
+        ----------
+        request : tornado.httputil.HTTPServerRequest
+            The request to log
+        access_type : str, optional
+            The access type, defaults to the request uri
+        extra_params : str, optional
+            Additional serialized request parameters
+
+        Returns
+        -------
+        bool
+            True if the entry was queued, False if it was dropped due to overload.
+        """
+
+        if self.storage_socket is None:
+            raise AttributeError("No storage socket was provided, cannot queue access logs.")
+
+        qsize = len(self._queue)
+        with self._count_lock:
+            if qsize >= self.max_queue_size:
+                self.n_dropped += 1
+                return False
+
+            # Under heavy load only keep a sample of the entries
+            if qsize >= (self.max_queue_size // 2):
+                self._n_overloaded += 1
+                if self._n_overloaded % self.overload_sample:
+                    self.n_dropped += 1
+                    return False
+
+        self._queue.append(self._base_access_log(request, access_type=access_type, extra_params=extra_params))
+        if qsize + 1 >= self.flush_size:
+            self._wake.set()
+
+        return True
+
+    def flush(self) -> int:
+        """
+        Writes all queued access logs to the database.
+
+        Returns
+        -------
+        int
+            The number of access logs written.
+        """
+
+        nwritten = 0
+        with self._flush_lock:
+            while self._queue:
+                batch = []
+                while self._queue and (len(batch) < self.flush_size):
+                    log = self._queue.popleft()
+
+                    # Every row needs the same columns for a multi-row insert
+                    geo = self.get_geoip2_data(log["ip_address"])
+                    log.update({k: geo.get(k, None) for k in _geo_fields})
+                    batch.append(log)
+
+                try:
+                    with self.storage_socket.workload("background"):
+                        self.storage_socket.save_access(batch)
+                except Exception as e:
+                    logger.error(f"Failed to write {len(batch)} access logs: {str(e)}")
+                    with self._count_lock:
+                        self.n_dropped += len(batch)
+                    continue
+
+                nwritten += len(batch)
+
+        with self._count_lock:
+            self.n_logged += nwritten
+        return nwritten
+
+    def _writer_loop(self):
+
+        ndropped = 0
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+            with self._count_lock:
+                n_dropped = self.n_dropped
+            if n_dropped > ndropped:
+                logger.warning(f"Access logging overloaded, dropped {n_dropped - ndropped} entries.")
+                ndropped = n_dropped
+
+    def stop(self):
+        """
+        Stops the background writer and writes out any remaining access logs.
+        """
+
+        if self._writer is None:
+            return
+
+        self._stop.set()
+        self._wake.set()
+        self._writer.join()
+        self._writer = None
+        self.flush()
+
+    def _get_geoip2_data(self, ip_address):
         out = {}
 
         if not self.geoip2_reader:
@@ -4,6 +4,7 @@ from sqlalchemy import Integer, inspect
 from sqlalchemy.sql import bindparam, text
 
 from qcfractal.interface.models import Molecule, ResultRecord
+from qcfractal.interface.models.records import RecordStatusEnum
 from qcfractal.storage_sockets.models import MoleculeORM, ResultORM
 
 QUERY_CLASSES = set()
@@ -27,7 +28,9 @@ class QueryBase:
             QUERY_CLASSES.add(cls)
         super().__init_subclass__(**kwargs)
 
-    def query(self, session, query_key, limit=0, skip=0, include=None, exclude=None, **kwargs):
+    def query(
+        self, session, query_key, limit=0, skip=0, cursor=None, count=None, include=None, exclude=None, **kwargs
+    ):
 
         if query_key not in self._query_method_map:
             raise TypeError(f"Query type {query_key} is unimplemented for class {self._class_name}")
@@ -116,8 +119,10 @@ class DatabaseStatQueries(QueryBase):
 
     _query_method_map = {
         "table_count": "_table_count",
+        "table_estimate": "_table_estimate",
         "database_size": "_database_size",
         "table_information": "_table_information",
+        "result_states": "_result_states",
     }
 
     def _table_count(self, table_name=None):
@@ -128,6 +133,46 @@ class DatabaseStatQueries(QueryBase):
         sql_statement = f"SELECT count(*) from {table_name}"
         return self.execute_query(sql_statement, with_keys=False)[0]
 
+    def _table_estimate(self, table_name=None):
+        """Row count of a table from the statistics collector, or the planner estimate if no statistics exist yet"""
+
+        if table_name is None:
+            self._raise_missing_attribute("table_name", "table name")
+
+        sql_statement = """
+SELECT COALESCE(NULLIF(s.n_live_tup, 0), GREATEST(c.reltuples, 0))::BIGINT
+FROM pg_class c
+         LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+WHERE c.oid = to_regclass(:table_name)
+"""
+        result = self.execute_query(sql_statement, with_keys=False, table_name=table_name)
+        return result[0] if result else (0,)
+
+    def _result_states(self):
+        """Exact number of results per result_type and status, read from the trigger maintained counters"""
+
+        # Collapse the appended deltas so the counter table stays small
+        compact_statement = """
+WITH removed AS (DELETE FROM result_state_count RETURNING result_type, status, count)
+INSERT INTO result_state_count (result_type, status, count)
+SELECT result_type, status, SUM(count) FROM removed GROUP BY result_type, status HAVING SUM(count) != 0
+"""
+        self.session.execute(compact_statement)
+
+        sql_statement = """
+SELECT result_type, status, SUM(count)::BIGINT AS count FROM result_state_count
+GROUP BY result_type, status
+HAVING SUM(count) != 0
+"""
+
+        ret = {}
+        for row in self.execute_query(sql_statement, with_keys=True):
+            # Statuses are stored by enum name
+            status = RecordStatusEnum[row["status"]].value
+            ret.setdefault(row["result_type"], {})[status] = row["count"]
+
+        return ret
+
     def _database_size(self):
 
         sql_statement = f"SELECT pg_database_size('{self.database_name}')"
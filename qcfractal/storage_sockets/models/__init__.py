@@ -9,6 +9,7 @@ from .results_models import (
     OptimizationHistory,
     OptimizationProcedureORM,
     ResultORM,
+    ResultStateCountORM,
     TorsionDriveProcedureORM,
     Trajectory,
     WavefunctionStoreORM,
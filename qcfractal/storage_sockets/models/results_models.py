@@ -1,7 +1,9 @@
 import datetime
 
 from sqlalchemy import (
+    DDL,
     JSON,
+    BigInteger,
     Boolean,
     Column,
     DateTime,
@@ -12,6 +14,7 @@ from sqlalchemy import (
     String,
     Table,
     UniqueConstraint,
+    event,
     func,
     select,
 )
@@ -49,20 +52,16 @@ class BaseResultORM(Base):
 
     # Extra fields
     extras = Column(MsgpackExt)
+
+    # kv_store entries are shared between results and reference counted, they are released by the socket
     stdout = Column(Integer, ForeignKey("kv_store.id"))
-    stdout_obj = relationship(
-        KVStoreORM, lazy="noload", foreign_keys=stdout, cascade="all, delete-orphan", single_parent=True
-    )
+    stdout_obj = relationship(KVStoreORM, lazy="noload", foreign_keys=stdout)
 
     stderr = Column(Integer, ForeignKey("kv_store.id"))
-    stderr_obj = relationship(
-        KVStoreORM, lazy="noload", foreign_keys=stderr, cascade="all, delete-orphan", single_parent=True
-    )
+    stderr_obj = relationship(KVStoreORM, lazy="noload", foreign_keys=stderr)
 
     error = Column(Integer, ForeignKey("kv_store.id"))
-    error_obj = relationship(
-        KVStoreORM, lazy="noload", foreign_keys=error, cascade="all, delete-orphan", single_parent=True
-    )
+    error_obj = relationship(KVStoreORM, lazy="noload", foreign_keys=error)
 
     # Compute status
     status = Column(Enum(RecordStatusEnum), nullable=False, default=RecordStatusEnum.incomplete)
@@ -81,6 +80,58 @@ class BaseResultORM(Base):
     __mapper_args__ = {"polymorphic_on": "result_type"}
 
 
+class ResultStateCountORM(Base):
+    """
+        Number of base results per (result_type, status)
+
+        Rows are signed deltas appended by statement triggers on base_result in the same
+        transaction as the change, so writers never contend on a shared counter row. The
+        count of a (result_type, status) pair is the sum of its rows, compacted on read.
+    """
+
+    __tablename__ = "result_state_count"
+
+    id = Column(Integer, primary_key=True)
+    result_type = Column(String)
+    status = Column(String)
+    count = Column(BigInteger, nullable=False)
+
+
+# Transition tables (Postgres 10+) let a single insert, update or delete record its net change once
+result_state_count_ddl = """
+CREATE OR REPLACE FUNCTION result_state_count_delta() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO result_state_count (result_type, status, count)
+        SELECT result_type, status::text, count(*) FROM new_rows GROUP BY 1, 2;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO result_state_count (result_type, status, count)
+        SELECT result_type, status::text, -count(*) FROM old_rows GROUP BY 1, 2;
+    ELSE
+        INSERT INTO result_state_count (result_type, status, count)
+        SELECT result_type, status, SUM(delta) FROM (
+            SELECT result_type, status::text AS status, 1 AS delta FROM new_rows
+            UNION ALL
+            SELECT result_type, status::text AS status, -1 AS delta FROM old_rows
+        ) AS changes GROUP BY 1, 2 HAVING SUM(delta) != 0;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER base_result_state_count_insert AFTER INSERT ON base_result
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE result_state_count_delta();
+
+CREATE TRIGGER base_result_state_count_update AFTER UPDATE ON base_result
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE result_state_count_delta();
+
+CREATE TRIGGER base_result_state_count_delete AFTER DELETE ON base_result
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE result_state_count_delta();
+"""
+
+event.listen(BaseResultORM.__table__, "after_create", DDL(result_state_count_ddl).execute_if(dialect="postgresql"))
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
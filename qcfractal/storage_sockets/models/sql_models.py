@@ -98,7 +98,18 @@ class KVStoreORM(Base):
     __tablename__ = "kv_store"
 
     id = Column(Integer, primary_key=True)
-    value = Column(JSON, nullable=False)
+
+    # Content is stored compressed and deduplicated by the hash of the serialized value,
+    # refcount is the number of references the entry was added for.
+    compression = Column(String, nullable=True)
+    hash = Column(String(64), nullable=True)
+    refcount = Column(Integer, nullable=False, default=1, server_default="1")
+    data = Column(LargeBinary, nullable=True)
+
+    # Uncompressed value of entries written before compression was introduced
+    value = Column(JSON, nullable=True)
+
+    __table_args__ = (Index("ix_kv_store_hash", "hash", unique=True),)
 
 
 # class ErrorORM(Base):
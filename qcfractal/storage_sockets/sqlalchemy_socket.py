@@ -3,9 +3,11 @@ SQLAlchemy Database class to handle access to Pstgres through ORM
 """
 
 try:
-    from sqlalchemy import create_engine, or_, case, func
+    from sqlalchemy import Column, create_engine, or_, case, func, inspect, literal_column
+    from sqlalchemy.dialects.postgresql import insert as postgres_insert
     from sqlalchemy.exc import IntegrityError
     from sqlalchemy.orm import sessionmaker, with_polymorphic
+    from sqlalchemy.sql import bindparam
     from sqlalchemy.sql.expression import desc
     from sqlalchemy.sql.expression import case as expression_case
 except ImportError:
@@ -13,13 +15,17 @@ except ImportError:
         "SQLAlchemy_socket requires sqlalchemy, please install this python " "module or try a different db_socket."
     )
 
+import functools
 import json
 import logging
 import secrets
+import threading
+import time
+from collections import Counter, defaultdict
 from collections.abc import Iterable
 from contextlib import contextmanager
 from datetime import datetime as dt
-from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple, Union
 
 import bcrypt
 
@@ -51,6 +57,7 @@ from qcfractal.storage_sockets.models import (
     QueueManagerORM,
     ReactionDatasetORM,
     ResultORM,
+    ResultStateCountORM,
     ServerStatsLogORM,
     ServiceQueueORM,
     TaskQueueORM,
@@ -59,7 +66,17 @@ from qcfractal.storage_sockets.models import (
     VersionsORM,
     WavefunctionStoreORM,
 )
-from qcfractal.storage_sockets.storage_utils import add_metadata_template, get_metadata_template
+from qcfractal.storage_sockets.storage_utils import (
+    TimedQueuePool,
+    TransactionSession,
+    UserVerificationCache,
+    add_metadata_template,
+    compress_kvstore_value,
+    decode_cursor,
+    decompress_kvstore_value,
+    encode_cursor,
+    get_metadata_template,
+)
 
 from .models import Base
 
@@ -70,6 +87,28 @@ if TYPE_CHECKING:
 import qcelemental, qcfractal, qcengine
 
 _null_keys = {"basis", "keywords"}
+
+# Rows per multi-row INSERT, keeps bulk inserts below the Postgres bind parameter limit
+_insert_chunk_size = 1000
+
+# Parent ids per relationship query when joining relations onto a projection
+_relation_chunk_size = 5000
+
+# Columns of base_result referencing shared, reference counted kv_store entries
+_kvstore_columns = ("stdout", "stderr", "error")
+
+# Connection pools per workload, so that no workload can starve the others of connections. Each server
+# process opens up to 14 connections (plus one LISTEN connection), sized to the default API executors and
+# kept small so that several pre-forked workers stay below the Postgres default of max_connections=100
+_default_pools = {
+    "interactive": {"pool_size": 4, "max_overflow": 4, "pool_timeout": 30},
+    "queue": {"pool_size": 2, "max_overflow": 2, "pool_timeout": 10},
+    "background": {"pool_size": 1, "max_overflow": 1, "pool_timeout": 60},
+}
+
+# Postgres NOTIFY channel announcing new waiting tasks, payloads are limited to 8000 bytes
+_queue_channel = "qcfractal_task_queue"
+_queue_payload_limit = 7500
 _id_keys = {"id", "molecule", "keywords", "procedure_id"}
 _lower_func = lambda x: x.lower()
 _prepare_keys = {"program": _lower_func, "basis": prepare_basis, "method": _lower_func, "procedure": _lower_func}
@@ -79,6 +118,19 @@ def dict_from_tuple(keys, values):
     return [dict(zip(keys, row)) for row in values]
 
 
+def _values_equal(stored: Any, value: Any) -> bool:
+    """Compares a stored column value against an incoming one, anything that cannot be compared counts as changed."""
+
+    # Ids are integers in the database and strings on the models
+    if isinstance(stored, int) and isinstance(value, str):
+        return str(stored) == value
+
+    try:
+        return bool(stored == value)
+    except Exception:
+        return False
+
+
 def format_query(ORMClass, **query: Dict[str, Union[str, List[str]]]) -> Dict[str, Union[str, List[str]]]:
     """
     Formats a query into a SQLAlchemy format.
@@ -125,6 +177,22 @@ def get_count_fast(query):
     return count
 
 
+def get_count_estimate(query):
+    """
+    returns the planner estimate of the number of rows of the query using:
+        EXPLAIN (FORMAT JSON) SELECT ... FROM TestModel WHERE ...
+
+    Does not execute the query, the estimate is only as good as the table statistics.
+    """
+
+    statement = query.statement.compile(dialect=query.session.bind.dialect)
+    plan = query.session.connection().execute("EXPLAIN (FORMAT JSON) " + str(statement), statement.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
 def get_procedure_class(record):
 
     if isinstance(record, OptimizationRecord):
@@ -139,6 +207,24 @@ def get_procedure_class(record):
     return procedure_class
 
 
+def replica_read(func):
+    """
+    Marks a read-only socket method whose queries may be served by a read replica.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        previous = getattr(self._local, "read_from", None)
+        if previous is None:
+            self._local.read_from = "replica"
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self._local.read_from = previous
+
+    return wrapper
+
+
 def get_collection_class(collection_type):
 
     collection_map = {"dataset": DatasetORM, "reactiondataset": ReactionDatasetORM}
@@ -166,10 +252,39 @@ class SQLAlchemySocket:
         sql_echo: bool = False,
         max_limit: int = 1000,
         skip_version_check: bool = False,
+        verification_cache_ttl: float = 60,
+        verification_cache_size: int = 1024,
+        read_replica_uris: Optional[List[str]] = None,
+        replica_max_lag: float = 30,
+        replica_check_interval: float = 10,
+        replica_connect_timeout: int = 5,
+        pools: Optional[Dict[str, Dict[str, Any]]] = None,
+        queue_notify: bool = False,
     ):
         """
         Constructs a new SQLAlchemy socket
 
+        Successful user verifications are cached for ``verification_cache_ttl`` seconds (0 disables
+        the cache). Modifying or removing a user only invalidates the cache of this process: with
+        ``workers > 1``, or any other socket on the same database, the user may keep their old access
+        in the other processes until their entries expire.
+
+        Read-only queries (molecules, keywords, kvstore, results, procedures, collections and custom
+        queries) are spread over the ``read_replica_uris`` if given. Replicas are health checked every
+        ``replica_check_interval`` seconds by a background thread and skipped while unreachable (no
+        connection within ``replica_connect_timeout`` seconds) or lagging more than ``replica_max_lag``
+        seconds behind the primary. Reads within a ``primary()`` block always see the writes of the primary.
+
+        Connections to the primary are drawn from a separate pool per workload: "interactive" (the
+        default), "queue" for queue manager traffic and "background" for maintenance. ``pools`` overrides
+        the ``pool_size``, ``max_overflow`` and ``pool_timeout`` of these or adds further pools; queries
+        within a ``workload(name)`` block use the pool of that name.
+
+        Tasks becoming available to managers (through ``queue_submit`` and ``queue_reset_status``) are
+        announced to the callbacks registered with ``add_queue_listener``. With ``queue_notify`` the
+        announcements are sent through Postgres NOTIFY instead, to be picked up by every server process
+        listening on the connection returned by ``queue_listen``.
+
         """
 
         # Logging data
@@ -181,32 +296,67 @@ class SQLAlchemySocket:
         # Security
         self._bypass_security = bypass_security
         self._allow_read = allow_read
+        self._verification_cache = UserVerificationCache(ttl=verification_cache_ttl, maxsize=verification_cache_size)
 
         self._lower_results_index = ["method", "basis", "program"]
 
         # disconnect from any active default connection
         # disconnect()
-        if "psycopg2" not in uri:
-            uri = uri.replace("postgresql", "postgresql+psycopg2")
-
-        if project and not uri.endswith("/"):
-            uri = uri + "/"
-
-        uri = uri + project
+        uri = self._build_uri(uri, project)
         self.logger.info(f"SQLAlchemy attempt to connect to {uri}.")
 
-        # Connect to DB and create session
+        # Connect to DB and create session, one engine per workload pool
         self.uri = uri
-        self.engine = create_engine(
-            uri,
-            echo=sql_echo,  # echo for logging into python logging
-            pool_size=5,  # 5 is the default, 0 means unlimited
-        )
+        self._local = threading.local()
+
+        pool_settings = {k: dict(v) for k, v in _default_pools.items()}
+        for name, settings in (pools or {}).items():
+            pool_settings.setdefault(name, {}).update(settings)
+
+        self._engines = {}
+        self._sessionmakers = {}
+        for name, settings in pool_settings.items():
+            # echo for logging into python logging
+            engine = create_engine(uri, echo=sql_echo, poolclass=TimedQueuePool, **settings)
+            self._engines[name] = engine
+            self._sessionmakers[name] = sessionmaker(bind=engine, class_=TransactionSession)
+
+        self.engine = self._engines["interactive"]
+        self.Session = self._sessionmakers["interactive"]
         self.logger.info(
             "Connected SQLAlchemy to DB dialect {} with driver {}".format(self.engine.dialect.name, self.engine.driver)
         )
 
-        self.Session = sessionmaker(bind=self.engine)
+        # Read replicas, each with its own pool
+        self._replicas = []
+        for replica_uri in read_replica_uris or []:
+            engine = create_engine(
+                self._build_uri(replica_uri, project),
+                echo=sql_echo,
+                poolclass=TimedQueuePool,
+                pool_size=5,
+                connect_args={"connect_timeout": replica_connect_timeout},
+            )
+            self._replicas.append(
+                {"engine": engine, "Session": sessionmaker(bind=engine), "healthy": False, "lag": None, "error": None}
+            )
+        self._replica_max_lag = replica_max_lag
+        self._replica_check_interval = replica_check_interval
+        self._replica_checked = None
+        self._replica_counter = 0
+        self._replica_lock = threading.Lock()
+        if self._replicas:
+            self.logger.info(f"Routing read-only queries to {len(self._replicas)} read replica(s).")
+
+            # Checks run off the request path, a stalled replica only delays the next check
+            self._replica_check_thread = threading.Thread(
+                target=self._replica_check_loop, name="fractal_replica_check", daemon=True
+            )
+            self._replica_check_thread.start()
+
+        # Announcements of newly waiting tasks
+        self._queue_notify = queue_notify
+        self._queue_listeners = []
 
         # check version compatibility
         db_ver = self.check_lib_versions()
@@ -225,10 +375,8 @@ class SQLAlchemySocket:
         except Exception as e:
             raise ValueError(f"SQLAlchemy Connection Error\n {str(e)}") from None
 
-        # Advanced queries objects
-        self._query_classes = {
-            cls._class_name: cls(self.engine.url.database, max_limit=max_limit) for cls in QUERY_CLASSES
-        }
+        # Advanced queries classes, instantiated per call since a query object holds its session
+        self._query_classes = {cls._class_name: cls for cls in QUERY_CLASSES}
 
         # if expanded_uri["password"] is not None:
         #     # connect to mongoengine
@@ -259,11 +407,276 @@ class SQLAlchemySocket:
     def __str__(self) -> str:
         return f"<SQLAlchemySocket: address='{self.uri}`>"
 
+    @staticmethod
+    def _build_uri(uri: str, project: str) -> str:
+
+        if "psycopg2" not in uri:
+            uri = uri.replace("postgresql", "postgresql+psycopg2")
+
+        if project and not uri.endswith("/"):
+            uri = uri + "/"
+
+        return uri + project
+
+    @contextmanager
+    def primary(self):
+        """
+        Sends all queries of the current thread to the primary database, for reads that must see
+        preceding writes.
+        """
+
+        previous = getattr(self._local, "read_from", None)
+        self._local.read_from = "primary"
+        try:
+            yield
+        finally:
+            self._local.read_from = previous
+
+    @contextmanager
+    def workload(self, name: str):
+        """
+        Draws the connections of all queries of the current thread from the named pool.
+        """
+
+        if name not in self._sessionmakers:
+            raise KeyError(f"Connection pool '{name}' not understood.")
+
+        previous = getattr(self._local, "workload", None)
+        self._local.workload = name
+        try:
+            yield
+        finally:
+            self._local.workload = previous
+
+    def _new_session(self):
+        """A new session on a healthy replica inside read-only methods, otherwise on the pool of the workload"""
+
+        if self._replicas and getattr(self._local, "read_from", None) == "replica":
+            replica = self._select_replica()
+            if replica is not None:
+                return replica["Session"]()
+
+        return self._sessionmakers[getattr(self._local, "workload", None) or "interactive"]()
+
+    def get_pool_statistics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the checkout wait times and utilisation of each connection pool.
+
+        Returns
+        -------
+        Dict[str, Dict[str, Any]]
+            The statistics of each pool, read replicas are listed as "replica_<index>".
+        """
+
+        ret = {name: engine.pool.statistics() for name, engine in self._engines.items()}
+        for i, replica in enumerate(self._replicas):
+            ret[f"replica_{i}"] = replica["engine"].pool.statistics()
+
+        return ret
+
+    def _select_replica(self) -> Optional[Dict[str, Any]]:
+
+        with self._replica_lock:
+            healthy = [r for r in self._replicas if r["healthy"]]
+            if not healthy:
+                return None
+
+            self._replica_counter += 1
+            return healthy[self._replica_counter % len(healthy)]
+
+    def _check_replicas(self) -> None:
+
+        sql_statement = """
+SELECT CASE
+           WHEN NOT pg_is_in_recovery() THEN 0
+           WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+           ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+       END
+"""
+
+        for replica in self._replicas:
+            # Connect and query without the lock, requests keep using the last known state meanwhile
+            try:
+                with replica["engine"].connect() as conn:
+                    lag = float(conn.execute(sql_statement).scalar())
+                error = None
+            except Exception as err:
+                lag = None
+                error = str(err)
+
+            with self._replica_lock:
+                was_healthy = replica["healthy"]
+                replica["lag"] = lag
+                replica["error"] = error
+                replica["healthy"] = (error is None) and (lag <= self._replica_max_lag)
+
+            if was_healthy and not replica["healthy"]:
+                reason = replica["error"] or f"lag of {replica['lag']:.1f}s"
+                self.logger.warning(f"Read replica {replica['engine'].url!r} disabled: {reason}")
+            elif replica["healthy"] and not was_healthy:
+                self.logger.info(f"Read replica {replica['engine'].url!r} enabled, lag of {replica['lag']:.1f}s")
+
+        self._replica_checked = time.monotonic()
+
+    def _replica_check_loop(self) -> None:
+
+        while True:
+            try:
+                self._check_replicas()
+            except Exception as err:
+                self.logger.warning(f"Read replica check failed: {err}")
+
+            time.sleep(self._replica_check_interval)
+
+    def get_replica_status(self, refresh: bool = False) -> List[Dict[str, Any]]:
+        """
+        Returns the health of the read replicas.
+
+        Parameters
+        ----------
+        refresh : bool, optional
+            Checks the replicas now instead of reporting the result of the last periodic check.
+
+        Returns
+        -------
+        List[Dict[str, Any]]
+            The address (without password), health, replication lag in seconds and last error of each replica.
+        """
+
+        if refresh or self._replica_checked is None:
+            self._check_replicas()
+
+        with self._replica_lock:
+            return [
+                {"uri": repr(r["engine"].url), "healthy": r["healthy"], "lag": r["lag"], "error": r["error"]}
+                for r in self._replicas
+            ]
+
+    def add_queue_listener(self, callback: Callable[[Optional[List[Dict[str, Any]]]], None]) -> None:
+        """
+        Registers a callback that is called when tasks become available to managers.
+
+        The callback is called from the thread of the storage call with a list of the ``tag``,
+        ``program`` and ``procedure`` of the new tasks, or None if any task may have become available.
+        Callbacks are only called by this socket, see ``queue_listen`` for announcements of all processes.
+        """
+
+        self._queue_listeners.append(callback)
+
+    def _notify_queue(self, tasks: Optional[List[Dict[str, Any]]]) -> None:
+        """Announces newly waiting tasks, call after the tasks are committed"""
+
+        pending = getattr(self._local, "queue_announcements", None)
+        if pending is not None:
+            pending.append(tasks)
+            return
+
+        if tasks is not None:
+            tasks = [dict(x) for x in {tuple(sorted(t.items())) for t in tasks}]
+
+        if self._queue_notify:
+            payload = "" if tasks is None else json.dumps(tasks)
+            if len(payload) > _queue_payload_limit:
+                payload = ""
+
+            with self.session_scope() as session:
+                session.execute("SELECT pg_notify(:channel, :payload)", {"channel": _queue_channel, "payload": payload})
+            return
+
+        for callback in self._queue_listeners:
+            try:
+                callback(tasks)
+            except Exception:
+                self.logger.exception("Queue listener failed.")
+
+    def queue_listen(self):
+        """
+        Opens a dedicated database connection listening for the task announcements of all processes.
+
+        The connection is in autocommit mode and should be polled with ``queue_notifications``
+        whenever it becomes readable. The caller is responsible for closing it.
+        """
+
+        conn = self.engine.raw_connection()
+        conn.detach()
+
+        dbapi_conn = conn.connection
+        dbapi_conn.autocommit = True
+        with dbapi_conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {_queue_channel}")
+
+        return dbapi_conn
+
+    @staticmethod
+    def queue_notifications(conn) -> List[Optional[List[Dict[str, Any]]]]:
+        """
+        Reads the pending task announcements of a connection opened by ``queue_listen``.
+
+        Returns
+        -------
+        List[Optional[List[Dict[str, Any]]]]
+            The announced tasks of each notification, None if any task may have become available.
+        """
+
+        conn.poll()
+
+        ret = []
+        while conn.notifies:
+            payload = conn.notifies.pop(0).payload
+            ret.append(json.loads(payload) if payload else None)
+
+        return ret
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs all storage calls of the current thread within a single database transaction.
+
+        The calls share one session on the primary, each within a savepoint so that a failing call
+        is rolled back on its own. Everything is committed at the end of the block and rolled back
+        if the block raises. Queue announcements are sent once committed.
+        """
+
+        if getattr(self._local, "transaction", None) is not None:
+            yield self._local.transaction
+            return
+
+        session = self._sessionmakers[getattr(self._local, "workload", None) or "interactive"]()
+        session.deferred = True
+        self._local.transaction = session
+        self._local.queue_announcements = []
+        try:
+            yield session
+            session.deferred = False
+            session.commit()
+        except:
+            session.rollback()
+            raise
+        finally:
+            announcements = self._local.queue_announcements
+            self._local.transaction = None
+            self._local.queue_announcements = None
+            session.close()
+
+        for tasks in announcements:
+            self._notify_queue(tasks)
+
     @contextmanager
     def session_scope(self):
         """Provide a transactional scope"""
 
-        session = self.Session()
+        outer = getattr(self._local, "transaction", None)
+        if outer is not None:
+            savepoint = outer.begin_nested()
+            try:
+                yield outer
+                savepoint.commit()
+            except:
+                savepoint.rollback()
+                raise
+            return
+
+        session = self._new_session()
         try:
             yield session
             session.commit()
@@ -273,6 +686,84 @@ class SQLAlchemySocket:
         finally:
             session.close()
 
+    def _next_ids(self, session, table_name: str, n: int) -> List[int]:
+        """Takes ``n`` new ids from the serial id sequence of a table."""
+
+        if n == 0:
+            return []
+
+        return [
+            x
+            for (x,) in session.query(func.nextval(func.pg_get_serial_sequence(table_name, "id")))
+            .select_from(func.generate_series(1, n))
+            .all()
+        ]
+
+    def _insert_many(self, session, table, rows: List[Dict[str, Any]]) -> List[int]:
+        """Inserts rows with multi-row INSERT statements and returns their new ids in the order of the rows.
+
+        The ids are taken from the sequence up front. Rows are inserted in groups of the same columns
+        so that columns missing from a row keep their defaults.
+        """
+
+        ids = self._next_ids(session, table.name, len(rows))
+
+        groups = defaultdict(list)
+        for new_id, row in zip(ids, rows):
+            groups[frozenset(row)].append({**row, "id": new_id})
+
+        for group in groups.values():
+            for i in range(0, len(group), _insert_chunk_size):
+                session.execute(table.insert().values(group[i : i + _insert_chunk_size]))
+
+        return ids
+
+    def _bulk_update(self, session, className, updates: Dict[int, Dict[str, Any]], relations: bool = False) -> int:
+        """Writes the changed columns of existing rows with a single bulk update.
+
+        The stored rows are loaded in one query and only the columns whose value differs from the
+        stored one are written. Keys that are not table columns are ignored, unless ``relations``
+        is set, in which case they are handed to the ``update_relations`` of the loaded row.
+
+        Returns the number of rows found and updated.
+        """
+
+        if not updates:
+            return 0
+
+        columns = {p.key for p in inspect(className).column_attrs if isinstance(p.columns[0], Column)}
+        columns.discard("id")
+
+        rows = session.query(className).filter(className.id.in_(list(updates))).all()
+
+        missing = set(updates) - {row.id for row in rows}
+        if missing:
+            self.logger.error(
+                "Attempted update of missing {} ids {}, skipping.".format(className.__tablename__, sorted(missing))
+            )
+
+        mappings = []
+        released = []
+        for row in rows:
+            data = updates[row.id]
+            if relations:
+                row.update_relations(**data)
+
+            changed = {k: v for k, v in data.items() if k in columns and not _values_equal(getattr(row, k), v)}
+            if changed:
+                # Repointed kv_store entries lose the reference of this row
+                released.extend(getattr(row, k) for k in _kvstore_columns if k in changed)
+                changed["id"] = row.id
+                mappings.append(changed)
+
+        session.bulk_update_mappings(className, mappings)
+
+        if any(x is not None for x in released):
+            session.flush()
+            self._release_kvstore(session, released)
+
+        return len(rows)
+
     def _clear_db(self, db_name: str = None):
         """Dangerous, make sure you are deleting the right DB"""
 
@@ -309,6 +800,7 @@ class SQLAlchemySocket:
             session.query(ResultORM).delete(synchronize_session=False)
             session.query(WavefunctionStoreORM).delete(synchronize_session=False)
             session.query(BaseResultORM).delete(synchronize_session=False)
+            session.query(ResultStateCountORM).delete(synchronize_session=False)
 
             # Auxiliary tables
             session.query(KVStoreORM).delete(synchronize_session=False)
@@ -325,7 +817,26 @@ class SQLAlchemySocket:
 
         return limit if limit is not None and limit < self._max_limit else self._max_limit
 
-    def get_query_projection(self, className, query, *, limit=None, skip=0, include=None, exclude=None):
+    def get_query_projection(
+        self, className, query, *, limit=None, skip=0, cursor=None, count="exact", include=None, exclude=None
+    ):
+        """
+        Queries a table with optional projection and pagination.
+
+        If ``cursor`` is not None, keyset pagination is used instead of ``skip``: rows are
+        ordered by id and the query resumes after the last id encoded in the cursor. An empty
+        cursor starts from the first row. ``n_found`` is always the size of the full query.
+
+        ``count`` selects how ``n_found`` is computed: ``"exact"`` runs a COUNT over the query,
+        ``"estimate"`` uses the planner row estimate, and ``"none"`` skips counting and reports
+        the number of returned rows.
+
+        Returns
+        -------
+        Tuple[List[Dict[str, Any]], int, Optional[str]]
+            The found rows, the total number of matches, and the cursor to the next page
+            if keyset pagination was requested and the page was full.
+        """
 
         if include and exclude:
             raise AttributeError(
@@ -368,54 +879,80 @@ class SQLAlchemySocket:
         for key in join_attrs:
             _projection.remove(key)
 
+        # Keyset pagination, only the rows after the last seen id are considered
+        keyset = cursor is not None
+        last_id = decode_cursor(cursor) if keyset else None
+        limit = self.get_limit(limit)
+        next_cursor = None
+
+        if count not in {"exact", "estimate", "none"}:
+            raise ValueError(f"Count type '{count}' not understood.")
+
+        def get_count(data):
+            if count == "exact":
+                return get_count_fast(data)
+            elif count == "estimate":
+                return get_count_estimate(data)
+            else:
+                return None
+
+        def paginate(data):
+            if not keyset:
+                return data.limit(limit).offset(skip)
+
+            if last_id is not None:
+                data = data.filter(className.id > last_id)
+            return data.order_by(className.id).limit(limit)
+
         with self.session_scope() as session:
             if _projection or join_attrs:
 
-                if join_attrs and "id" not in _projection:  # if the id is need for joins
+                # if the id is need for joins or the cursor
+                if (join_attrs or keyset) and "id" not in _projection:
                     proj.append(getattr(className, "id"))
                     _projection.append("_id")  # not to be returned to user
 
                 # query with projection, without joins
                 data = session.query(*proj).filter(*query)
 
-                n_found = get_count_fast(data)  # before iterating on the data
-                data = data.limit(self.get_limit(limit)).offset(skip)
+                n_found = get_count(data)  # before iterating on the data
+                data = paginate(data)
                 rdata = [dict(zip(_projection, row)) for row in data]
 
+                if keyset and len(rdata) == limit:
+                    next_cursor = encode_cursor(rdata[-1].get("id", rdata[-1].get("_id")))
+
                 # query for joins if any (relationships and hybrids)
                 if join_attrs:
-                    res_ids = [d.get("id", d.get("_id")) for d in rdata]
-                    res_ids.sort()
-                    join_data = {res_id: {} for res_id in res_ids}
+                    parent_ids = [d.get("id", d.get("_id")) for d in rdata]
+                    res_ids = sorted(set(parent_ids))
 
-                    # relations data
+                    # relations data, grouped by parent id in a single pass over the related rows
                     for key, relation_details in join_attrs.items():
-                        ret = (
-                            session.query(
-                                relation_details["remote_side_column"].label("id"), relation_details["join_class"]
+                        remote_column = relation_details["remote_side_column"]
+                        join_data = defaultdict(list)
+                        for i in range(0, len(res_ids), _relation_chunk_size):
+                            ret = (
+                                session.query(remote_column.label("id"), relation_details["join_class"])
+                                .filter(remote_column.in_(res_ids[i : i + _relation_chunk_size]))
+                                .order_by(remote_column)
                             )
-                            .filter(relation_details["remote_side_column"].in_(res_ids))
-                            .order_by(relation_details["remote_side_column"])
-                            .all()
-                        )
-                        for res_id in res_ids:
-                            join_data[res_id][key] = []
-                            for res in ret:
-                                if res_id == res[0]:
-                                    join_data[res_id][key].append(res[1])
-
-                        for data in rdata:
-                            parent_id = data.get("id", data.get("_id"))
-                            data[key] = join_data[parent_id][key]
-                            data.pop("_id", None)
+                            for parent_id, related in ret:
+                                join_data[parent_id].append(related)
+
+                        for data, parent_id in zip(rdata, parent_ids):
+                            data[key] = join_data.get(parent_id, [])
 
                 # call hybrid methods
                 for callback in callbacks:
+                    hybrid_func = getattr(className, "_" + callback)
                     for res in rdata:
-                        res[callback] = getattr(className, "_" + callback)(res[callback])
+                        res[callback] = hybrid_func(res[callback])
 
                 id_fields = className._get_fieldnames_with_DB_ids_()
                 for d in rdata:
+                    d.pop("_id", None)
+
                     # Expand extra json into fields
                     if "extra" in d:
                         d.update(d["extra"])
@@ -434,14 +971,21 @@ class SQLAlchemySocket:
 
                 # from sqlalchemy.dialects import postgresql
                 # print(data.statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
-                n_found = get_count_fast(data)
-                data = data.limit(self.get_limit(limit)).offset(skip).all()
+                n_found = get_count(data)
+                data = paginate(data).all()
                 rdata = [d.to_dict() for d in data]
 
-        return rdata, n_found
+                if keyset and len(data) == limit:
+                    next_cursor = encode_cursor(data[-1].id)
+
+        if n_found is None:
+            n_found = len(rdata)
+
+        return rdata, n_found, next_cursor
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
+    @replica_read
     def custom_query(self, class_name: str, query_key: str, **kwargs):
         """
         Run advanced or specialized queries on different classes
@@ -471,8 +1015,13 @@ class SQLAlchemySocket:
             if class_name not in self._query_classes:
                 raise AttributeError(f"Class name {class_name} is not found.")
 
-            session = self.Session()
-            ret["data"] = self._query_classes[class_name].query(session, query_key, **kwargs)
+            query_class = self._query_classes[class_name](self.engine.url.database, max_limit=self._max_limit)
+
+            session = self._new_session()
+            try:
+                ret["data"] = query_class.query(session, query_key, **kwargs)
+            finally:
+                session.close()
             ret["meta"]["success"] = True
             try:
                 ret["meta"]["n_found"] = len(ret["data"])
@@ -485,12 +1034,24 @@ class SQLAlchemySocket:
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Logging ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-    def save_access(self, log_data):
+    def save_access(self, log_data: Union[Dict[str, Any], List[Dict[str, Any]]]):
+        """
+        Saves API access logs, a list of logs is written with a single multi-row insert.
+
+        Parameters
+        ----------
+        log_data : Union[Dict[str, Any], List[Dict[str, Any]]]
+            The access log or list of access logs. All logs in a list must have the same keys.
+        """
+
+        if isinstance(log_data, dict):
+            log_data = [log_data]
+
+        if len(log_data) == 0:
+            return
 
         with self.session_scope() as session:
-            log = AccessLogORM(**log_data)
-            session.add(log)
-            session.commit()
+            session.execute(AccessLogORM.__table__.insert().values(log_data))
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Logs (KV store) ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -511,23 +1072,82 @@ class SQLAlchemySocket:
         """
 
         meta = add_metadata_template()
-        blob_ids = []
-        with self.session_scope() as session:
-            for blob in blobs_list:
-                if blob is None:
-                    blob_ids.append(None)
-                    continue
 
-                doc = KVStoreORM(value=blob)
-                session.add(doc)
-                session.commit()
-                blob_ids.append(str(doc.id))
-                meta["n_inserted"] += 1
+        with self.session_scope() as session:
+            blob_ids, meta["n_inserted"] = self._add_kvstore(session, blobs_list)
 
+        blob_ids = [None if x is None else str(x) for x in blob_ids]
         meta["success"] = True
 
         return {"data": blob_ids, "meta": meta}
 
+    def _add_kvstore(self, session, blobs_list: List[Any]) -> Tuple[List[Optional[int]], int]:
+        """Stores compressed blobs, reusing the existing entry of blobs whose content is already stored.
+
+        Entries are identified by the hash of their content. Adding a blob that is already stored
+        increments the refcount of the existing entry instead of inserting a new row.
+
+        Returns the ids of the blobs in the order given (None for None blobs) and the number of new entries.
+        """
+
+        entries = {}
+        blob_hashes = []
+        for blob in blobs_list:
+            if blob is None:
+                blob_hashes.append(None)
+                continue
+
+            data, compression, digest = compress_kvstore_value(blob)
+            blob_hashes.append(digest)
+            if digest in entries:
+                entries[digest]["refcount"] += 1
+            else:
+                entries[digest] = {"hash": digest, "compression": compression, "data": data, "refcount": 1}
+
+        # Upsert in hash order so concurrent inserts of overlapping blobs lock rows in the same order
+        rows = [entries[k] for k in sorted(entries)]
+        table = KVStoreORM.__table__
+
+        ids = {}
+        n_inserted = 0
+        for i in range(0, len(rows), _insert_chunk_size):
+            stmt = postgres_insert(table).values(rows[i : i + _insert_chunk_size])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.hash], set_={"refcount": table.c.refcount + stmt.excluded.refcount}
+            ).returning(table.c.id, table.c.hash, literal_column("(xmax = 0)"))
+
+            for blob_id, digest, inserted in session.execute(stmt):
+                ids[digest] = blob_id
+                n_inserted += bool(inserted)
+
+        return [None if x is None else ids[x] for x in blob_hashes], n_inserted
+
+    def _release_kvstore(self, session, blob_ids: List[Optional[int]]) -> int:
+        """Drops one reference to each of the given entries, entries left without references are deleted.
+
+        Must be called after the rows referencing the entries were deleted or repointed and flushed.
+
+        Returns the number of deleted entries.
+        """
+
+        counts = Counter(int(x) for x in blob_ids if x is not None)
+        if not counts:
+            return 0
+
+        table = KVStoreORM.__table__
+
+        # Decrement in id order so concurrent releases lock rows in the same order
+        stmt = (
+            table.update()
+            .where(table.c.id == bindparam("b_id"))
+            .values(refcount=table.c.refcount - bindparam("b_count"))
+        )
+        session.execute(stmt, [{"b_id": k, "b_count": counts[k]} for k in sorted(counts)])
+
+        ret = session.execute(table.delete().where(table.c.id.in_(list(counts))).where(table.c.refcount <= 0))
+        return ret.rowcount
+
+    @replica_read
     def get_kvstore(self, id: List[str] = None, limit: int = None, skip: int = 0):
         """
         Pulls from the key/value store table.
@@ -550,13 +1170,18 @@ class SQLAlchemySocket:
 
         query = format_query(KVStoreORM, id=id)
 
-        rdata, meta["n_found"] = self.get_query_projection(KVStoreORM, query, limit=limit, skip=skip)
+        rdata, meta["n_found"], _ = self.get_query_projection(KVStoreORM, query, limit=limit, skip=skip)
 
         meta["success"] = True
 
         # meta['error_description'] = str(err)
 
-        data = {d["id"]: d["value"] for d in rdata}
+        data = {}
+        for d in rdata:
+            if d["data"] is None:
+                data[d["id"]] = d["value"]
+            else:
+                data[d["id"]] = decompress_kvstore_value(d["data"], d["compression"])
 
         return {"data": data, "meta": meta}
 
@@ -596,8 +1221,9 @@ class SQLAlchemySocket:
 
         id_mols.update({k: v for k, v in zip(flat_mol_keys, flat_mols)})
 
-        # Get molecules by index and translate back to dict
-        tmp = self.get_molecules(list(id_mols.values()))
+        # Get molecules by index and translate back to dict, the new molecules are only on the primary
+        with self.primary():
+            tmp = self.get_molecules(list(id_mols.values()))
         id_mols_list = tmp["data"]
         meta["errors"].extend(tmp["meta"]["errors"])
 
@@ -722,7 +1348,17 @@ class SQLAlchemySocket:
         ret = {"data": results, "meta": meta}
         return ret
 
-    def get_molecules(self, id=None, molecule_hash=None, molecular_formula=None, limit: int = None, skip: int = 0):
+    @replica_read
+    def get_molecules(
+        self,
+        id=None,
+        molecule_hash=None,
+        molecular_formula=None,
+        limit: int = None,
+        skip: int = 0,
+        cursor: Optional[str] = None,
+        count: str = "exact",
+    ):
         try:
             if isinstance(molecular_formula, str):
                 molecular_formula = qcelemental.molutil.order_molecular_formula(molecular_formula)
@@ -737,9 +1373,19 @@ class SQLAlchemySocket:
         query = format_query(MoleculeORM, id=id, molecule_hash=molecule_hash, molecular_formula=molecular_formula)
 
         # Don't include the hash or the molecular_formula in the returned result
-        rdata, meta["n_found"] = self.get_query_projection(
-            MoleculeORM, query, limit=limit, skip=skip, exclude=["molecule_hash", "molecular_formula"]
-        )
+        try:
+            rdata, meta["n_found"], meta["cursor"] = self.get_query_projection(
+                MoleculeORM,
+                query,
+                limit=limit,
+                skip=skip,
+                cursor=cursor,
+                count=count,
+                exclude=["molecule_hash", "molecular_formula"],
+            )
+        except ValueError as err:
+            meta["error_description"] = str(err)
+            return {"meta": meta, "data": []}
 
         meta["success"] = True
 
@@ -823,12 +1469,15 @@ class SQLAlchemySocket:
 
         return ret
 
+    @replica_read
     def get_keywords(
         self,
         id: Union[str, list] = None,
         hash_index: Union[str, list] = None,
         limit: int = None,
         skip: int = 0,
+        cursor: Optional[str] = None,
+        count: str = "exact",
         return_json: bool = False,
         with_ids: bool = True,
     ) -> List[KeywordSet]:
@@ -847,6 +1496,12 @@ class SQLAlchemySocket:
             the max_limit will be returned instead.
             Default is to return the socket's max_limit (when limit=None or 0)
         skip : int, optional
+        cursor : str, optional
+            Resume a keyset paginated query after this cursor, ``skip`` is then ignored.
+            An empty string starts a new paginated query.
+        count : str, default is "exact"
+            How ``n_found`` is computed: "exact", "estimate" (query planner estimate) or "none"
+            (the number of returned entries).
         return_json : bool, optional
             Return the results as a json object
             Default is True
@@ -865,14 +1520,22 @@ class SQLAlchemySocket:
         meta = get_metadata_template()
         query = format_query(KeywordsORM, id=id, hash_index=hash_index)
 
-        rdata, meta["n_found"] = self.get_query_projection(
-            KeywordsORM, query, limit=limit, skip=skip, exclude=[None if with_ids else "id"]
-        )
+        try:
+            rdata, meta["n_found"], meta["cursor"] = self.get_query_projection(
+                KeywordsORM,
+                query,
+                limit=limit,
+                skip=skip,
+                cursor=cursor,
+                count=count,
+                exclude=[None if with_ids else "id"],
+            )
+        except ValueError as err:
+            meta["error_description"] = str(err)
+            return {"data": [], "meta": meta}
 
         meta["success"] = True
 
-        # meta['error_description'] = str(err)
-
         if not return_json:
             data = [KeywordSet(**d) for d in rdata]
         else:
@@ -911,7 +1574,8 @@ class SQLAlchemySocket:
                 missing.append(idx)
                 continue
 
-            tmp = self.get_keywords(id=id)["data"]
+            with self.primary():
+                tmp = self.get_keywords(id=id)["data"]
             if tmp:
                 ret.append(tmp[0])
             else:
@@ -1021,6 +1685,7 @@ class SQLAlchemySocket:
         ret = {"data": col_id, "meta": meta}
         return ret
 
+    @replica_read
     def get_collections(
         self,
         collection: Optional[str] = None,
@@ -1066,7 +1731,7 @@ class SQLAlchemySocket:
         query = format_query(collection_class, lname=name, collection=collection, id=col_id)
 
         # try:
-        rdata, meta["n_found"] = self.get_query_projection(
+        rdata, meta["n_found"], _ = self.get_query_projection(
             collection_class, query, include=include, exclude=exclude, limit=limit, skip=skip
         )
 
@@ -1116,11 +1781,53 @@ class SQLAlchemySocket:
 
     ## ResultORMs functions
 
+    @staticmethod
+    def _result_key(program, driver, method, basis, keywords, molecule) -> Tuple[Optional[str], ...]:
+        """The unique key of a result as a tuple of strings, matching the uix_results_keys constraint."""
+
+        key = (program, driver, method, basis, keywords, molecule)
+        return tuple(None if x is None else str(getattr(x, "value", x)) for x in key)
+
+    def _find_results(self, session, keys: List[Tuple[Optional[str], ...]]) -> Dict[Tuple[Optional[str], ...], int]:
+        """Looks up the ids of existing results from their unique keys in a single query.
+
+        Keys are matched in Python since NULL basis or keywords never compare equal in SQL.
+        """
+
+        keys = set(keys)
+        if not keys:
+            return {}
+
+        query = session.query(
+            ResultORM.id,
+            ResultORM.program,
+            ResultORM.driver,
+            ResultORM.method,
+            ResultORM.basis,
+            ResultORM.keywords,
+            ResultORM.molecule,
+        ).filter(
+            ResultORM.molecule.in_({k[5] for k in keys}),
+            ResultORM.program.in_({k[0] for k in keys}),
+            ResultORM.method.in_({k[2] for k in keys}),
+        )
+
+        found = {}
+        for row in query:
+            key = self._result_key(*row[1:])
+            if key in keys:
+                found.setdefault(key, row[0])
+
+        return found
+
     def add_results(self, record_list: List[ResultRecord]):
         """
         Add results from a given dict. The dict should have all the required
         keys of a result.
 
+        All new results are inserted in bulk within a single transaction, results that
+        already exist (or are repeated in record_list) are returned as duplicates.
+
         Parameters
         ----------
         data : list of dict
@@ -1138,30 +1845,67 @@ class SQLAlchemySocket:
 
         meta = add_metadata_template()
 
-        result_ids = []
+        result_keys = [
+            self._result_key(r.program, r.driver, r.method, r.basis, r.keywords, r.molecule) for r in record_list
+        ]
+
         with self.session_scope() as session:
-            for result in record_list:
-
-                doc = session.query(ResultORM).filter_by(
-                    program=result.program,
-                    driver=result.driver,
-                    method=result.method,
-                    basis=result.basis,
-                    keywords=result.keywords,
-                    molecule=result.molecule,
-                )
+            existing = self._find_results(session, result_keys)
+
+            # The first record of every new key is inserted
+            new_records = {}
+            for key, record in zip(result_keys, record_list):
+                if key not in existing:
+                    new_records.setdefault(key, record)
+
+            created = {}
+            if new_records:
+                # Take the ids from the sequence up front so both tables can be inserted with multi-row statements
+                new_ids = self._next_ids(session, "base_result", len(new_records))
+
+                base_columns = set(BaseResultORM.__table__.c.keys())
+                base_rows, result_rows = [], []
+                for new_id, record in zip(new_ids, new_records.values()):
+                    data = record.dict(exclude={"id"})
+                    base_rows.append(
+                        {"id": new_id, "result_type": "result", **{k: v for k, v in data.items() if k in base_columns}}
+                    )
+                    result_rows.append({"id": new_id, **{k: v for k, v in data.items() if k not in base_columns}})
+
+                inserted_ids = set()
+                for i in range(0, len(new_ids), _insert_chunk_size):
+                    session.execute(BaseResultORM.__table__.insert().values(base_rows[i : i + _insert_chunk_size]))
+                    inserted = session.execute(
+                        postgres_insert(ResultORM.__table__)
+                        .values(result_rows[i : i + _insert_chunk_size])
+                        .on_conflict_do_nothing(constraint="uix_results_keys")
+                        .returning(ResultORM.__table__.c.id)
+                    )
+                    inserted_ids.update(x for (x,) in inserted)
 
-                if get_count_fast(doc) == 0:
-                    doc = ResultORM(**result.dict(exclude={"id"}))
-                    session.add(doc)
-                    session.commit()  # TODO: faster if done in bulk
-                    result_ids.append(str(doc.id))
+                # Results inserted concurrently by another transaction win the conflict
+                lost = []
+                for new_id, key in zip(new_ids, new_records):
+                    if new_id in inserted_ids:
+                        created[key] = new_id
+                    else:
+                        lost.append(new_id)
+
+                if lost:
+                    session.execute(BaseResultORM.__table__.delete().where(BaseResultORM.__table__.c.id.in_(lost)))
+                    existing.update(self._find_results(session, [k for k in new_records if k not in created]))
+
+            result_ids = []
+            for key in result_keys:
+                if key in created:
+                    # Repeated records are duplicates of the first one
+                    existing[key] = created.pop(key)
                     meta["n_inserted"] += 1
                 else:
-                    id = str(doc.first().id)
-                    meta["duplicates"].append(id)  # TODO
-                    # If new or duplicate, add the id to the return list
-                    result_ids.append(id)
+                    meta["duplicates"].append(str(existing[key]))
+
+                result_ids.append(str(existing[key]))
+
         meta["success"] = True
 
         ret = {"data": result_ids, "meta": meta}
@@ -1185,24 +1929,16 @@ class SQLAlchemySocket:
             number of records updated
         """
 
-        # try:
-        updated_count = 0
+        updates = {}
         for result in record_list:
-
             if result.id is None:
                 self.logger.error("Attempted update without ID, skipping")
                 continue
-            with self.session_scope() as session:
 
-                result_db = session.query(ResultORM).filter_by(id=result.id).first()
+            updates[int(result.id)] = result.dict(exclude={"id"})
 
-                data = result.dict(exclude={"id"})
-
-                for attr, val in data.items():
-                    setattr(result_db, attr, val)
-
-                session.commit()
-                updated_count += 1
+        with self.session_scope() as session:
+            updated_count = self._bulk_update(session, ResultORM, updates)
 
         return updated_count
 
@@ -1215,6 +1951,7 @@ class SQLAlchemySocket:
 
         """
 
+    @replica_read
     def get_results(
         self,
         id: Union[str, List] = None,
@@ -1231,6 +1968,8 @@ class SQLAlchemySocket:
         exclude: Optional[List[str]] = None,
         limit: int = None,
         skip: int = 0,
+        cursor: Optional[str] = None,
+        count: str = "exact",
         return_json=True,
         with_ids=True,
     ):
@@ -1264,6 +2003,12 @@ class SQLAlchemySocket:
             (This is to avoid overloading the server)
         skip : int, default is 0
             skip the first 'skip' results. Used to paginate
+        cursor : str, optional
+            Resume a keyset paginated query after this cursor, ``skip`` is then ignored.
+            An empty string starts a new paginated query.
+        count : str, default is "exact"
+            How ``n_found`` is computed: "exact", "estimate" (query planner estimate) or "none"
+            (the number of returned entries).
         return_json : bool, default is True
             Return the results as a list of json inseated of objects
         with_ids : bool, default is True
@@ -1297,9 +2042,14 @@ class SQLAlchemySocket:
             status=status,
         )
 
-        data, meta["n_found"] = self.get_query_projection(
-            ResultORM, query, include=include, exclude=exclude, limit=limit, skip=skip
-        )
+        try:
+            data, meta["n_found"], meta["cursor"] = self.get_query_projection(
+                ResultORM, query, include=include, exclude=exclude, limit=limit, skip=skip, cursor=cursor, count=count
+            )
+        except ValueError as err:
+            meta["error_description"] = str(err)
+            return {"data": [], "meta": meta}
+
         meta["success"] = True
 
         return {"data": data, "meta": meta}
@@ -1358,8 +2108,12 @@ class SQLAlchemySocket:
         with self.session_scope() as session:
             results = session.query(ResultORM).filter(ResultORM.id.in_(ids)).all()
             # delete through session to delete correctly from base_result
+            blob_ids = []
             for result in results:
+                blob_ids.extend(getattr(result, k) for k in _kvstore_columns)
                 session.delete(result)
+            session.flush()
+            self._release_kvstore(session, blob_ids)
             session.commit()
             count = len(results)
 
@@ -1381,23 +2135,18 @@ class SQLAlchemySocket:
         """
 
         meta = add_metadata_template()
-        blob_ids = []
-        with self.session_scope() as session:
-            for blob in blobs_list:
-                if blob is None:
-                    blob_ids.append(None)
-                    continue
 
-                doc = WavefunctionStoreORM(**blob)
-                session.add(doc)
-                session.commit()
-                blob_ids.append(str(doc.id))
-                meta["n_inserted"] += 1
+        rows = [blob for blob in blobs_list if blob is not None]
+        with self.session_scope() as session:
+            new_ids = iter(self._insert_many(session, WavefunctionStoreORM.__table__, rows))
 
+        blob_ids = [None if blob is None else str(next(new_ids)) for blob in blobs_list]
+        meta["n_inserted"] = len(rows)
         meta["success"] = True
 
         return {"data": blob_ids, "meta": meta}
 
+    @replica_read
     def get_wavefunction_store(
         self,
         id: List[str] = None,
@@ -1429,7 +2178,7 @@ class SQLAlchemySocket:
         meta = get_metadata_template()
 
         query = format_query(WavefunctionStoreORM, id=id)
-        rdata, meta["n_found"] = self.get_query_projection(
+        rdata, meta["n_found"], _ = self.get_query_projection(
             WavefunctionStoreORM, query, limit=limit, skip=skip, include=include, exclude=exclude
         )
 
@@ -1490,6 +2239,7 @@ class SQLAlchemySocket:
         ret = {"data": procedure_ids, "meta": meta}
         return ret
 
+    @replica_read
     def get_procedures(
         self,
         id: Union[str, List] = None,
@@ -1503,6 +2253,8 @@ class SQLAlchemySocket:
         exclude=None,
         limit: int = None,
         skip: int = 0,
+        cursor: Optional[str] = None,
+        count: str = "exact",
         return_json=True,
         with_ids=True,
     ):
@@ -1528,6 +2280,12 @@ class SQLAlchemySocket:
             (This is to avoid overloading the server)
         skip : int, default is 0
             skip the first 'skip' resaults. Used to paginate
+        cursor : str, optional
+            Resume a keyset paginated query after this cursor, ``skip`` is then ignored.
+            An empty string starts a new paginated query.
+        count : str, default is "exact"
+            How ``n_found`` is computed: "exact", "estimate" (query planner estimate) or "none"
+            (the number of returned entries).
         return_json : bool, deafult is True
             Return the results as a list of json inseated of objects
         with_ids : bool, default is True
@@ -1574,8 +2332,15 @@ class SQLAlchemySocket:
         try:
             # TODO: decide a way to find the right type
 
-            data, meta["n_found"] = self.get_query_projection(
-                className, query, limit=limit, skip=skip, include=include, exclude=exclude
+            data, meta["n_found"], meta["cursor"] = self.get_query_projection(
+                className,
+                query,
+                limit=limit,
+                skip=skip,
+                cursor=cursor,
+                count=count,
+                include=include,
+                exclude=exclude,
             )
             meta["success"] = True
         except Exception as err:
@@ -1585,46 +2350,41 @@ class SQLAlchemySocket:
 
     def update_procedures(self, records_list: List["BaseRecord"]):
         """
-        TODO: needs to be of specific type
-        """
+        Update procedures, only the changed columns of each procedure are written.
 
-        updated_count = 0
-        with self.session_scope() as session:
-            for procedure in records_list:
-
-                className = get_procedure_class(procedure)
-                # join_table = get_procedure_join(procedure)
-                # Must have ID
-                if procedure.id is None:
-                    self.logger.error(
-                        "No procedure id found on update (hash_index={}), skipping.".format(procedure.hash_index)
-                    )
-                    continue
+        Parameters
+        ----------
+        records_list : List[BaseRecord]
+            The procedures to update, each must have an id that exists in the DB.
 
-                proc_db = session.query(className).filter_by(id=procedure.id).first()
+        Returns
+        -------
+            number of records updated
+        """
 
-                data = procedure.dict(exclude={"id"})
-                proc_db.update_relations(**data)
+        with self.session_scope() as session:
+            updated_count = self._update_procedures(session, records_list)
 
-                for attr, val in data.items():
-                    setattr(proc_db, attr, val)
+        return updated_count
 
-                # session.add(proc_db)
+    def _update_procedures(self, session, records_list: List["BaseRecord"]) -> int:
 
-                # Upsert relations (insert or update)
-                # needs primarykeyconstraint on the table keys
-                # for result_id in procedure.trajectory:
-                #     statement = postgres_insert(opt_result_association)\
-                #         .values(opt_id=procedure.id, result_id=result_id)\
-                #         .on_conflict_do_update(
-                #             index_elements=[opt_result_association.c.opt_id, opt_result_association.c.result_id],
-                #             set_=dict(result_id=result_id))
-                #     session.execute(statement)
+        updates = {}
+        for procedure in records_list:
+            # Must have ID
+            if procedure.id is None:
+                self.logger.error(
+                    "No procedure id found on update (hash_index={}), skipping.".format(procedure.hash_index)
+                )
+                continue
 
-                session.commit()
-                updated_count += 1
+            className = get_procedure_class(procedure)
+            updates.setdefault(className, {})[int(procedure.id)] = procedure.dict(exclude={"id"})
 
-        # session.commit()  # save changes, takes care of inheritance
+        # Relations (such as the trajectory) are rebuilt through update_relations on the loaded rows
+        updated_count = 0
+        for className, class_updates in updates.items():
+            updated_count += self._bulk_update(session, className, class_updates, relations=True)
 
         return updated_count
 
@@ -1656,8 +2416,12 @@ class SQLAlchemySocket:
                 .all()
             )
             # delete through session to delete correctly from base_result
+            blob_ids = []
             for proc in procedures:
+                blob_ids.extend(getattr(proc, k) for k in _kvstore_columns)
                 session.delete(proc)
+            session.flush()
+            self._release_kvstore(session, blob_ids)
             # session.commit()
             count = len(procedures)
 
@@ -1723,6 +2487,8 @@ class SQLAlchemySocket:
         status: str = None,
         limit: int = None,
         skip: int = 0,
+        cursor: Optional[str] = None,
+        count: str = "exact",
         return_json=True,
     ):
         """
@@ -1740,6 +2506,11 @@ class SQLAlchemySocket:
             (This is to avoid overloading the server)
         skip : int, default is 0
             skip the first 'skip' resaults. Used to paginate
+        cursor : str, optional
+            Resume a keyset paginated query after this cursor, ``skip`` is then ignored and the
+            services are ordered by id instead of priority.
+        count : str, default is "exact"
+            Services are not counted, ``n_found`` is always the number of returned services.
         return_json : bool, deafult is True
             Return the results as a list of json instead of objects
 
@@ -1752,15 +2523,25 @@ class SQLAlchemySocket:
         meta = get_metadata_template()
         query = format_query(ServiceQueueORM, id=id, hash_index=hash_index, procedure_id=procedure_id, status=status)
 
+        try:
+            last_id = decode_cursor(cursor)
+        except ValueError as err:
+            meta["error_description"] = str(err)
+            return {"data": [], "meta": meta}
+
         with self.session_scope() as session:
-            data = (
-                session.query(ServiceQueueORM)
-                .filter(*query)
-                .order_by(ServiceQueueORM.priority.desc(), ServiceQueueORM.created_on)
-                .limit(limit)
-                .offset(skip)
-                .all()
-            )
+            data = session.query(ServiceQueueORM).filter(*query)
+            if cursor is None:
+                data = data.order_by(ServiceQueueORM.priority.desc(), ServiceQueueORM.created_on)
+                data = data.limit(limit).offset(skip).all()
+            else:
+                # Keyset pagination, only the services after the last seen id are considered
+                limit = self.get_limit(limit)
+                if last_id is not None:
+                    data = data.filter(ServiceQueueORM.id > last_id)
+                data = data.order_by(ServiceQueueORM.id).limit(limit).all()
+                meta["cursor"] = encode_cursor(data[-1].id) if len(data) == limit else None
+
             data = [x.to_dict() for x in data]
 
         meta["n_found"] = len(data)
@@ -1787,31 +2568,27 @@ class SQLAlchemySocket:
             if operation is succesful
         """
 
-        updated_count = 0
+        service_keys = set(ServiceQueueORM.__dict__.keys())
+
+        updates = {}
+        procedures = []
         for service in records_list:
             if service.id is None:
                 self.logger.error("No service id found on update (hash_index={}), skipping.".format(service.hash_index))
                 continue
 
-            with self.session_scope() as session:
-
-                doc_db = session.query(ServiceQueueORM).filter_by(id=service.id).first()
-
-                data = service.dict(include=set(ServiceQueueORM.__dict__.keys()))
-                data["extra"] = service.dict(exclude=set(ServiceQueueORM.__dict__.keys()))
-
-                data["id"] = int(data["id"])
-                for attr, val in data.items():
-                    setattr(doc_db, attr, val)
-
-                session.add(doc_db)
-                session.commit()
+            data = service.dict(include=service_keys, exclude={"id"})
+            data["extra"] = service.dict(exclude=service_keys)
+            updates[int(service.id)] = data
 
             procedure = service.output
             procedure.__dict__["id"] = service.procedure_id
-            self.update_procedures([procedure])
+            procedures.append(procedure)
 
-            updated_count += 1
+        # Services and their procedures are written in the same transaction
+        with self.session_scope() as session:
+            updated_count = self._bulk_update(session, ServiceQueueORM, updates)
+            self._update_procedures(session, procedures)
 
         return updated_count
 
@@ -1897,33 +2674,58 @@ class SQLAlchemySocket:
 
         meta = add_metadata_template()
 
-        results = []
+        # The first task of every base_result is inserted
+        rows = {}
+        for record in data:
+            task_dict = record.dict(exclude={"id"})
+            base_result = int(task_dict.pop("base_result"))
+            if base_result in rows:
+                continue
+
+            task_dict["base_result_id"] = base_result
+            task_dict["priority"] = task_dict["priority"].value  # Must be an integer for sorting
+            rows[base_result] = task_dict
+
+        rows = list(rows.values())
         with self.session_scope() as session:
-            for task_num, record in enumerate(data):
-                try:
-                    task_dict = record.dict(exclude={"id"})
-                    # # for compatibility with mongoengine
-                    # if isinstance(task_dict['base_result'], dict):
-                    #     task_dict['base_result'] = task_dict['base_result']['id']
-                    task = TaskQueueORM(**task_dict)
-                    task.priority = task.priority.value  # Must be an integer for sorting
-                    session.add(task)
-                    session.commit()
-                    results.append(str(task.id))
-                    meta["n_inserted"] += 1
-                except IntegrityError as err:  # rare case
-                    # print(str(err))
-                    session.rollback()
-                    # TODO: merge hooks
-                    task = session.query(TaskQueueORM).filter_by(base_result_id=record.base_result).first()
-                    self.logger.warning("queue_submit got a duplicate task: {}".format(task.to_dict()))
-                    results.append(str(task.id))
-                    meta["duplicates"].append(task_num)
-                # except Exception as err:
-                #     self.logger.warning('queue_submit submission error: {}'.format(str(err)))
-                #     meta["success"] = False
-                #     meta["errors"].append(str(err))
-                #     results.append(None)
+            task_ids = {}
+            for i in range(0, len(rows), _insert_chunk_size):
+                stmt = (
+                    postgres_insert(TaskQueueORM.__table__)
+                    .values(rows[i : i + _insert_chunk_size])
+                    .on_conflict_do_nothing(index_elements=[TaskQueueORM.__table__.c.base_result_id])
+                    .returning(TaskQueueORM.__table__.c.base_result_id, TaskQueueORM.__table__.c.id)
+                )
+                task_ids.update(session.execute(stmt))
+
+            # TODO: merge hooks
+            inserted = set(task_ids)
+            new_tasks = [
+                {"tag": x["tag"], "program": x["program"], "procedure": x["procedure"]}
+                for x in rows
+                if x["base_result_id"] in inserted
+            ]
+            existing = [x["base_result_id"] for x in rows if x["base_result_id"] not in inserted]
+            if existing:
+                query = session.query(TaskQueueORM.base_result_id, TaskQueueORM.id)
+                task_ids.update(query.filter(TaskQueueORM.base_result_id.in_(existing)))
+
+        results = []
+        for task_num, record in enumerate(data):
+            base_result = int(record.base_result)
+            results.append(str(task_ids[base_result]))
+
+            if base_result in inserted:
+                inserted.remove(base_result)
+                meta["n_inserted"] += 1
+            else:
+                meta["duplicates"].append(task_num)
+
+        if meta["duplicates"]:
+            self.logger.warning("queue_submit got {} duplicate tasks.".format(len(meta["duplicates"])))
+
+        if new_tasks:
+            self._notify_queue(new_tasks)
 
         meta["success"] = True
 
@@ -1933,7 +2735,12 @@ class SQLAlchemySocket:
     def queue_get_next(
         self, manager, available_programs, available_procedures, limit=100, tag=None, as_json=True
     ) -> List[TaskRecord]:
-        """Done in a transaction"""
+        """Claims the next waiting tasks for a manager in a single atomic statement.
+
+        The waiting tasks are selected in tag order, then by priority and creation time, and
+        locked with ``FOR UPDATE SKIP LOCKED`` so concurrent managers or server processes never
+        claim the same task.
+        """
 
         # Figure out query, tagless has no requirements
         query = format_query(TaskQueueORM, status=TaskStatusEnum.waiting, program=available_programs, tag=tag)
@@ -1952,28 +2759,32 @@ class SQLAlchemySocket:
         order_by.extend([TaskQueueORM.priority.desc(), TaskQueueORM.created_on])
 
         with self.session_scope() as session:
-            query = session.query(TaskQueueORM).filter(*query).order_by(*order_by).limit(limit)
-
-            # print(query.statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
-            found = query.all()
+            # Tasks locked by a concurrent claim are skipped rather than handed out twice
+            claim = (
+                session.query(TaskQueueORM.id)
+                .filter(*query)
+                .order_by(*order_by)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
 
-            ids = [x.id for x in found]
             update_fields = {"status": TaskStatusEnum.running, "modified_on": dt.utcnow(), "manager": manager}
-            # Bulk update operation in SQL
-            update_count = (
-                session.query(TaskQueueORM)
-                .filter(TaskQueueORM.id.in_(ids))
-                .update(update_fields, synchronize_session=False)
+            claimed = session.execute(
+                TaskQueueORM.__table__.update()
+                .where(TaskQueueORM.id.in_(claim.statement))
+                .values(**update_fields)
+                .returning(TaskQueueORM.id)
             )
+            ids = [x for (x,) in claimed]
+
+            found = []
+            if ids:
+                found = session.query(TaskQueueORM).filter(TaskQueueORM.id.in_(ids)).order_by(*order_by).all()
 
             if as_json:
-                # avoid another trip to the DB to get the updated values, set them here
-                found = [TaskRecord(**task.to_dict(exclude=update_fields.keys()), **update_fields) for task in found]
+                found = [TaskRecord(**task.to_dict()) for task in found]
             session.commit()
 
-        if update_count != len(found):
-            self.logger.warning("QUEUE: Number of found projects does not match the number of updated projects.")
-
         return found
 
     def get_queue(
@@ -1989,6 +2800,8 @@ class SQLAlchemySocket:
         exclude=None,
         limit: int = None,
         skip: int = 0,
+        cursor: Optional[str] = None,
+        count: str = "exact",
         return_json=False,
         with_ids=True,
     ):
@@ -2014,6 +2827,12 @@ class SQLAlchemySocket:
             (This is to avoid overloading the server)
         skip : int, default is None 0
             skip the first 'skip' resaults. Used to paginate
+        cursor : str, optional
+            Resume a keyset paginated query after this cursor, ``skip`` is then ignored.
+            An empty string starts a new paginated query.
+        count : str, default is "exact"
+            How ``n_found`` is computed: "exact", "estimate" (query planner estimate) or "none"
+            (the number of returned entries).
         return_json : bool, deafult is True
             Return the results as a list of json inseated of objects
         with_ids : bool, default is True
@@ -2039,8 +2858,15 @@ class SQLAlchemySocket:
 
         data = []
         try:
-            data, meta["n_found"] = self.get_query_projection(
-                TaskQueueORM, query, limit=limit, skip=skip, include=include, exclude=exclude
+            data, meta["n_found"], meta["cursor"] = self.get_query_projection(
+                TaskQueueORM,
+                query,
+                limit=limit,
+                skip=skip,
+                cursor=cursor,
+                count=count,
+                include=include,
+                exclude=exclude,
             )
             meta["success"] = True
         except Exception as err:
@@ -2150,7 +2976,14 @@ class SQLAlchemySocket:
                 .all()
             )
 
-            for (task_id, msg), task_obj, base_result in zip(sorted_data.items(), task_objects, base_results):
+            error_ids, _ = self._add_kvstore(session, list(sorted_data.values()))
+
+            # Errors of previous attempts are replaced
+            previous_errors = [base_result.error for base_result in base_results]
+
+            for (task_id, msg), error_id, task_obj, base_result in zip(
+                sorted_data.items(), error_ids, task_objects, base_results
+            ):
 
                 task_ids.append(task_id)
                 # update task
@@ -2161,10 +2994,12 @@ class SQLAlchemySocket:
                 base_result.status = TaskStatusEnum.error
                 base_result.manager_name = task_obj.manager
                 base_result.modified_on = dt.utcnow()
-                base_result.error_obj = KVStoreORM(value=msg)
+                base_result.error = error_id
 
                 # session.add(task_obj)
 
+            session.flush()
+            self._release_kvstore(session, previous_errors)
             session.commit()
 
         return len(task_ids)
@@ -2232,6 +3067,9 @@ class SQLAlchemySocket:
                 .update(dict(status=TaskStatusEnum.waiting, modified_on=dt.utcnow()), synchronize_session=False)
             )
 
+        if updated:
+            self._notify_queue(None)
+
         return updated
 
     def del_tasks(self, id: Union[str, list]):
@@ -2356,7 +3194,7 @@ class SQLAlchemySocket:
         if modified_after:
             query.append(QueueManagerORM.modified_on >= modified_after)
 
-        data, meta["n_found"] = self.get_query_projection(QueueManagerORM, query, limit=limit, skip=skip)
+        data, meta["n_found"], _ = self.get_query_projection(QueueManagerORM, query, limit=limit, skip=skip)
         meta["success"] = True
 
         return {"data": data, "meta": meta}
@@ -2368,7 +3206,7 @@ class SQLAlchemySocket:
         if timestamp_after:
             query.append(QueueManagerLogORM.timestamp >= timestamp_after)
 
-        data, meta["n_found"] = self.get_query_projection(
+        data, meta["n_found"], _ = self.get_query_projection(
             QueueManagerLogORM, query, limit=limit, skip=skip, exclude=["id"]
         )
         meta["success"] = True
@@ -2473,6 +3311,7 @@ class SQLAlchemySocket:
                 count = session.query(UserORM).filter_by(username=username).update(blob)
                 # doc.upsert_one(**blob)
                 success = count == 1
+                self._verification_cache.invalidate(username)
 
             else:
                 try:
@@ -2523,6 +3362,11 @@ class SQLAlchemySocket:
         if self._bypass_security or (self._allow_read and (permission == "read")):
             return (True, "Success")
 
+        # Skip the user query and bcrypt check for recently verified credentials
+        cache_key = self._verification_cache.key(username, password, permission)
+        if self._verification_cache.get(cache_key):
+            return (True, "Success")
+
         with self.session_scope() as session:
             data = session.query(UserORM).filter_by(username=username).first()
 
@@ -2546,6 +3390,7 @@ class SQLAlchemySocket:
             if (permission.lower() not in data.permissions) and ("admin" not in data.permissions):
                 return (False, "User has insufficient permissions.")
 
+        self._verification_cache.add(cache_key, username)
         return (True, "Success")
 
     def modify_user(
@@ -2601,6 +3446,8 @@ class SQLAlchemySocket:
             count = session.query(UserORM).filter_by(username=username).update(blob)
             success = count == 1
 
+        self._verification_cache.invalidate(username)
+
         if success:
             return True, None if password is None else f"New password is {password}"
         else:
@@ -2623,6 +3470,8 @@ class SQLAlchemySocket:
         with self.session_scope() as session:
             count = session.query(UserORM).filter_by(username=username).delete(synchronize_session=False)
 
+        self._verification_cache.invalidate(username)
+
         return count == 1
 
     def get_user_permissions(self, username: str) -> Optional[List[str]]:
@@ -2729,7 +3578,38 @@ class SQLAlchemySocket:
 
         return count
 
-    def log_server_stats(self):
+    def log_server_stats(self, count: str = "estimate"):
+        """
+        Computes and stores the server statistics.
+
+        Parameters
+        ----------
+        count : str, optional
+            How the table row counts are computed, ``"estimate"`` reads the Postgres statistics and
+            ``"exact"`` runs a COUNT over each table. The result counts and the per-state breakdown
+            are always exact as they come from the trigger maintained counters.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The logged statistics
+        """
+
+        if count not in {"exact", "estimate"}:
+            raise ValueError(f"Count type '{count}' not understood.")
+
+        # Compacting the result state counters writes, so the statistics are always read from the primary
+        with self.primary():
+            data = self._collect_server_stats(count)
+
+        with self.session_scope() as session:
+            log = ServerStatsLogORM(**data)
+            session.add(log)
+            session.commit()
+
+        return data
+
+    def _collect_server_stats(self, count: str) -> Dict[str, Any]:
 
         table_info = self.custom_query("database_stats", "table_information")["data"]
 
@@ -2740,18 +3620,19 @@ class SQLAlchemySocket:
             table_size += row[2] - row[3] - (row[4] or 0)
             index_size += row[3]
 
-        # Calculate result state info, turns out to be very costly for large databases
-        # state_data = self.custom_query("result", "count", groupby={'result_type', 'status'})["data"]
-        # result_states = {}
+        # Calculate result state info from the incremental counters
+        state_data = self.custom_query("database_stats", "result_states")
+        result_states = state_data["data"] if state_data["meta"]["success"] else {}
 
-        # for row in state_data:
-        #     result_states.setdefault(row["result_type"], {})
-        #     result_states[row["result_type"]][row["status"]] = row["count"]
-        result_states = {}
+        tables = ["collection", "molecule", "kv_store", "access_log"]
+        if not state_data["meta"]["success"]:
+            self.logger.warning(f"Result state counters unavailable: {state_data['meta']['error_description']}")
+            tables.append("base_result")
 
         counts = {}
-        for table in ["collection", "molecule", "base_result", "kv_store", "access_log"]:
-            counts[table] = self.custom_query("database_stats", "table_count", table_name=table)["data"][0]
+        for table in tables:
+            counts[table] = self.custom_query("database_stats", f"table_{count}", table_name=table)["data"][0]
+        counts.setdefault("base_result", sum(sum(states.values()) for states in result_states.values()))
 
         # Build out final data
         data = {
@@ -2767,11 +3648,6 @@ class SQLAlchemySocket:
             "db_table_information": table_info,
         }
 
-        with self.session_scope() as session:
-            log = ServerStatsLogORM(**data)
-            session.add(log)
-            session.commit()
-
         return data
 
     def get_server_stats_log(self, before=None, after=None, limit=None, skip=0):
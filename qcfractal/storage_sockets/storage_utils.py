@@ -2,7 +2,20 @@
 Contains a number of utility functions for storage sockets.
 """
 
+import base64
+import hashlib
+import hmac
 import json
+import secrets
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
 
 # Constants
 _get_metadata = json.dumps({"errors": [], "n_found": 0, "success": False, "missing": [], "error_description": False})
@@ -19,6 +32,64 @@ _add_metadata = json.dumps(
 )
 
 
+def _zstd():
+    try:
+        import zstandard
+
+        return zstandard
+    except ImportError:
+        return None
+
+
+def compress_kvstore_value(value: Any) -> Tuple[bytes, str, str]:
+    """
+    Serializes and compresses a KVStore value for storage.
+
+    Values are compressed with zstd if the zstandard package is installed and zlib otherwise,
+    values that do not shrink are stored uncompressed.
+
+    Returns
+    -------
+    Tuple[bytes, str, str]
+        The stored bytes, the compression used ("zstd", "zlib" or "none") and the sha256 hex digest
+        of the serialized value which identifies the content.
+    """
+
+    raw = json.dumps(value, sort_keys=True, separators=(",", ":")).encode("UTF-8")
+    digest = hashlib.sha256(raw).hexdigest()
+
+    zstandard = _zstd()
+    if zstandard is not None:
+        data, compression = zstandard.ZstdCompressor(level=3).compress(raw), "zstd"
+    else:
+        data, compression = zlib.compress(raw, 6), "zlib"
+
+    if len(data) >= len(raw):
+        data, compression = raw, "none"
+
+    return data, compression, digest
+
+
+def decompress_kvstore_value(data: bytes, compression: str) -> Any:
+    """
+    Restores a KVStore value stored by ``compress_kvstore_value``.
+    """
+
+    if compression == "zstd":
+        zstandard = _zstd()
+        if zstandard is None:
+            raise ImportError("Reading zstd compressed KVStore entries requires the zstandard package.")
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    elif compression == "zlib":
+        raw = zlib.decompress(data)
+    elif compression == "none":
+        raw = data
+    else:
+        raise ValueError(f"KVStore compression '{compression}' not understood.")
+
+    return json.loads(bytes(raw).decode("UTF-8"))
+
+
 def get_metadata_template():
     """
     Returns a copy of the metadata for database getters.
@@ -31,3 +102,182 @@ def add_metadata_template():
     Returns a copy of the metadata for database save/updates.
     """
     return json.loads(_add_metadata)
+
+
+def encode_cursor(last_id: int) -> str:
+    """
+    Builds an opaque pagination cursor that resumes a query after the given id.
+    """
+    blob = json.dumps({"sort": "id", "last": int(last_id)}).encode("UTF-8")
+    return base64.urlsafe_b64encode(blob).decode("UTF-8")
+
+
+def decode_cursor(cursor: str) -> Optional[int]:
+    """
+    Returns the last seen id of a pagination cursor, an empty cursor starts from the beginning.
+    """
+    if not cursor:
+        return None
+
+    try:
+        blob = json.loads(base64.urlsafe_b64decode(cursor.encode("UTF-8")))
+        if blob["sort"] != "id":
+            raise KeyError(blob["sort"])
+        return int(blob["last"])
+    except Exception:
+        raise ValueError(f"Pagination cursor '{cursor}' is not valid.") from None
+
+
+class UserVerificationCache:
+    """
+    A thread-safe, TTL and size bounded cache of successful user verifications.
+
+    Entries are keyed on a keyed digest of the username, password, and permission so
+    that plaintext passwords are never held by the cache.
+    """
+
+    def __init__(self, ttl: float = 60, maxsize: int = 1024):
+        """
+        Parameters
+        ----------
+        ttl : float, optional
+            The number of seconds an entry is valid for, 0 disables the cache.
+        maxsize : int, optional
+            The maximum number of entries, the least recently used entries are evicted first.
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+        self._secret = secrets.token_bytes(32)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, username: str, password: str, permission: str) -> bytes:
+        """
+        Builds the cache key for a set of credentials.
+        """
+        msg = "\0".join([username, password, permission]).encode("UTF-8")
+        return hmac.new(self._secret, msg, hashlib.sha256).digest()
+
+    def get(self, key: bytes) -> bool:
+        """
+        Returns True if the credentials were recently verified.
+        """
+        if self.ttl <= 0:
+            return False
+
+        with self._lock:
+            entry = self._data.get(key, None)
+            if entry is None:
+                return False
+
+            if entry[0] < time.monotonic():
+                del self._data[key]
+                return False
+
+            self._data.move_to_end(key)
+            return True
+
+    def add(self, key: bytes, username: str) -> None:
+        """
+        Records a successful verification for a given user.
+        """
+        if self.ttl <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, username)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, username: str) -> None:
+        """
+        Removes all entries for a given user.
+        """
+        with self._lock:
+            for key in [k for k, v in self._data.items() if v[1] == username]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        """
+        Removes all entries.
+        """
+        with self._lock:
+            self._data.clear()
+
+
+class TimedQueuePool(QueuePool):
+    """
+    A QueuePool that records how long checkouts wait for a connection and how many connections are in use.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._metrics_lock = threading.Lock()
+        self._metrics = {"checkouts": 0, "timeouts": 0, "wait_total": 0.0, "wait_max": 0.0, "in_use_peak": 0}
+
+    def recreate(self):
+        # Keep the counters when the pool is recreated, e.g. after a dispose
+        pool = super().recreate()
+        pool._metrics_lock = self._metrics_lock
+        pool._metrics = self._metrics
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            with self._metrics_lock:
+                self._metrics["timeouts"] += 1
+            raise
+
+        wait = time.perf_counter() - start
+        with self._metrics_lock:
+            self._metrics["checkouts"] += 1
+            self._metrics["wait_total"] += wait
+            self._metrics["wait_max"] = max(self._metrics["wait_max"], wait)
+            self._metrics["in_use_peak"] = max(self._metrics["in_use_peak"], self.checkedout())
+
+        return conn
+
+    def statistics(self) -> Dict[str, Any]:
+        """
+        Returns the checkout metrics and the current utilisation of the pool.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The number of checkouts and checkout timeouts, the mean and maximum checkout wait in seconds,
+            the connections in use (now and at peak), the pool capacity and its utilisation. The capacity
+            and utilisation are None for pools with unlimited overflow.
+        """
+
+        in_use = self.checkedout()
+        capacity = self.size() + self._max_overflow if self._max_overflow >= 0 else None
+
+        with self._metrics_lock:
+            ret = dict(self._metrics)
+
+        ret["wait_mean"] = (ret["wait_total"] / ret["checkouts"]) if ret["checkouts"] else 0.0
+        ret["in_use"] = in_use
+        ret["capacity"] = capacity
+        ret["utilisation"] = (in_use / capacity) if capacity else None
+        return ret
+
+
+class TransactionSession(Session):
+    """
+    A Session whose commits only flush while ``deferred`` is set, so that the commits of storage
+    calls made within an enclosing transaction do not end that transaction.
+    """
+
+    deferred = False
+
+    def commit(self):
+        if self.deferred:
+            self.flush()
+        else:
+            super().commit()
@@ -0,0 +1,90 @@
+"""
+Tests the queued writes of the API access logger
+"""
+
+import contextlib
+import threading
+from types import SimpleNamespace
+
+from qcfractal.storage_sockets.api_logger import API_AccessLogger
+from qcfractal.testing import await_true
+
+
+class RecordingSocket:
+    """Records the batches of access logs saved through it"""
+
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def workload(self, name):
+        return contextlib.nullcontext()
+
+    def save_access(self, batch):
+        with self.lock:
+            self.batches.append(list(batch))
+
+    def saved(self):
+        with self.lock:
+            return [len(x) for x in self.batches]
+
+
+def make_request(n):
+    return SimpleNamespace(uri="/molecule", method="GET", headers={"User-Agent": f"test-{n}"}, remote_ip="127.0.0.1")
+
+
+def test_api_logger_flush_on_size():
+
+    socket = RecordingSocket()
+    api_logger = API_AccessLogger("no_geo_file", storage_socket=socket, flush_interval=60, flush_size=3)
+
+    try:
+        # Filling a batch wakes the writer well before the flush interval
+        for n in range(2):
+            assert api_logger.log_access(make_request(n))
+        assert not await_true(0.5, lambda: socket.saved(), period=0.05)
+
+        assert api_logger.log_access(make_request(2))
+        assert await_true(5, lambda: socket.saved() == [3], period=0.05)
+        assert [x["user_agent"] for x in socket.batches[0]] == ["test-0", "test-1", "test-2"]
+        assert api_logger.n_logged == 3
+    finally:
+        api_logger.stop()
+
+
+def test_api_logger_drop_on_overflow():
+
+    socket = RecordingSocket()
+    api_logger = API_AccessLogger(
+        "no_geo_file", storage_socket=socket, flush_interval=60, flush_size=100, max_queue_size=4, overload_sample=2
+    )
+
+    try:
+        queued = [api_logger.log_access(make_request(n)) for n in range(10)]
+
+        # Past half the queue size every second entry is kept, past the full size all are dropped
+        assert queued == [True, True, False, True, False, True, False, False, False, False]
+        assert api_logger.n_dropped == 6
+    finally:
+        api_logger.stop()
+
+    assert socket.saved() == [4]
+    assert [x["user_agent"] for x in socket.batches[0]] == ["test-0", "test-1", "test-3", "test-5"]
+
+
+def test_api_logger_stop_drains_queue():
+
+    socket = RecordingSocket()
+    api_logger = API_AccessLogger("no_geo_file", storage_socket=socket, flush_interval=60, flush_size=100)
+
+    # Neither the interval nor the batch size is reached, the entries are written on shutdown
+    for n in range(5):
+        assert api_logger.log_access(make_request(n))
+    assert socket.saved() == []
+
+    api_logger.stop()
+
+    assert socket.saved() == [5]
+    assert len(api_logger._queue) == 0
+    assert api_logger.n_logged == 5
+    assert api_logger.n_dropped == 0
@@ -2,6 +2,11 @@
 Tests the interface portal adapter to the REST API
 """
 
+import copy
+import http.server
+import pickle
+import threading
+
 import numpy as np
 import pytest
 
@@ -160,3 +165,144 @@ def test_custom_queries(test_server, encoding):
 
     assert ret.meta.success
     assert ret.meta.n_found == 0
+
+
+def test_client_retries(test_server):
+
+    client = ptl.FractalClient(test_server, backoff_factor=0)
+
+    # Fails with each retried status once before answering
+    statuses = [502, 503, 504, 200]
+    seen = []
+
+    class FlakyHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            seen.append(self.path)
+            self.send_response(statuses[len(seen) - 1])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    flaky = http.server.HTTPServer(("127.0.0.1", 0), FlakyHandler)
+    thread = threading.Thread(target=flaky.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        client.address = f"http://127.0.0.1:{flaky.server_port}/"
+        r = client._request("get", "flaky")
+        assert r.status_code == 200
+        assert seen == ["/flaky"] * 4
+    finally:
+        flaky.shutdown()
+        flaky.server_close()
+        client.close()
+
+
+def test_client_sessions(test_server):
+
+    client = ptl.FractalClient(test_server)
+
+    sessions = {}
+
+    def get_session(name):
+        sessions[name] = client._get_session()
+        assert client._get_session() is sessions[name]
+
+    threads = [threading.Thread(target=get_session, args=(i,)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Every thread has its own session over the shared connection pool
+    assert len({id(x) for x in sessions.values()}) == 3
+    assert all(x.get_adapter(client.address) is client._adapter for x in sessions.values())
+
+    # Closing drops all sessions, the client keeps working with new ones
+    session = client._get_session()
+    client.close()
+    assert client._sessions == []
+    assert client._get_session() is not session
+    assert client.server_information()["name"] == client.server_name
+
+    # Copies and unpickled clients build their own pool
+    for other in [copy.copy(client), copy.deepcopy(client), pickle.loads(pickle.dumps(client))]:
+        assert other._adapter is not client._adapter
+        assert other._sessions == []
+        assert other.server_information()["name"] == client.server_name
+        other.close()
+
+    client.close()
+
+
+def test_client_map_chunks(test_server):
+
+    client = ptl.FractalClient(test_server, max_in_flight=3)
+
+    water = ptl.data.get_molecule("water_dimer_minima.psimol")
+    mols = []
+    for _ in range(7):
+        mol = water.copy(deep=True)
+        mol.geometry[:] += np.random.random(mol.geometry.shape)
+        mols.append(mol)
+    ids = client.add_molecules(mols)
+
+    # Order is preserved across concurrent chunks, and every request is counted
+    n_requests = client._request_counter[("molecule", "get")]
+    chunks = client.map_chunks(lambda chunk_ids: client.query_molecules(id=chunk_ids), ids, chunk_size=2)
+    assert [[m.id for m in chunk] for chunk in chunks] == [ids[2 * i : 2 * i + 2] for i in range(4)]
+    assert client._request_counter[("molecule", "get")] == n_requests + 4
+
+    # Nested calls run serially and do not deadlock
+    nested = client.map_chunks(lambda chunk: client.map_chunks(len, chunk, chunk_size=1), ids, chunk_size=2)
+    assert nested == [[1, 1], [1, 1], [1, 1], [1]]
+
+    client.close()
+
+
+def test_client_cache(test_server, tmp_path):
+
+    client = ptl.FractalClient(test_server, cache_path=str(tmp_path))
+
+    water = ptl.data.get_molecule("water_dimer_minima.psimol")
+    water.geometry[:] += np.random.random(water.geometry.shape)
+    mol_id = client.add_molecules([water])[0]
+
+    # The first query misses, the second one is served from the cache
+    assert water.compare(client.query_molecules(id=mol_id)[0])
+    assert client.cache.statistics()["misses"] == 1
+
+    n_requests = client._request_counter[("molecule", "get")]
+    assert water.compare(client.query_molecules(id=[mol_id])[0])
+    assert client._request_counter[("molecule", "get")] == n_requests
+    assert client.cache.statistics()["hits"] == 1
+
+    # Non-id queries always go to the server
+    assert len(client.query_molecules(molecular_formula="H4O2"))
+    assert client._request_counter[("molecule", "get")] == n_requests + 1
+
+    # A new client against the same server shares the cache
+    client = ptl.FractalClient(test_server, cache_path=str(tmp_path))
+    assert water.compare(client.query_molecules(id=mol_id)[0])
+    assert client._request_counter[("molecule", "get")] == 0
+
+
+def test_client_cache_query_limit(test_server, tmp_path):
+
+    client = ptl.FractalClient(test_server, cache_path=str(tmp_path))
+    client.query_limit = 2
+
+    water = ptl.data.get_molecule("water_dimer_minima.psimol")
+    mols = []
+    for _ in range(5):
+        mol = water.copy(deep=True)
+        mol.geometry[:] += np.random.random(mol.geometry.shape)
+        mols.append(mol)
+    ids = client.add_molecules(mols)
+
+    # Cache misses are fetched in chunks of at most the query limit
+    found = client.query_molecules(id=ids)
+    assert [m.id for m in found] == ids
+    assert client._request_counter[("molecule", "get")] == 3
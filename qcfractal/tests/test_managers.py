@@ -6,10 +6,12 @@ import contextlib
 import datetime
 import logging
 import re
+import threading
 import time
 from concurrent.futures import ProcessPoolExecutor
 
 import pytest
+import tornado.ioloop
 
 import qcfractal.interface as ptl
 from qcfractal import FractalServer, queue, testing
@@ -226,6 +228,267 @@ def test_queue_manager_shutdown(compute_adapter_fixture):
     assert ret[0].status == "COMPLETE"
 
 
+@testing.using_rdkit
+def test_queue_manager_pipelined(compute_adapter_fixture):
+    """Tests that pipelined managers refill slots from prefetched tasks and push results in the background"""
+    client, server, adapter = compute_adapter_fixture
+    reset_server_database(server)
+
+    hooh = ptl.data.get_molecule("hooh.json")
+    molecules = [hooh.copy(update={"geometry": hooh.geometry + 0.1 * i}) for i in range(3)]
+    ret = client.add_compute("rdkit", "UFF", "", "energy", None, molecules)
+
+    manager = queue.QueueManager(client, adapter, max_tasks=1, pipelined=True, prefetch_tasks=2)
+
+    # One task is running, the others are prefetched
+    manager.update()
+    assert len(manager.list_current_tasks()) == 1
+    assert len(manager._task_buffer) == 2
+
+    # The freed slot is refilled without contacting the server
+    manager.queue_adapter.await_results()
+    assert manager.refill() == 1
+    assert len(manager._task_buffer) == 1
+    manager._send_queue.join()
+    assert sum(r.status == "COMPLETE" for r in client.query_results(ret.ids)) == 1
+
+    manager.await_results()
+    manager.await_results()
+    assert all(r.status == "COMPLETE" for r in client.query_results(ret.ids))
+    assert manager.statistics.total_successful_tasks == 3
+
+    shutdown = manager.shutdown()
+    assert shutdown["nshutdown"] == 0, shutdown["info"]
+    assert manager._sender is None
+
+
+def test_task_waiters():
+    """Tests that waiting manager requests are only woken by tasks they can compute"""
+
+    async def run():
+        waiters = queue.TaskWaiters(tornado.ioloop.IOLoop.current(), max_wait=10)
+
+        psi4 = waiters.subscribe(["psi4", "rdkit"], ["geometric"], None)
+        tagged = waiters.subscribe(["RDKit"], [], ["tag1", "tag2"])
+        assert len(waiters) == 2
+
+        assert waiters.notify([{"program": "dftd3", "procedure": None, "tag": None}]) == 0
+        assert waiters.notify([{"program": "rdkit", "procedure": "geometric", "tag": "tag1"}]) == 1
+        assert await waiters.wait(psi4, 1)
+        assert not await waiters.wait(tagged, 0.01)
+
+        assert waiters.notify([{"program": "rdkit", "procedure": None, "tag": "tag2"}]) == 1
+        assert await waiters.wait(tagged, 1)
+
+        waiters.unsubscribe(psi4)
+        waiters.unsubscribe(tagged)
+
+        # Unspecific announcements wake everyone, also from other threads
+        everyone = waiters.subscribe(["psi4"], [], "other")
+        threading.Thread(target=waiters.notify_threadsafe, args=(None,)).start()
+        assert await waiters.wait(everyone, 5)
+        waiters.unsubscribe(everyone)
+        assert len(waiters) == 0
+
+    tornado.ioloop.IOLoop.current().run_sync(run)
+
+
+@testing.using_rdkit
+def test_queue_manager_long_poll(compute_adapter_fixture):
+    """Tests that a waiting manager request returns as soon as tasks are submitted"""
+    client, server, adapter = compute_adapter_fixture
+    reset_server_database(server)
+
+    manager = queue.QueueManager(client, adapter, task_wait=30)
+    hooh = ptl.data.get_molecule("hooh.json")
+
+    def submit():
+        time.sleep(1)
+        client.add_compute("rdkit", "UFF", "", "energy", None, [hooh])
+
+    thread = threading.Thread(target=submit)
+    thread.start()
+
+    start = time.time()
+    manager.update()
+    thread.join()
+
+    assert len(manager.list_current_tasks()) == 1
+    assert time.time() - start < 20
+
+    manager.await_results()
+    assert client.query_results()[0].status == "COMPLETE"
+
+
+def test_queue_manager_pipelined_task_wait(compute_adapter_fixture):
+    """Tests that long-polling is rejected in pipelined mode"""
+    client, server, adapter = compute_adapter_fixture
+
+    with pytest.raises(ValueError):
+        queue.QueueManager(client, adapter, pipelined=True, task_wait=30)
+
+
+def test_queue_listen_reconnect(compute_adapter_fixture):
+    """Tests that the connection listening for task announcements is reopened when it is lost"""
+
+    client, server, adapter = compute_adapter_fixture
+
+    with testing.loop_in_thread() as loop:
+
+        server = FractalServer(
+            port=testing.find_open_port(),
+            storage_project_name=server.storage_database,
+            storage_uri=server.storage_uri,
+            loop=loop,
+            ssl_options=False,
+            queue_notify=True,
+        )
+        loop.add_callback(server.start, start_loop=False, start_periodics=False)
+        assert testing.await_true(10, lambda: server._queue_listen_conn is not None, period=0.1)
+        pid = server._queue_listen_conn.get_backend_pid()
+
+        # Drop the connection from the database side
+        with server.storage.session_scope() as session:
+            session.execute("SELECT pg_terminate_backend(:pid)", {"pid": pid})
+
+        def reconnected():
+            conn = server._queue_listen_conn
+            return (conn is not None) and (conn.get_backend_pid() != pid)
+
+        assert testing.await_true(10, reconnected, period=0.1)
+
+        loop.add_callback(server.stop, stop_loop=False)
+        assert testing.await_true(10, lambda: server._queue_listen_conn is None, period=0.1)
+
+
+@testing.using_rdkit
+def test_queue_manager_exchange(compute_adapter_fixture):
+    """Tests that results are returned and new tasks pulled through the exchange endpoint"""
+    client, server, adapter = compute_adapter_fixture
+    reset_server_database(server)
+
+    hooh = ptl.data.get_molecule("hooh.json")
+    molecules = [hooh.copy(update={"geometry": hooh.geometry + 0.1 * i}) for i in range(2)]
+    ret = client.add_compute("rdkit", "UFF", "", "energy", None, molecules)
+
+    manager = queue.QueueManager(client, adapter, max_tasks=1, exchange=True)
+
+    manager.await_results()
+    manager.await_results()
+    assert all(r.status == "COMPLETE" for r in client.query_results(ret.ids))
+    assert client._request_counter[("queue_manager", "get")] == 0
+
+    manager_record = server.storage.get_managers(name=manager.name())["data"][0]
+    assert manager_record["submitted"] == 2
+    assert manager_record["completed"] == 2
+    assert manager_record["failures"] == 0
+
+
+@testing.using_rdkit
+def test_queue_manager_chunked_upload(compute_adapter_fixture):
+    """Tests that completed tasks are pushed in size-bounded chunks"""
+    client, server, adapter = compute_adapter_fixture
+    reset_server_database(server)
+
+    hooh = ptl.data.get_molecule("hooh.json")
+    molecules = [hooh.copy(update={"geometry": hooh.geometry + 0.1 * i}) for i in range(3)]
+    ret = client.add_compute("rdkit", "UFF", "", "energy", None, molecules)
+
+    # Every task is larger than a chunk and pushed alone
+    manager = queue.QueueManager(client, adapter, upload_chunk_size=1)
+    posts = client._request_counter[("queue_manager", "post")]
+    manager.await_results()
+
+    assert client._request_counter[("queue_manager", "post")] - posts == 3
+    assert all(r.status == "COMPLETE" for r in client.query_results(ret.ids))
+
+
+def test_result_journal(tmp_path):
+    """Tests replay and compaction of the journal of undelivered results"""
+
+    journal = queue.ResultJournal(str(tmp_path), segment_size=100)
+    journal.append({"1": {"success": True}, "2": {"success": False}})
+    journal.append({"3": {"return_result": "x" * 200}})
+    journal.append({"4": {"success": True}})
+    assert journal.pending() == 4
+
+    # Only a single journal may use a folder
+    with pytest.raises(RuntimeError):
+        queue.ResultJournal(str(tmp_path))
+
+    # Fully delivered segments are removed
+    journal.mark_delivered(["1", "2", "3"])
+    assert len(list(tmp_path.glob("segment-*"))) == 1
+    journal.append({"5": {"success": True}})
+    journal.mark_delivered(["5"])
+    journal.close()
+
+    # A torn record of a crash is skipped on replay
+    with open(next(tmp_path.glob("segment-*")), "ab") as handle:
+        handle.write(b"\x20\x00\x00\x00torn")
+
+    journal = queue.ResultJournal(str(tmp_path))
+    assert journal.replay() == {"4": {"success": True}}
+
+    journal.mark_delivered(["4"])
+    assert journal.pending() == 0
+    assert len(list(tmp_path.glob("segment-*"))) == 0
+    journal.close()
+
+
+def test_result_journal_rollover(tmp_path):
+    """Tests delivery records of a segment that was closed because it is full"""
+
+    journal = queue.ResultJournal(str(tmp_path), segment_size=10)
+    journal.append({"1": {"success": True}, "2": {"success": True}})
+
+    journal.mark_delivered(["1"])
+    assert journal.pending() == 1
+    journal.mark_delivered(["2"])
+    assert journal.pending() == 0
+    assert len(list(tmp_path.glob("segment-*"))) == 0
+
+    # A new segment is opened for the next results
+    journal.append({"3": {"success": True}})
+    journal.close()
+
+    journal = queue.ResultJournal(str(tmp_path))
+    assert journal.replay() == {"3": {"success": True}}
+    journal.close()
+
+
+@testing.using_rdkit
+def test_queue_manager_journal(compute_adapter_fixture, tmp_path):
+    """Tests that results which never reached the server are pushed by the next manager"""
+    client, server, adapter = compute_adapter_fixture
+    reset_server_database(server)
+
+    hooh = ptl.data.get_molecule("hooh.json")
+    ret = client.add_compute("rdkit", "UFF", "", "energy", None, [hooh])
+
+    manager = queue.QueueManager(client, adapter, server_error_retries=0, journal_directory=str(tmp_path))
+    manager.update()
+    manager.queue_adapter.await_results()
+
+    # The push fails and the result is dropped by the manager, but kept in the journal
+    client._mock_network_error = True
+    manager.update(new_tasks=False)
+    client._mock_network_error = False
+    assert manager.n_stale_jobs == 1
+    assert manager.journal.pending() == 1
+
+    # Mock a crash of the manager
+    manager.journal.close()
+
+    manager = queue.QueueManager(client, adapter, journal_directory=str(tmp_path))
+    assert len(manager._stale_payload_tracking) == 1
+    manager.update(new_tasks=False)
+
+    assert client.query_results(ret.ids)[0].status == "COMPLETE"
+    assert manager.journal.pending() == 0
+    assert len(list(tmp_path.glob("segment-*"))) == 0
+
+
 @testing.using_rdkit
 def test_queue_manager_server_delay(compute_adapter_fixture):
     """Test to ensure interrupts to the server shutdown correctly"""
@@ -319,6 +582,26 @@ def test_queue_manager_heartbeat(compute_adapter_fixture):
         assert sman[0]["status"] == "INACTIVE"
 
 
+def test_queue_manager_dedicated_executor(compute_adapter_fixture):
+    """Tests that managers are served while every interactive API thread is busy"""
+
+    client, server, adapter = compute_adapter_fixture
+    reset_server_database(server)
+
+    release = threading.Event()
+    busy = [server.storage_executor.submit(release.wait, 30) for _ in range(server.api_workers)]
+    try:
+        start = time.time()
+        manager = queue.QueueManager(client, adapter)
+        assert time.time() - start < 10
+        assert not any(f.done() for f in busy)
+    finally:
+        release.set()
+
+    sman = server.list_managers(name=manager.name())
+    assert sman[0]["status"] == "ACTIVE"
+
+
 def test_manager_max_tasks_limiter(compute_adapter_fixture):
     client, server, adapter = compute_adapter_fixture
 
@@ -2,12 +2,19 @@
 Tests the DQM Server class
 """
 
+import asyncio
+import contextlib
 import json
 import os
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
 
 import pytest
 import requests
+import requests.adapters
+import tornado.locks
 
 import qcfractal.interface as ptl
 from qcfractal import FractalServer, FractalSnowflake, FractalSnowflakeHandler
@@ -20,6 +27,7 @@ from qcfractal.testing import (
     using_rdkit,
     using_torsiondrive,
 )
+from qcfractal.web_handlers import APIHandler
 
 meta_set = {"errors", "n_inserted", "success", "duplicates", "error_description", "validation_errors"}
 
@@ -31,6 +39,7 @@ def test_server_information(test_server):
     server_info = client.server_information()
     assert {"name", "heartbeat_frequency", "counts"} <= server_info.keys()
     assert server_info["counts"].keys() >= {"molecule", "kvstore", "result", "collection"}
+    assert server_info["read_replicas"] == []
 
 
 def test_storage_socket(test_server):
@@ -85,6 +94,87 @@ def test_storage_socket(test_server):
     assert len(r["data"]) == 0
 
 
+def test_run_storage_concurrency_limit():
+
+    # A bare stand-in for a handler, run_storage only needs the storage, executor and limiter
+    handler = SimpleNamespace(
+        storage=SimpleNamespace(workload=lambda name: contextlib.nullcontext()),
+        _storage_workload="interactive",
+        storage_executor=ThreadPoolExecutor(max_workers=8, thread_name_prefix="test_api"),
+        api_limiter=tornado.locks.Semaphore(2),
+    )
+
+    lock = threading.Lock()
+    running = [0]
+    seen = {"max": 0, "threads": set()}
+
+    def storage_call(x):
+        with lock:
+            running[0] += 1
+            seen["max"] = max(seen["max"], running[0])
+            seen["threads"].add(threading.current_thread().name)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return x
+
+    async def run_all():
+        return await asyncio.gather(*[APIHandler.run_storage(handler, storage_call, x) for x in range(10)])
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(run_all()) == list(range(10))
+    finally:
+        loop.close()
+        handler.storage_executor.shutdown()
+
+    # Calls ran off the event loop and never more than the endpoint limit at once
+    assert all(name.startswith("test_api") for name in seen["threads"])
+    assert seen["max"] == 2
+
+
+def test_compressed_request(test_server, monkeypatch):
+
+    client = ptl.FractalClient(test_server, compression="gzip")
+    assert client.compression == "gzip"
+
+    sent = []
+    send = requests.adapters.HTTPAdapter.send
+
+    def record_send(self, request, **kwargs):
+        sent.append((request.path_url, request.headers.get("Content-Encoding"), len(request.body or b"")))
+        return send(self, request, **kwargs)
+
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", record_send)
+
+    # Bodies above the threshold are sent compressed
+    mol = ptl.Molecule(symbols=["He"] * 4000, geometry=[[0, 0, 2 * i] for i in range(4000)])
+    ret = client.add_molecules([mol])
+    assert client.query_molecules(ret)[0].get_hash() == mol.get_hash()
+
+    uploads = [x for x in sent if x[0] == "/molecule" and x[1] is not None]
+    assert len(uploads) == 1
+    assert uploads[0][1] == "gzip"
+    assert uploads[0][2] < len(mol.json())
+
+    # Small bodies are sent as is
+    assert all(x[1] is None for x in sent if x not in uploads)
+
+    addr = test_server.get_address() + "molecule"
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    body = json.dumps({"meta": {}, "data": {"id": ret}}).encode()
+
+    r = requests.get(addr, data=ptl.util.compress_body(body, "gzip"), headers=headers)
+    assert r.status_code == 200, r.reason
+    assert r.json()["data"][0]["id"] == ret[0]
+
+    r = requests.get(addr, data=body, headers={**headers, "Content-Encoding": "br"})
+    assert r.status_code == 415
+
+    r = requests.get(addr, data=b"not gzip", headers=headers)
+    assert r.status_code == 400
+
+
 def test_bad_collection_get(test_server):
     for storage_api_addr in [
         test_server.get_address() + "collection/1234/entry",
@@ -133,6 +223,14 @@ def test_bad_view_endpoints(test_server):
     assert requests.get(addr + "collection/S22").status_code == 404
 
 
+def test_exchange_endpoint_methods(test_server):
+    """ Tests that the exchange endpoint only serves the exchange itself """
+    addr = test_server.get_address() + "queue_manager/exchange"
+
+    assert requests.get(addr, json={"meta": {}, "data": {}}).status_code == 405
+    assert requests.put(addr, json={"meta": {}, "data": {}}).status_code == 405
+
+
 @pytest.mark.slow
 def test_snowflakehandler_restart():
 
@@ -13,6 +13,7 @@ from sqlalchemy.orm import joinedload
 import qcfractal.interface as ptl
 from qcfractal.services.services import TorsionDriveService
 from qcfractal.storage_sockets.models import (
+    AccessLogORM,
     KVStoreORM,
     MoleculeORM,
     OptimizationHistory,
@@ -86,6 +87,23 @@ def test_logs(storage_socket, session):
     session_delete_all(session, KVStoreORM)
 
 
+def test_access_logs_bulk(storage_socket, session):
+
+    assert session.query(AccessLogORM).count() == 0
+
+    logs = [
+        {"access_type": "molecule", "access_method": "GET", "ip_address": f"10.0.0.{i}", "city": None}
+        for i in range(5)
+    ]
+    storage_socket.save_access(logs)
+    storage_socket.save_access({"access_type": "kvstore", "access_method": "GET"})
+
+    assert session.query(AccessLogORM).count() == 6
+    assert session.query(AccessLogORM).filter_by(access_type="molecule").count() == 5
+
+    session_delete_all(session, AccessLogORM)
+
+
 def test_molecule_sql(storage_socket, session):
     """
         Test the use of the ME class MoleculeORM
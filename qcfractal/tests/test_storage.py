@@ -4,16 +4,23 @@ Tests the database wrappers
 All tests should be atomic, that is create and cleanup their data
 """
 
+import logging
+import threading
 from datetime import datetime
 from time import time
 
+import bcrypt
 import numpy as np
 import pytest
 import sqlalchemy
 
 import qcfractal.interface as ptl
 from qcfractal.interface.models.task_models import TaskStatusEnum
+from qcfractal.procedures import get_procedure_parser
+from qcfractal.queue.handlers import QueueManagerHandler
 from qcfractal.services.services import TorsionDriveService
+from qcfractal.storage_sockets.models import KVStoreORM, UserORM
+from qcfractal.storage_sockets.sqlalchemy_socket import SQLAlchemySocket
 from qcfractal.testing import sqlalchemy_socket_fixture as storage_socket
 
 bad_id1 = "99999000"
@@ -25,6 +32,64 @@ def test_storage_repr(storage_socket):
     assert isinstance(repr(storage_socket), str)
 
 
+def test_storage_read_replicas(storage_socket):
+
+    # The primary itself stands in for a replica, with no lag
+    base_uri = storage_socket.uri.rsplit("/", 1)[0]
+    socket = SQLAlchemySocket(
+        base_uri,
+        project=storage_socket._project_name,
+        skip_version_check=True,
+        read_replica_uris=[base_uri, "postgresql://localhost:1"],
+    )
+
+    status = socket.get_replica_status(refresh=True)
+    assert [x["healthy"] for x in status] == [True, False]
+    assert status[0]["lag"] == 0
+    assert status[1]["lag"] is None
+    assert status[1]["error"]
+
+    # Read-only methods go to the healthy replica unless the primary is requested
+    socket._local.read_from = "replica"
+    assert socket._new_session().bind is socket._replicas[0]["engine"]
+    with socket.primary():
+        assert socket._new_session().bind is socket.engine
+    socket._local.read_from = None
+
+    # Everything else stays on the primary
+    assert socket._new_session().bind is socket.engine
+
+    kw = ptl.models.KeywordSet(values={"replica": True})
+    kw_id = socket.add_keywords([kw])["data"][0]
+    assert socket.get_keywords(id=kw_id)["data"][0].id == kw_id
+    assert socket.del_keywords(kw_id) == 1
+
+
+def test_storage_workload_pools(storage_socket):
+
+    assert storage_socket._new_session().bind is storage_socket.engine
+
+    with storage_socket.workload("queue"):
+        session = storage_socket._new_session()
+        assert session.bind is storage_socket._engines["queue"]
+        session.close()
+
+        kw = ptl.models.KeywordSet(values={"pool": "queue"})
+        kw_id = storage_socket.add_keywords([kw])["data"][0]
+
+    with pytest.raises(KeyError):
+        with storage_socket.workload("bad_pool"):
+            pass
+
+    stats = storage_socket.get_pool_statistics()
+    assert {"interactive", "queue", "background"} <= stats.keys()
+    assert stats["queue"]["checkouts"] >= 1
+    assert stats["queue"]["in_use"] == 0
+    assert stats["queue"]["capacity"] == 4
+
+    assert storage_socket.del_keywords(kw_id) == 1
+
+
 def test_molecules_add(storage_socket):
 
     water = ptl.data.get_molecule("water_dimer_minima.psimol")
@@ -209,6 +274,227 @@ def test_keywords_mixed_add_get(storage_socket):
     assert 1 == storage_socket.del_keywords(id=opts[1].id)
 
 
+def test_storage_transaction(storage_socket):
+
+    with storage_socket.transaction():
+        first = storage_socket.add_kvstore(["transaction first"])["data"][0]
+
+        # A failing call is rolled back on its own
+        with pytest.raises(sqlalchemy.exc.ProgrammingError):
+            with storage_socket.session_scope() as session:
+                session.execute("SELECT * FROM no_such_table")
+
+        second = storage_socket.add_kvstore(["transaction second"])["data"][0]
+
+    found = storage_socket.get_kvstore([first, second])["data"]
+    assert found == {first: "transaction first", second: "transaction second"}
+
+    # Everything is rolled back if the block fails
+    with pytest.raises(KeyError):
+        with storage_socket.transaction():
+            rolled_back = storage_socket.add_kvstore(["transaction rolled back"])["data"][0]
+            raise KeyError
+
+    assert storage_socket.get_kvstore([rolled_back])["data"] == {}
+
+
+def test_kvstore_add_bulk(storage_socket):
+
+    blobs = ["kvstore bulk stdout", None, {"error_type": "x", "error_message": "kvstore bulk"}, "kvstore bulk stdout"]
+    ret = storage_socket.add_kvstore(blobs)
+    assert ret["meta"]["n_inserted"] == 2
+    assert ret["data"][1] is None
+
+    # Identical content is stored once
+    ids = [x for x in ret["data"] if x is not None]
+    assert len(set(ids)) == 2
+    assert ret["data"][0] == ret["data"][3]
+
+    found = storage_socket.get_kvstore(ids)["data"]
+    assert [found[x] for x in ids] == [blobs[0], blobs[2], blobs[3]]
+
+    # Re-adding stored content reuses the entry and counts the reference
+    ret2 = storage_socket.add_kvstore([blobs[2], "kvstore bulk " * 1000])
+    assert ret2["meta"]["n_inserted"] == 1
+    assert ret2["data"][0] == ret["data"][2]
+    assert storage_socket.get_kvstore([ret2["data"][1]])["data"][ret2["data"][1]] == "kvstore bulk " * 1000
+
+    with storage_socket.session_scope() as session:
+        refcount = session.query(KVStoreORM.refcount).filter(KVStoreORM.id == int(ret["data"][0])).scalar()
+        assert refcount == 2
+
+    # Wavefunctions with differing fields keep their order as well
+    wfns = [
+        {"basis": {"name": "a"}, "restricted": True},
+        None,
+        {"basis": {"name": "b"}, "restricted": False, "extras": {}},
+        {"basis": {"name": "c"}, "restricted": False},
+    ]
+    ret = storage_socket.add_wavefunction_store(wfns)
+    assert ret["meta"]["n_inserted"] == 3
+    assert ret["data"][1] is None
+
+    found = storage_socket.get_wavefunction_store(id=[ret["data"][0], ret["data"][2], ret["data"][3]])["data"]
+    found = {x["id"]: x for x in found}
+    assert found[ret["data"][0]]["restricted"] is True
+    assert found[ret["data"][2]]["basis"] == {"name": "b"}
+    assert found[ret["data"][3]]["basis"] == {"name": "c"}
+
+
+def test_parse_output_task_errors(storage_socket):
+
+    water = ptl.data.get_molecule("water_dimer_minima.psimol")
+    mol_id = storage_socket.add_molecules([water])["data"][0]
+    record = ptl.models.ResultRecord(molecule=mol_id, method="M1", basis="B1", program="P1", driver="energy")
+    result_id = storage_socket.add_results([record])["data"][0]
+
+    # A missing base result and a malformed output are reported per task without aborting the packet
+    parser = get_procedure_parser("single", storage_socket, logging.getLogger(__name__))
+    completed, errors, _ = parser.parse_output(
+        [
+            {"task_id": "1", "base_result": bad_id1, "result": {}},
+            {"task_id": "2", "base_result": result_id, "result": {}},
+        ]
+    )
+    assert completed == []
+    assert [x[0] for x in errors] == ["1", "2"]
+    assert "not found" in errors[0][1]
+
+    storage_socket.del_results([result_id])
+    storage_socket.del_molecules(id=[mol_id])
+
+
+def test_parse_output_optimization(storage_socket):
+
+    water = ptl.data.get_molecule("water_dimer_minima.psimol")
+    steps = []
+    for _ in range(3):
+        mol = water.copy(deep=True)
+        mol.geometry[:] += np.random.random(mol.geometry.shape)
+        steps.append(mol)
+    mol_id = storage_socket.add_molecules([water])["data"][0]
+
+    record = ptl.models.OptimizationRecord(
+        procedure="optimization",
+        initial_molecule=mol_id,
+        program="geometric",
+        qc_spec={"driver": "gradient", "method": "HF", "basis": "sto-3g", "program": "psi4"},
+    )
+    proc_id = storage_socket.add_procedures([record])["data"][0]
+
+    def step_output(mol):
+        return {
+            "molecule": mol.dict(),
+            "driver": "gradient",
+            "model": {"method": "hf", "basis": "sto-3g"},
+            "extras": {"_qcfractal_tags": {"program": "psi4", "keywords": None}},
+            "return_result": [0.0] * (3 * len(mol.symbols)),
+            "properties": {},
+            "provenance": {"creator": "test"},
+            "stdout": "step stdout",
+            "stderr": None,
+            "error": None,
+            "success": True,
+        }
+
+    def opt_output(initial, trajectory):
+        return {
+            "initial_molecule": initial.dict(),
+            "final_molecule": trajectory[-1].dict(),
+            "trajectory": [step_output(mol) for mol in trajectory],
+            "energies": [float(i) for i in range(len(trajectory))],
+            "provenance": {"creator": "test"},
+            "stdout": "opt stdout",
+            "stderr": None,
+            "error": None,
+        }
+
+    # The second task does not belong to the record, none of its molecules may be written
+    parser = get_procedure_parser("optimization", storage_socket, logging.getLogger(__name__))
+    completed, errors, _ = parser.parse_output(
+        [
+            {"task_id": "1", "base_result": proc_id, "result": opt_output(water, steps[:2])},
+            {"task_id": "2", "base_result": proc_id, "result": opt_output(steps[0], steps[2:])},
+        ]
+    )
+    assert completed == ["1"]
+    assert [x[0] for x in errors] == ["2"]
+    assert "Initial molecule" in errors[0][1]
+    assert storage_socket.get_molecules(molecule_hash=[steps[2].get_hash()])["data"] == []
+
+    proc = storage_socket.get_procedures(id=proc_id)["data"][0]
+    step_ids = storage_socket.add_molecules(steps[:2])["data"]
+    assert proc["final_molecule"] == step_ids[1]
+
+    # Every trajectory result references its own molecule and carries a matching hash index
+    found = {x["id"]: x for x in storage_socket.get_results(id=proc["trajectory"])["data"]}
+    trajectory = [found[x] for x in proc["trajectory"]]
+    assert [x["molecule"] for x in trajectory] == step_ids
+
+    hashes = [ptl.models.ResultRecord(**x).get_hash_index() for x in trajectory]
+    assert len(set(hashes)) == 2
+    for result, hash_index in zip(trajectory, hashes):
+        assert result["hash_index"] in (None, hash_index)
+
+    storage_socket.del_procedures([proc_id])
+    storage_socket.del_results(proc["trajectory"])
+    storage_socket.del_molecules(id=[mol_id] + step_ids)
+
+
+def test_insert_complete_tasks_mixed(storage_socket):
+
+    water = ptl.data.get_molecule("water_dimer_minima.psimol")
+    mol_id = storage_socket.add_molecules([water])["data"][0]
+    records = [
+        ptl.models.ResultRecord(molecule=mol_id, method="M1", basis=basis, program="P1", driver="energy")
+        for basis in ["B1", "B2", "B3"]
+    ]
+    result_ids = storage_socket.add_results(records)["data"]
+
+    tasks = [
+        ptl.models.TaskRecord(
+            spec={"function": "qcengine.compute", "args": [], "kwargs": {}},
+            parser="single",
+            program="p1",
+            base_result=x,
+        )
+        for x in result_ids
+    ]
+    task_ids = [str(x) for x in storage_socket.queue_submit(tasks)["data"]]
+
+    def output(return_result):
+        return {
+            "model": {"method": "m1", "basis": None},
+            "extras": {"_qcfractal_tags": {"program": "p1", "keywords": None}},
+            "return_result": return_result,
+            "properties": {},
+            "provenance": {"creator": "test"},
+            "stdout": "mixed batch stdout",
+            "stderr": None,
+            "error": None,
+            "success": True,
+        }
+
+    # The malformed task is errored on its own, the rest of the batch completes
+    bad_output = output(2.0)
+    del bad_output["extras"]
+    results = {task_ids[0]: output(1.0), task_ids[1]: bad_output, task_ids[2]: output(3.0)}
+
+    ret = QueueManagerHandler.insert_complete_tasks(storage_socket, results, logging.getLogger(__name__))
+    assert ret == (2, 1)
+
+    found = {x["id"]: x for x in storage_socket.get_results(id=result_ids)["data"]}
+    assert [found[x]["status"] for x in result_ids] == ["COMPLETE", "ERROR", "COMPLETE"]
+    assert [found[x]["return_result"] for x in result_ids] == [1.0, None, 3.0]
+    assert found[result_ids[0]]["stdout"] == found[result_ids[2]]["stdout"]
+    assert storage_socket.get_kvstore([found[result_ids[1]]["error"]])["data"]
+
+    assert len(storage_socket.queue_get_by_id(task_ids)) == 1
+    storage_socket.del_tasks(task_ids[1])
+    storage_socket.del_results(result_ids)
+    storage_socket.del_molecules(id=[mol_id])
+
+
 def test_collections_add(storage_socket):
 
     collection = "TorsionDriveRecord"
@@ -393,6 +679,39 @@ def test_dataset_add_delete_cascade(storage_socket):
     storage_socket.del_molecules(mol_insert["data"])
 
 
+def test_collections_include_relations(storage_socket, monkeypatch):
+
+    # Fetch the related rows of each dataset in a separate query
+    monkeypatch.setattr("qcfractal.storage_sockets.sqlalchemy_socket._relation_chunk_size", 1)
+
+    water = ptl.data.get_molecule("water_dimer_minima.psimol")
+    water2 = ptl.data.get_molecule("water_dimer_stretch.psimol")
+    mol_ids = storage_socket.add_molecules([water, water2])["data"]
+
+    names = {"Dataset_A": ["A1"], "Dataset_B": ["B1", "B2"], "Dataset_C": []}
+    for name, entries in names.items():
+        db = {
+            "collection": "dataset",
+            "name": name,
+            "records": [
+                {"name": x, "molecule_id": mol_ids[i], "comment": None, "local_results": {}}
+                for i, x in enumerate(entries)
+            ],
+        }
+        ret = storage_socket.add_collection(db)
+        assert ret["meta"]["n_inserted"] == 1
+
+    ret = storage_socket.get_collections(collection="dataset", include=["name", "records"])
+    assert ret["meta"]["n_found"] == 3
+
+    found = {x["name"]: sorted(r["name"] for r in x["records"]) for x in ret["data"]}
+    assert found == names
+
+    for name in names:
+        assert storage_socket.del_collection(collection="dataset", name=name) == 1
+    storage_socket.del_molecules(mol_ids)
+
+
 def test_results_add(storage_socket):
 
     # Add two waters
@@ -469,6 +788,109 @@ def test_results_add(storage_socket):
     assert ret == 2
 
 
+def test_results_add_bulk(storage_socket):
+
+    water = ptl.data.get_molecule("water_dimer_minima.psimol")
+    water2 = ptl.data.get_molecule("water_dimer_stretch.psimol")
+    mol_ids = storage_socket.add_molecules([water, water2])["data"]
+
+    def record(mol_id, basis):
+        return ptl.models.ResultRecord(molecule=mol_id, method="M1", basis=basis, program="P1", driver="energy")
+
+    # Repeated records within a batch are duplicates of the first, NULL basis included
+    records = [record(mol_ids[0], "B1"), record(mol_ids[1], None), record(mol_ids[0], "B1"), record(mol_ids[1], None)]
+    ret = storage_socket.add_results(records)
+    assert ret["meta"]["n_inserted"] == 2
+    assert ret["data"][0] == ret["data"][2]
+    assert ret["data"][1] == ret["data"][3]
+    assert ret["meta"]["duplicates"] == [ret["data"][0], ret["data"][1]]
+
+    # Existing records keep the order of the request
+    ret2 = storage_socket.add_results([record(mol_ids[1], None), record(mol_ids[1], "B2"), record(mol_ids[0], "B1")])
+    assert ret2["meta"]["n_inserted"] == 1
+    assert ret2["data"][0] == ret["data"][1]
+    assert ret2["data"][2] == ret["data"][0]
+    assert ret2["meta"]["duplicates"] == [ret["data"][1], ret["data"][0]]
+
+    found = storage_socket.get_results(id=ret2["data"])["data"]
+    assert {x["basis"] for x in found} == {None, "b1", "b2"}
+
+    ret = storage_socket.del_results(ret2["data"])
+    assert ret == 3
+    storage_socket.del_molecules(id=mol_ids)
+
+
+def test_results_shared_kvstore(storage_socket):
+
+    water = ptl.data.get_molecule("water_dimer_minima.psimol")
+    mol_id = storage_socket.add_molecules([water])["data"][0]
+
+    # Both results reference the same stored stdout
+    stdout = storage_socket.add_kvstore(["shared stdout", "shared stdout"])["data"]
+    assert stdout[0] == stdout[1]
+
+    records = [
+        ptl.models.ResultRecord(molecule=mol_id, method="M1", basis=basis, program="P1", driver="energy", stdout=x)
+        for basis, x in zip(["B1", "B2"], stdout)
+    ]
+    ids = storage_socket.add_results(records)["data"]
+
+    def refcount(blob_id):
+        with storage_socket.session_scope() as session:
+            return session.query(KVStoreORM.refcount).filter(KVStoreORM.id == int(blob_id)).scalar()
+
+    assert refcount(stdout[0]) == 2
+
+    # Deleting one result keeps the entry of the other
+    assert storage_socket.del_results([ids[0]]) == 1
+    assert refcount(stdout[0]) == 1
+    assert storage_socket.get_kvstore([stdout[0]])["data"][stdout[0]] == "shared stdout"
+    assert storage_socket.get_results(id=ids[1])["data"][0]["stdout"] == stdout[0]
+
+    # Repointing the last reference deletes the entry
+    new_stdout = storage_socket.add_kvstore(["other stdout"])["data"][0]
+    record = ptl.models.ResultRecord(**storage_socket.get_results(id=ids[1])["data"][0])
+    record.__dict__["stdout"] = new_stdout
+    assert storage_socket.update_results([record]) == 1
+    assert refcount(stdout[0]) is None
+    assert refcount(new_stdout) == 1
+
+    assert storage_socket.del_results([ids[1]]) == 1
+    assert refcount(new_stdout) is None
+    storage_socket.del_molecules(id=mol_id)
+
+
+def test_results_update_bulk(storage_socket):
+
+    water = ptl.data.get_molecule("water_dimer_minima.psimol")
+    mol_id = storage_socket.add_molecules([water])["data"][0]
+
+    records = [
+        ptl.models.ResultRecord(molecule=mol_id, method="M1", basis=basis, program="P1", driver="energy")
+        for basis in ["B1", "B2", "B3"]
+    ]
+    ids = storage_socket.add_results(records)["data"]
+
+    records = storage_socket.get_results(id=ids)["data"]
+    records = [ptl.models.ResultRecord(**x) for x in records]
+    records[0].__dict__["status"] = "COMPLETE"
+    records[2].__dict__["return_result"] = 5.0
+
+    # Unchanged records are still counted, records without an id are skipped
+    no_id = ptl.models.ResultRecord(molecule=mol_id, method="M1", basis="B4", program="P1", driver="energy")
+    assert storage_socket.update_results(records + [no_id]) == 3
+
+    found = {x["id"]: x for x in storage_socket.get_results(id=ids)["data"]}
+    assert found[ids[0]]["status"] == "COMPLETE"
+    assert found[ids[1]]["status"] == "INCOMPLETE"
+    assert found[ids[2]]["return_result"] == 5.0
+    assert found[ids[2]]["basis"] == "b3"
+
+    ret = storage_socket.del_results(ids)
+    assert ret == 3
+    storage_socket.del_molecules(id=mol_id)
+
+
 ### Build out a set of query tests
 
 
@@ -700,6 +1122,33 @@ def test_queue_submit_sql(storage_results):
     assert len(ret["meta"]["duplicates"]) == 1
 
 
+def test_queue_submit_bulk(storage_results):
+
+    results = storage_results.get_results()["data"]
+
+    task_template = {
+        "spec": {"function": "qcengine.compute_procedure", "args": [{"json_blob": "data"}], "kwargs": {}},
+        "tag": None,
+        "program": "p1",
+        "parser": "",
+    }
+    tasks = [ptl.models.TaskRecord(**task_template, base_result=x["id"]) for x in results]
+
+    ret = storage_results.queue_submit(tasks[:2])
+    assert ret["meta"]["n_inserted"] == 2
+
+    # Existing and repeated tasks are duplicates, ids stay in the submitted order
+    ret2 = storage_results.queue_submit([tasks[2], tasks[0], tasks[3], tasks[2], tasks[1]])
+    assert ret2["meta"]["n_inserted"] == 2
+    assert ret2["meta"]["duplicates"] == [1, 3, 4]
+    assert ret2["data"][1] == ret["data"][0]
+    assert ret2["data"][4] == ret["data"][1]
+    assert ret2["data"][0] == ret2["data"][3]
+
+    found = storage_results.queue_get_by_id(ret2["data"][:3])
+    assert {x.base_result for x in found} == {results[2]["id"], results[0]["id"], results[3]["id"]}
+
+
 # ----------------------------------------------------------
 
 # Builds tests for the queue - Changed design
@@ -792,6 +1241,40 @@ def test_queue_submit_many_order(storage_results):
     # Todo: test more scenarios
 
 
+def test_queue_get_next_concurrent(storage_results):
+
+    results = storage_results.get_results()["data"]
+
+    task_template = {
+        "spec": {"function": "qcengine.compute_procedure", "args": [{"json_blob": "data"}], "kwargs": {}},
+        "tag": None,
+        "program": "P1",
+        "procedure": "P1",
+        "parser": "",
+    }
+    tasks = [ptl.models.TaskRecord(**task_template, base_result=x["id"]) for x in results]
+    assert storage_results.queue_submit(tasks)["meta"]["n_inserted"] == len(tasks)
+
+    # Managers claiming at the same time never receive the same task
+    barrier = threading.Barrier(3)
+    claimed = []
+
+    def claim(name):
+        storage_results.manager_update(name)
+        barrier.wait()
+        claimed.append(storage_results.queue_get_next(name, ["p1"], ["p1"], limit=2))
+
+    threads = [threading.Thread(target=claim, args=(f"test_manager{i}",)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    ids = [task.id for found in claimed for task in found]
+    assert len(ids) == len(set(ids)) == len(tasks)
+    assert all(task.status == "RUNNING" for found in claimed for task in found)
+
+
 # User testing
 
 
@@ -842,6 +1325,34 @@ def test_modify_user(storage_socket):
     assert storage_socket.remove_user("george") is True
 
 
+def test_user_verification_cache(storage_socket):
+
+    r, pw = storage_socket.add_user("george", "shortpw", permissions=["read", "write"])
+    assert r is True
+
+    def replace_stored_password(password):
+        hashed = bcrypt.hashpw(password.encode("UTF-8"), bcrypt.gensalt(6))
+        with storage_socket.session_scope() as session:
+            session.query(UserORM).filter_by(username="george").update({"password": hashed})
+
+    assert storage_socket.verify_user("george", "shortpw", "write")[0] is True
+
+    # Changing the stored hash behind the cache's back, the old password is still served from the cache
+    replace_stored_password("otherpw")
+    assert storage_socket.verify_user("george", "shortpw", "write")[0] is True
+    assert storage_socket.verify_user("george", "wrongpw", "write")[0] is False
+
+    # Modification invalidates the cached entry, so the stored hash is checked again
+    r, msg = storage_socket.modify_user("george", permissions=["read", "write"])
+    assert r is True
+    assert storage_socket.verify_user("george", "shortpw", "write")[0] is False
+    assert storage_socket.verify_user("george", "otherpw", "write")[0] is True
+
+    # Removal invalidates the cached entry
+    assert storage_socket.remove_user("george") is True
+    assert storage_socket.verify_user("george", "otherpw", "write")[0] is False
+
+
 def test_user_permissions_default(storage_socket):
 
     r, pw = storage_socket.add_user("george", "shortpw")
@@ -1039,9 +1550,21 @@ def test_services_sql(storage_results):
     ret = storage_results.add_services([service])
     assert len(ret["data"]) == 1
 
-    ret = storage_results.get_services(procedure_id=ret["data"][0], status=TaskStatusEnum.waiting)
+    procedure_id = ret["data"][0]
+    ret = storage_results.get_services(procedure_id=procedure_id, status=TaskStatusEnum.waiting)
     assert ret["data"][0]["hash_index"] == service_data["hash_index"]
 
+    # Keyset pagination
+    page = storage_results.get_services(procedure_id=procedure_id, limit=1, cursor="")
+    assert len(page["data"]) == 1
+    page = storage_results.get_services(procedure_id=procedure_id, limit=1, cursor=page["meta"]["cursor"])
+    assert page["data"] == []
+    assert page["meta"]["cursor"] is None
+
+    page = storage_results.get_services(cursor="notacursor")
+    assert page["meta"]["success"] is False
+    assert "notacursor" in page["meta"]["error_description"]
+
     # attributes in extra fields
     assert ret["data"][0]["dihedral_template"] == service_data["dihedral_template"]
 
@@ -1209,6 +1732,68 @@ def test_mol_pagination(storage_socket):
         storage_socket.del_molecules(inserted["data"])
 
 
+def test_mol_pagination_cursor(storage_socket):
+    """
+        Test Molecule keyset pagination
+    """
+
+    assert len(storage_socket.get_molecules()["data"]) == 0
+    mol_names = [
+        "water_dimer_minima.psimol",
+        "water_dimer_stretch.psimol",
+        "water_dimer_stretch2.psimol",
+        "neon_tetramer.psimol",
+    ]
+
+    total = len(mol_names)
+    molecules = [ptl.data.get_molecule(mol_name) for mol_name in mol_names]
+    inserted = storage_socket.add_molecules(molecules)
+
+    try:
+        assert inserted["meta"]["n_inserted"] == total
+
+        found = []
+        cursor = ""
+        for npage in range(total):
+            ret = storage_socket.get_molecules(limit=3, cursor=cursor)
+            assert ret["meta"]["n_found"] == total
+            found.extend(mol.id for mol in ret["data"])
+
+            cursor = ret["meta"]["cursor"]
+            if cursor is None:
+                break
+
+        assert npage == 1
+        assert found == sorted(inserted["data"], key=int)
+
+        # Malformed cursors are reported rather than raised
+        ret = storage_socket.get_molecules(cursor="notacursor")
+        assert ret["meta"]["success"] is False
+        assert "notacursor" in ret["meta"]["error_description"]
+        assert ret["data"] == []
+
+        ret = storage_socket.get_keywords(cursor="notacursor")
+        assert ret["meta"]["success"] is False
+        assert "notacursor" in ret["meta"]["error_description"]
+
+        # Counting modes
+        ret = storage_socket.get_molecules(limit=1, count="none")
+        assert len(ret["data"]) == 1
+        assert ret["meta"]["n_found"] == 1
+
+        ret = storage_socket.get_molecules(limit=1, count="estimate")
+        assert len(ret["data"]) == 1
+        assert ret["meta"]["n_found"] >= 0
+
+        ret = storage_socket.get_molecules(count="sometimes")
+        assert ret["meta"]["success"] is False
+        assert "sometimes" in ret["meta"]["error_description"]
+
+    finally:
+        # cleanup
+        storage_socket.del_molecules(inserted["data"])
+
+
 def test_mol_formula(storage_socket):
     """
         Test Molecule pagination
@@ -1287,6 +1872,73 @@ def test_server_log(storage_results):
     assert ret["data"][0]["timestamp"] > now
 
 
+def test_server_log_result_states(storage_socket):
+    def result_states():
+        ret = storage_socket.custom_query("database_stats", "result_states")
+        assert ret["meta"]["success"], ret["meta"]["error_description"]
+        return ret["data"].get("result", {})
+
+    water = ptl.data.get_molecule("water_dimer_minima.psimol")
+    mol_id = storage_socket.add_molecules([water])["data"][0]
+
+    records = [
+        ptl.models.ResultRecord(molecule=mol_id, method="M1", basis=basis, program="P1", driver="energy")
+        for basis in ["B1", "B2", "B3"]
+    ]
+    ids = storage_socket.add_results(records)["data"]
+    assert result_states() == {"INCOMPLETE": 3}
+
+    records = [ptl.models.ResultRecord(**x) for x in storage_socket.get_results(id=ids[:2])["data"]]
+    for record in records:
+        record.__dict__["status"] = "COMPLETE"
+    storage_socket.update_results(records)
+    assert result_states() == {"INCOMPLETE": 1, "COMPLETE": 2}
+
+    # Estimated table counts, exact result counts
+    ret = storage_socket.log_server_stats()
+    assert ret["result_states"]["result"] == {"INCOMPLETE": 1, "COMPLETE": 2}
+    assert ret["result_count"] == 3
+
+    ret = storage_socket.log_server_stats(count="exact")
+    assert ret["molecule_count"] == 1
+
+    with pytest.raises(ValueError):
+        storage_socket.log_server_stats(count="bad")
+
+    storage_socket.del_results(ids)
+    assert result_states() == {}
+
+    storage_socket.del_molecules(id=mol_id)
+
+
+def test_custom_query_concurrent(storage_socket):
+
+    water = ptl.data.get_molecule("water_dimer_minima.psimol")
+    mol_id = storage_socket.add_molecules([water])["data"][0]
+
+    # Custom queries running on the storage executor must not share a session
+    barrier = threading.Barrier(8)
+    found = []
+
+    def query(table_name):
+        barrier.wait()
+        for _ in range(10):
+            ret = storage_socket.custom_query("database_stats", "table_count", table_name=table_name)
+            assert ret["meta"]["success"], ret["meta"]["error_description"]
+            found.append((table_name, ret["data"][0]))
+
+    threads = [threading.Thread(target=query, args=(["molecule", "task_queue"][i % 2],)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(found) == 80
+    assert set(found) == {("molecule", 1), ("task_queue", 0)}
+
+    storage_socket.del_molecules(id=mol_id)
+
+
 def test_collections_include_exclude(storage_socket):
 
     collection = "Dataset"
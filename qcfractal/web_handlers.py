@@ -1,13 +1,16 @@
 """
 Web handlers for the FractalServer.
 """
+import functools
 import json
 
+import tornado.ioloop
 import tornado.web
 from pydantic import ValidationError
 from qcelemental.util import deserialize, serialize
 
 from .interface.models.rest_models import rest_model
+from .interface.util import body_encodings, decompress_body
 from .storage_sockets.storage_utils import add_metadata_template
 
 _valid_encodings = {
@@ -16,6 +19,9 @@ _valid_encodings = {
     "application/msgpack-ext": "msgpack-ext",
 }
 
+# Guards against decompression bombs, compressed bodies are bounded by the HTTP server limits
+_max_decompressed_size = 2 ** 30
+
 
 class APIHandler(tornado.web.RequestHandler):
     """
@@ -26,6 +32,9 @@ class APIHandler(tornado.web.RequestHandler):
     _required_auth = "admin"
     _logging_param_counts = {}
 
+    # The database connection pool used by the storage calls of the handler
+    _storage_workload = "interactive"
+
     def initialize(self, **objects):
         """
         Initializes the request to JSON, adds objects, and logging.
@@ -51,15 +60,42 @@ class APIHandler(tornado.web.RequestHandler):
         self.view_handler = objects["view_handler"]
         self.username = None
 
-    def prepare(self):
+        # Storage calls are offloaded to a bounded executor, optionally limited per endpoint.
+        # Queue manager traffic has its own executor so it never waits behind interactive queries.
+        if self._storage_workload == "queue":
+            self.storage_executor = objects.get("queue_executor", None)
+        else:
+            self.storage_executor = objects.get("storage_executor", None)
+        self.endpoint = self.request.path.strip("/").split("/")[0]
+        self.api_limiter = objects.get("api_limits", {}).get(self.endpoint, None)
+
+    async def prepare(self):
         if self._required_auth:
-            self.authenticate(self._required_auth)
+            await self.authenticate(self._required_auth)
+
+        blob = self.request.body
+        content_encoding = self.request.headers.get("Content-Encoding", "identity").strip().lower()
+        if blob and content_encoding != "identity":
+            if content_encoding not in body_encodings():
+                raise tornado.web.HTTPError(
+                    status_code=415, reason=f"Did not understand 'Content-Encoding': {content_encoding}"
+                )
+
+            # Large bodies take a while to decompress, keep the IOLoop free meanwhile
+            decompress = functools.partial(decompress_body, blob, content_encoding, max_size=_max_decompressed_size)
+            try:
+                if self.storage_executor is None:
+                    blob = decompress()
+                else:
+                    blob = await tornado.ioloop.IOLoop.current().run_in_executor(self.storage_executor, decompress)
+            except ValueError as exc:
+                raise tornado.web.HTTPError(status_code=413, reason=str(exc))
+            except Exception:
+                raise tornado.web.HTTPError(status_code=400, reason="Could not decompress body.")
 
         try:
-            if (self.encoding == "json") and isinstance(self.request.body, bytes):
-                blob = self.request.body.decode()
-            else:
-                blob = self.request.body
+            if (self.encoding == "json") and isinstance(blob, bytes):
+                blob = blob.decode()
 
             if blob:
                 self.data = deserialize(blob, self.encoding)
@@ -84,12 +120,46 @@ class APIHandler(tornado.web.RequestHandler):
 
             extra_params = json.dumps(extra_params)
 
-            log = self.api_logger.get_api_access_log(request=self.request, extra_params=extra_params)
-            self.storage.save_access(log)
+            # Queued and written in bulk by the access logger, never blocks the request
+            self.api_logger.log_access(request=self.request, extra_params=extra_params)
 
         # self.logger.info('Done saving API access to the database')
 
-    def authenticate(self, permission):
+    async def run_storage(self, func, *args, **kwargs):
+        """Runs a blocking storage call on the storage executor and awaits the result.
+
+        If the endpoint has a concurrency limit, the call will wait for a free slot before
+        being handed to the executor. Without an executor the call is run in place.
+
+        Parameters
+        ----------
+        func : callable
+            The storage function to call
+        *args
+            Arguments to call the function with.
+        **kwargs
+            Kwargs to call the function with.
+
+        """
+
+        call = functools.partial(func, *args, **kwargs)
+
+        # Connections are drawn from the pool of the handler's workload
+        def run():
+            with self.storage.workload(self._storage_workload):
+                return call()
+
+        if self.storage_executor is None:
+            return run()
+
+        loop = tornado.ioloop.IOLoop.current()
+        if self.api_limiter is None:
+            return await loop.run_in_executor(self.storage_executor, run)
+
+        async with self.api_limiter:
+            return await loop.run_in_executor(self.storage_executor, run)
+
+    async def authenticate(self, permission):
         """Authenticates request with a given permission setting.
 
         Parameters
@@ -109,7 +179,7 @@ class APIHandler(tornado.web.RequestHandler):
 
         self.username = username
 
-        verified, msg = self.objects["storage_socket"].verify_user(username, password, permission)
+        verified, msg = await self.run_storage(self.storage.verify_user, username, password, permission)
         if verified is False:
             raise tornado.web.HTTPError(status_code=401, reason=msg)
 
@@ -152,7 +222,7 @@ class KVStoreHandler(APIHandler):
     _required_auth = "read"
     _logging_param_counts = {"id"}
 
-    def get(self):
+    async def get(self):
         """
 
         Experimental documentation, need to find a decent format.
@@ -174,7 +244,7 @@ class KVStoreHandler(APIHandler):
         body_model, response_model = rest_model("kvstore", "get")
         body = self.parse_bodymodel(body_model)
 
-        ret = self.storage.get_kvstore(body.data.id)
+        ret = await self.run_storage(self.storage.get_kvstore, body.data.id)
         ret = response_model(**ret)
 
         self.logger.info("GET: KVStore - {} pulls.".format(len(ret.data)))
@@ -189,12 +259,12 @@ class WavefunctionStoreHandler(APIHandler):
     _required_auth = "read"
     _logging_param_counts = {"id"}
 
-    def get(self):
+    async def get(self):
 
         body_model, response_model = rest_model("wavefunctionstore", "get")
         body = self.parse_bodymodel(body_model)
 
-        ret = self.storage.get_wavefunction_store(body.data.id, include=body.meta.include)
+        ret = await self.run_storage(self.storage.get_wavefunction_store, body.data.id, include=body.meta.include)
         if len(ret["data"]):
             ret["data"] = ret["data"][0]
         ret = response_model(**ret)
@@ -211,7 +281,7 @@ class MoleculeHandler(APIHandler):
     _required_auth = "read"
     _logging_param_counts = {"id"}
 
-    def get(self):
+    async def get(self):
         """
 
         Experimental documentation, need to find a decent format.
@@ -235,13 +305,13 @@ class MoleculeHandler(APIHandler):
         body_model, response_model = rest_model("molecule", "get")
         body = self.parse_bodymodel(body_model)
 
-        molecules = self.storage.get_molecules(**{**body.data.dict(), **body.meta.dict()})
+        molecules = await self.run_storage(self.storage.get_molecules, **{**body.data.dict(), **body.meta.dict()})
         ret = response_model(**molecules)
 
         self.logger.info("GET: Molecule - {} pulls.".format(len(ret.data)))
         self.write(ret)
 
-    def post(self):
+    async def post(self):
         """
             Experimental documentation, need to find a decent format.
 
@@ -260,12 +330,12 @@ class MoleculeHandler(APIHandler):
             "data" - A dictionary of {key : id} results
         """
 
-        self.authenticate("write")
+        await self.authenticate("write")
 
         body_model, response_model = rest_model("molecule", "post")
         body = self.parse_bodymodel(body_model)
 
-        ret = self.storage.add_molecules(body.data)
+        ret = await self.run_storage(self.storage.add_molecules, body.data)
         response = response_model(**ret)
 
         self.logger.info("POST: Molecule - {} inserted.".format(response.meta.n_inserted))
@@ -280,24 +350,26 @@ class KeywordHandler(APIHandler):
     _required_auth = "read"
     _logging_param_counts = {"id"}
 
-    def get(self):
+    async def get(self):
 
         body_model, response_model = rest_model("keyword", "get")
         body = self.parse_bodymodel(body_model)
 
-        ret = self.storage.get_keywords(**{**body.data.dict(), **body.meta.dict()}, with_ids=False)
+        ret = await self.run_storage(
+            self.storage.get_keywords, **{**body.data.dict(), **body.meta.dict()}, with_ids=False
+        )
         response = response_model(**ret)
 
         self.logger.info("GET: Keywords - {} pulls.".format(len(response.data)))
         self.write(response)
 
-    def post(self):
-        self.authenticate("write")
+    async def post(self):
+        await self.authenticate("write")
 
         body_model, response_model = rest_model("keyword", "post")
         body = self.parse_bodymodel(body_model)
 
-        ret = self.storage.add_keywords(body.data)
+        ret = await self.run_storage(self.storage.add_keywords, body.data)
         response = response_model(**ret)
 
         self.logger.info("POST: Keywords - {} inserted.".format(response.meta.n_inserted))
@@ -311,15 +383,15 @@ class CollectionHandler(APIHandler):
 
     _required_auth = "read"
 
-    def get(self, collection_id=None, view_function=None):
+    async def get(self, collection_id=None, view_function=None):
 
         # List collections
         if (collection_id is None) and (view_function is None):
             body_model, response_model = rest_model("collection", "get")
             body = self.parse_bodymodel(body_model)
 
-            cols = self.storage.get_collections(
-                **body.data.dict(), include=body.meta.include, exclude=body.meta.exclude
+            cols = await self.run_storage(
+                self.storage.get_collections, **body.data.dict(), include=body.meta.include, exclude=body.meta.exclude
             )
             response = response_model(**cols)
 
@@ -332,8 +404,12 @@ class CollectionHandler(APIHandler):
             body_model, response_model = rest_model("collection", "get")
 
             body = self.parse_bodymodel(body_model)
-            cols = self.storage.get_collections(
-                **body.data.dict(), col_id=int(collection_id), include=body.meta.include, exclude=body.meta.exclude
+            cols = await self.run_storage(
+                self.storage.get_collections,
+                **body.data.dict(),
+                col_id=int(collection_id),
+                include=body.meta.include,
+                exclude=body.meta.exclude,
             )
             response = response_model(**cols)
 
@@ -356,7 +432,9 @@ class CollectionHandler(APIHandler):
                 self.logger.info("GET: Collections - view request made, but server does not have a view_handler.")
                 return
 
-            result = self.view_handler.handle_request(collection_id, view_function, body.data.dict())
+            result = await self.run_storage(
+                self.view_handler.handle_request, collection_id, view_function, body.data.dict()
+            )
             response = response_model(**result)
 
             self.logger.info(f"GET: Collections - {collection_id} view {view_function} pulls.")
@@ -375,8 +453,8 @@ class CollectionHandler(APIHandler):
             )
             return
 
-    def post(self, collection_id=None, view_function=None):
-        self.authenticate("write")
+    async def post(self, collection_id=None, view_function=None):
+        await self.authenticate("write")
 
         body_model, response_model = rest_model("collection", "post")
         body = self.parse_bodymodel(body_model)
@@ -390,17 +468,17 @@ class CollectionHandler(APIHandler):
             self.logger.info("POST: Collections - Access attempted on subresource.")
             return
 
-        ret = self.storage.add_collection(body.data.dict(), overwrite=body.meta.overwrite)
+        ret = await self.run_storage(self.storage.add_collection, body.data.dict(), overwrite=body.meta.overwrite)
         response = response_model(**ret)
 
         self.logger.info("POST: Collections - {} inserted.".format(response.meta.n_inserted))
         self.write(response)
 
-    def delete(self, collection_id, _):
-        self.authenticate("write")
+    async def delete(self, collection_id, _):
+        await self.authenticate("write")
 
         body_model, response_model = rest_model(f"collection/{collection_id}", "delete")
-        ret = self.storage.del_collection(col_id=collection_id)
+        ret = await self.run_storage(self.storage.del_collection, col_id=collection_id)
         if ret == 0:
             self.logger.info(f"DELETE: Collections - Attempted to delete non-existent collection {collection_id}.")
             raise tornado.web.HTTPError(status_code=404, reason=f"Collection {collection_id} does not exist.")
@@ -417,12 +495,12 @@ class ResultHandler(APIHandler):
     _required_auth = "read"
     _logging_param_counts = {"id", "molecule"}
 
-    def get(self):
+    async def get(self):
 
         body_model, response_model = rest_model("result", "get")
         body = self.parse_bodymodel(body_model)
 
-        ret = self.storage.get_results(**{**body.data.dict(), **body.meta.dict()})
+        ret = await self.run_storage(self.storage.get_results, **{**body.data.dict(), **body.meta.dict()})
         result = response_model(**ret)
 
         self.logger.info("GET: Results - {} pulls.".format(len(result.data)))
@@ -437,16 +515,18 @@ class ProcedureHandler(APIHandler):
     _required_auth = "read"
     _logging_param_counts = {"id"}
 
-    def get(self, query_type="get"):
+    async def get(self, query_type="get"):
 
         body_model, response_model = rest_model("procedure", query_type)
         body = self.parse_bodymodel(body_model)
 
         try:
             if query_type == "get":
-                ret = self.storage.get_procedures(**{**body.data.dict(), **body.meta.dict()})
+                ret = await self.run_storage(self.storage.get_procedures, **{**body.data.dict(), **body.meta.dict()})
             else:  # all other queries, like 'best_opt_results'
-                ret = self.storage.custom_query("procedure", query_type, **{**body.data.dict(), **body.meta.dict()})
+                ret = await self.run_storage(
+                    self.storage.custom_query, "procedure", query_type, **{**body.data.dict(), **body.meta.dict()}
+                )
         except KeyError as e:
             raise tornado.web.HTTPError(status_code=401, reason=str(e))
 
@@ -464,16 +544,18 @@ class OptimizationHandler(APIHandler):
     _required_auth = "read"
     _logging_param_counts = {"id"}
 
-    def get(self, query_type="get"):
+    async def get(self, query_type="get"):
 
         body_model, response_model = rest_model(f"optimization/{query_type}", "get")
         body = self.parse_bodymodel(body_model)
 
         try:
             if query_type == "get":
-                ret = self.storage.get_procedures(**{**body.data.dict(), **body.meta.dict()})
+                ret = await self.run_storage(self.storage.get_procedures, **{**body.data.dict(), **body.meta.dict()})
             else:  # all other queries, like 'best_opt_results'
-                ret = self.storage.custom_query("optimization", query_type, **{**body.data.dict(), **body.meta.dict()})
+                ret = await self.run_storage(
+                    self.storage.custom_query, "optimization", query_type, **{**body.data.dict(), **body.meta.dict()}
+                )
         except KeyError as e:
             raise tornado.web.HTTPError(status_code=401, reason=str(e))
 